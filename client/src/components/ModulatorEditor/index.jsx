@@ -12,6 +12,7 @@ const DEFAULT_EFFECT = {
   chorus: 0.0,
   delay: 0.0,
   reverb: 0.0,
+  reverb_size: 0.0,
   ring_mod: 0.0,
   bitcrusher: 0.0,
   low_pass: 0.0,
@@ -28,6 +29,7 @@ const PARAMS = [
   { key: "chorus", label: "Chorus", min: 0, max: 1, step: 0.01 },
   { key: "delay", label: "Delay (ms)", min: 0, max: 500, step: 1 },
   { key: "reverb", label: "Reverb", min: 0, max: 1, step: 0.01 },
+  { key: "reverb_size", label: "Reverb Size", min: 0, max: 1, step: 0.01 },
   { key: "ring_mod", label: "Ring Mod (Hz)", min: 0, max: 2000, step: 1 },
   { key: "bitcrusher", label: "Bitcrusher", min: 0, max: 1, step: 0.01 },
   { key: "low_pass", label: "Low Pass (Hz)", min: 0, max: 20000, step: 10 },
@@ -76,6 +78,7 @@ export default function EffectEditor() {
         chorus: 0,
         delay: 0,
         reverb: 0,
+        reverb_size: 0,
         ring_mod: 0,
         bitcrusher: 0,
         low_pass: 0,
@@ -1,89 +1,122 @@
 import os
-import subprocess
-import json
-import socket
+import itertools
 import time
 import threading
+import weakref
+from .loudness import LoudnessIndex
+from .mpv import MpvClient, MpvPool
+from .pcm_cache import PcmCache
+from .sampler import Sampler, output_devices
+from .scheduler import Scheduler
+from .supervisor import Supervisor, remove_stale_sockets
 from .state import state
+from .utils import list_audio_files
 
 BASE_DIR = os.path.dirname(os.path.dirname(__file__))
 DATA_DIR = os.path.join(BASE_DIR, "data")
 MIX = os.environ.get("MIX_SINK_NAME", "mixout")
 
-CROSSFADE_STEPS = 20
-VOLUME_FADE_STEPS = 20
 VOLUME_FADE_SECONDS = 3
 
 SUPPORTED_EXT = (".mp3", ".wav", ".flac", ".ogg")
 
+# FX engine: "sampler" mixes decoded clips in-process (mpv when it cannot start), or "mpv"
+FX_ENGINE = os.environ.get("FX_ENGINE", "sampler")
+FX_POLYPHONY = int(os.environ.get("FX_POLYPHONY", 16))
+FX_DEVICE = os.environ.get("FX_DEVICE") or None  # PortAudio device; default: the mix sink
+FX_STATE_SECONDS = 0.05  # state["fx"]["voices"] refresh while voices play
+
+# Decoded PCM (float32, memory-mapped) for the sampler, under a disk budget
+PCM_CACHE_DIR = os.environ.get("PCM_CACHE_DIR") or os.path.join(DATA_DIR, ".pcm")
+PCM_CACHE_MB = int(os.environ.get("PCM_CACHE_MB", 2048))
+
+# Loudness normalization: channels whose tracks start at a measured gain towards LOUDNESS_TARGET (LUFS)
+LOUDNESS_CHANNELS = [c.strip() for c in os.environ.get("LOUDNESS_CHANNELS", "music,ambient").split(",") if c.strip()]
+GAIN_FILTER = "gain"  # label of the volume filter that applies a track's loudness correction
+LOUDNESS_TARGET = float(os.environ.get("LOUDNESS_TARGET", -18))
+LOUDNESS_WORKERS = int(os.environ.get("LOUDNESS_WORKERS", 0)) or None  # default: all cores
+
+# mpv processes playing at once per channel; one more stops the oldest
+MAX_PROCESSES = int(os.environ.get("MPV_MAX_PROCESSES", 6))
+SOCK_PATTERN = "/tmp/mpv_*.sock"
+
+# Idle mpv instances kept ready per channel (0 disables the pool for that channel)
+MAX_POOL_SIZE = 8
+POOL_SIZES = {
+    "music": min(MAX_POOL_SIZE, int(os.environ.get("MPV_POOL_SIZE", 1))),
+    "ambient": min(MAX_POOL_SIZE, int(os.environ.get("MPV_POOL_SIZE", 1))),
+    "fx": min(MAX_POOL_SIZE, int(os.environ.get("MPV_FX_POOL_SIZE", 3))),
+}
+# A transition timer that fires this early (pause, seek, slow start) re-arms instead
+TRANSITION_SLACK_SECONDS = 0.05
+# How long before a loop transition the next entry is opened (0 disables prefetch)
+PREFETCH_SECONDS = float(os.environ.get("MPV_PREFETCH_SECONDS", 5))
+
 # -------------------------
 # Runtime-only player registry
 # -------------------------
+# "ipc" is the player's persistent MpvClient; every thread shares it.
+# "next" is the prefetched loop entry: {"index", "track", "proc", "ipc"}, with
+# proc/ipc None when it is queued in the current player's own playlist (it
+# carries its own loudness gain, see _load()). "prefetch_failed" is
+# the MpvClient whose prefetch could not start a player: it is not retried, and
+# that player's transition starts the next entry the plain way.
 _PLAYERS = {
     "music": {
         "proc": None,
         "sock": None,
+        "ipc": None,
+        "timer": None,
+        "next": None,
+        "prefetch_failed": None,
         "loop_stop": threading.Event()
     },
     "ambient": {
         "proc": None,
         "sock": None,
+        "ipc": None,
+        "timer": None,
+        "next": None,
+        "prefetch_failed": None,
         "loop_stop": threading.Event()
     },
     "fx": {
         "proc": None,
-        "sock": None
+        "sock": None,
+        "ipc": None
     },  # FX are fire-and-forget
 }
+_supervisor = Supervisor({key: MAX_PROCESSES for key in ("music", "ambient", "fx")})
+_POOLS = {}  # key -> MpvPool, once start_pools() ran
+_sampler = None  # FX Sampler, once start_fx_sampler() ran
+_pcm_cache = None
+_loudness = None  # LoudnessIndex, once start_loudness() ran
+_fx_wake = threading.Event()
+_sock_ids = itertools.count()
+# Fades, crossfades and loop transitions; volume ramps are keyed by the player's MpvClient
+_scheduler = Scheduler()
+_volumes = weakref.WeakKeyDictionary()  # MpvClient -> volume last sent to it
+_timer_lock = threading.Lock()  # player["timer"] swaps
+_advance_lock = threading.Lock()  # one loop transition at a time
 
 # -------------------------
 # IPC helpers
 # -------------------------
-def _send_mpv(sock, cmd):
-    if not sock or not os.path.exists(sock):
-        return
-    try:
-        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
-            s.connect(sock)
-            s.sendall(json.dumps(cmd).encode() + b"\n")
-    except Exception:
-        pass
-
-def _get_prop(sock, prop):
-    try:
-        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
-            s.connect(sock)
-            s.sendall(json.dumps({"command": ["get_property", prop]}).encode() + b"\n")
-            return json.loads(s.recv(4096).decode()).get("data")
-    except Exception:
-        return None
-    
-def _fade_volume(sock, vol, fade_duration):
-    if not sock or not os.path.exists(sock):
-        return
-
+def _fade_volume(ipc, vol, fade_duration, done=None):
+    """Ramp the player's volume to vol from where it stands, replacing any ramp it has; then done()"""
     target_vol = max(0, min(100, float(vol)))
-    start_vol = _get_prop(sock, "volume")
+    start_vol = _volumes.get(ipc, target_vol)
 
-    if start_vol is None:
-        start_vol = target_vol
+    def step(value):
+        if not ipc.closed:
+            _set_volume(ipc, value)
 
-    step_delay = fade_duration / VOLUME_FADE_STEPS
-
-    for i in range(VOLUME_FADE_STEPS):
-        if not os.path.exists(sock):
-            return
+    _scheduler.ramp(ipc, step, start_vol, target_vol, fade_duration, done)
 
-        t = (i + 1) / VOLUME_FADE_STEPS
-        next_vol = start_vol + (target_vol - start_vol) * t
-
-        _set_volume(sock, next_vol)
-        time.sleep(step_delay)
-    
-
-def _set_volume(sock, vol):
+def _set_volume(ipc, vol):
     vol = max(0, min(100, float(vol)))
-    _send_mpv(sock, {"command": ["set_property", "volume", vol]})
+    _volumes[ipc] = vol
+    ipc.set("volume", vol)
 
 def _proc_alive(proc):
     return proc and proc.poll() is None
@@ -91,54 +124,291 @@ def _proc_alive(proc):
 # -------------------------
 # Spawn mpv
 # -------------------------
-def _spawn(track, sock, loop=False, volume=100):
+def _sock_path(key):
+    return f"/tmp/mpv_{key}_{int(time.time()*1000)}_{next(_sock_ids)}.sock"
+
+def _spawn(key, track, sock, loop=False, volume=100, paused=False, gain_db=0.0):
+    """Start mpv on track (None: idle until a loadfile, then quit after that playlist) and connect to it"""
     cmd = [
-        "mpv", track,
+        "mpv", track or "--idle=once",
         "--no-video",
         f"--audio-device=pulse/{MIX}",
         f"--input-ipc-server={sock}",
         f"--volume={volume}",
+        # open an appended loop entry while the current one still plays
+        "--prefetch-playlist=yes",
     ]
+    if key in LOUDNESS_CHANNELS:
+        # Loudness normalization (--volume-gain would need mpv 0.36)
+        cmd.append(f"--af={_gain_filter(gain_db)}")
     if loop:
         cmd.append("--loop")
+    if paused:
+        cmd.append("--pause")
 
-    proc = subprocess.Popen(cmd)
+    proc = _supervisor.spawn(key, cmd, sock, idle=track is None)
 
+    ipc = MpvClient(sock)
+    _volumes[ipc] = volume
     for _ in range(40):
-        if os.path.exists(sock):
-            return proc
+        if os.path.exists(sock) and ipc.connect():
+            return proc, ipc
         time.sleep(0.05)
 
-    proc.terminate()
+    _supervisor.stop(proc)
     raise RuntimeError("mpv IPC socket not created")
 
+def _gain_filter(gain_db):
+    return f"@{GAIN_FILTER}:volume=volume={gain_db}dB"
+
+def _load(key, ipc, track, flags):
+    """loadfile track on ipc (flags: replace/append) with its loudness gain as a per-file filter
+
+    Set with the entry itself, so it applies from the entry's first sample;
+    an idle player has no filter chain to retune, and an appended entry
+    starts before its end-file event arrives. Named arguments, since mpv
+    0.38 put an index before the positional options.
+    """
+    if key not in LOUDNESS_CHANNELS:
+        ipc.send("loadfile", track, flags)
+        return
+    ipc.send_named("loadfile", url=track, flags=flags, options=f"af={_gain_filter(_track_gain(key, track))}")
+
 # -------------------------
-# Crossfade
+# Warm pool
 # -------------------------
-def _crossfade(old_proc, old_sock, new_sock, target_vol, seconds, fade_out_old=True):
-    if seconds <= 0:
-        if old_proc and _proc_alive(old_proc):
-            old_proc.terminate()
-        if new_sock:
-            _set_volume(new_sock, target_vol)
+def start_pools():
+    """Keep POOL_SIZES idle players per channel so play() only needs a loadfile"""
+    for key, size in POOL_SIZES.items():
+        if key == "fx" and _sampler is not None:
+            continue  # FX play in the sampler
+        if size and key not in _POOLS:
+            pool = MpvPool(
+                lambda key=key: _spawn(key, None, _sock_path(key), volume=0), size,
+                name=f"mpv-pool {key}", stop=_stop_player,
+            )
+            _POOLS[key] = pool
+            pool.start()
+
+def close_pools():
+    for key in list(_POOLS):
+        _POOLS.pop(key).close()
+
+def clean_sockets():
+    """Remove IPC sockets left behind by mpv processes of earlier runs"""
+    return remove_stale_sockets(SOCK_PATTERN)
+
+def close_players():
+    """Stop every mpv child (server shutdown)"""
+    close_pools()
+    _supervisor.close()
+
+def get_process_stats():
+    return _supervisor.stats()
+
+def get_pool_stats():
+    return {
+        key: {"size": pool.size, "ready": pool.ready, "hits": pool.hits, "misses": pool.misses}
+        for key, pool in _POOLS.items()
+    }
+
+# -------------------------
+# Loudness normalization
+# -------------------------
+def start_loudness():
+    """Measure the library in the background (new and changed files only) and keep it up to date"""
+    global _loudness
+    if not LOUDNESS_CHANNELS or _loudness is not None:
         return
+    _loudness = LoudnessIndex(DATA_DIR, target=LOUDNESS_TARGET, workers=LOUDNESS_WORKERS)
+    _loudness.start()
+
+def close_loudness():
+    global _loudness
+    index, _loudness = _loudness, None
+    if index is not None:
+        index.close()
 
-    step_delay = seconds / CROSSFADE_STEPS
-    start_old = _get_prop(old_sock, "volume") or target_vol
+def scan_loudness():
+    if _loudness is not None:
+        _loudness.scan()
 
-    for i in range(CROSSFADE_STEPS):
-        t = (i + 1) / CROSSFADE_STEPS
+def get_loudness_stats():
+    if _loudness is None:
+        return None
+    stats = _loudness.stats()
+    stats["channels"] = LOUDNESS_CHANNELS
+    return stats
+
+def _track_gain(key, full):
+    """dB that bring full to the target loudness on key (0 while unmeasured or not normalized)"""
+    if _loudness is None or key not in LOUDNESS_CHANNELS:
+        return 0.0
+    return _loudness.gain_db(full)
+
+# -------------------------
+# FX sampler
+# -------------------------
+def _fx_device():
+    """(PortAudio device, PULSE_SINK) for FX: FX_DEVICE, a device named after the mix sink, or PulseAudio's ALSA plugin"""
+    if FX_DEVICE:
+        return FX_DEVICE, None
+    devices = output_devices()
+    for index, name in devices:
+        if MIX in name:
+            return index, None
+    for index, name in devices:
+        if name == "pulse":
+            return index, MIX  # the plugin picks its sink from PULSE_SINK when the stream opens
+    return None, None
+
+def start_fx_sampler():
+    """Open the FX output stream; FX stay on mpv if it fails"""
+    global _sampler
+    if FX_ENGINE != "sampler" or _sampler is not None:
+        return
+    sampler = Sampler(polyphony=FX_POLYPHONY, cache=_get_pcm_cache())
+    device, sink = _fx_device()
+    previous = os.environ.get("PULSE_SINK")
+    try:
+        if sink:
+            os.environ["PULSE_SINK"] = sink
+        sampler.start(device)
+    except Exception as e:
+        print(f"⚠️ FX sampler unavailable ({e}), FX play through mpv")
+        return
+    finally:
+        if sink:
+            if previous is None:
+                os.environ.pop("PULSE_SINK", None)
+            else:
+                os.environ["PULSE_SINK"] = previous
+    sampler.volume = state["fx"].get("volume", 100) / 100
+    _sampler = sampler
+    state["fx"]["voices"] = []
+    threading.Thread(target=_publish_fx, name="fx-state", daemon=True).start()
+
+def warm_pcm_cache():
+    """Decode data/fx into the PCM cache in the background, whichever engine plays FX"""
+    fx_dir = os.path.join(DATA_DIR, "fx")
+    paths = [os.path.join(fx_dir, rel) for rel in list_audio_files(fx_dir)]
+
+    def warm():
+        _get_pcm_cache().warm(paths)
+        sampler = _sampler
+        if sampler is not None:
+            sampler.preload(paths)  # only maps and faults in the clips decoded above
+
+    threading.Thread(target=warm, name="pcm-warm", daemon=True).start()
+
+def _get_pcm_cache():
+    global _pcm_cache
+    if _pcm_cache is None:
+        _pcm_cache = PcmCache(PCM_CACHE_DIR, PCM_CACHE_MB * 1024 * 1024)
+    return _pcm_cache
+
+def get_pcm_cache_stats():
+    if _pcm_cache is None:
+        return None
+    return _pcm_cache.stats()
+
+def close_fx_sampler():
+    global _sampler
+    sampler, _sampler = _sampler, None
+    if sampler is not None:
+        sampler.close()
+
+def get_fx_stats():
+    if _sampler is None:
+        return {"engine": "mpv"}
+    stats = _sampler.stats()
+    stats["engine"] = "sampler"
+    return stats
+
+def _play_sampled(track, gain):
+    """Trigger track on the sampler; False if it cannot play it (mpv takes over)"""
+    sampler = _sampler
+    full = os.path.join(DATA_DIR, "fx", track)
+    if sampler is None or not os.path.exists(full):
+        return False
+    try:
+        clip = sampler.load(full)
+        gain = max(0.0, float(gain)) * 10 ** (_track_gain("fx", full) / 20)
+        sampler.trigger(clip, gain)
+    except Exception:
+        return False  # e.g. a format libsndfile cannot decode
+
+    _fx_wake.set()
+    return True
+
+def _publish_fx():
+    """Mirror the sampler's voices into state["fx"] while any are playing"""
+    fx_dir = os.path.join(DATA_DIR, "fx")
+    while _sampler is not None:
+        _fx_wake.wait()
+        _fx_wake.clear()
+        while True:
+            sampler = _sampler
+            if sampler is None:
+                return
+            voices = sampler.voices()
+            for voice in voices:
+                voice["track"] = os.path.relpath(voice["track"], fx_dir)
+            latest = voices[-1] if voices else {}
+            state["fx"].update({
+                "voices": voices,
+                "playing": bool(voices),
+                "track": latest.get("track"),
+                "position": latest.get("position"),
+                "duration": latest.get("duration"),
+            })
+            if not voices and not sampler.pending:
+                break
+            time.sleep(FX_STATE_SECONDS)
+
+def _start_player(key, track, volume, paused=False):
+    """(proc, ipc) playing track at volume: a pooled idle mpv if one is ready, else a fresh one"""
+    pool = _POOLS.get(key)
+    player = pool.acquire() if pool else None
+    if player is None:
+        return _spawn(key, track, _sock_path(key), volume=volume, paused=paused, gain_db=_track_gain(key, track))
+    proc, ipc = player
+    _supervisor.claim(proc)
+    _set_volume(ipc, volume)
+    if paused:
+        ipc.set("pause", True)
+    _load(key, ipc, track, "replace")
+    return proc, ipc
 
-        if (fade_out_old):
-            if old_proc and _proc_alive(old_proc) and old_sock and os.path.exists(old_sock):
-                _set_volume(old_sock, start_old * (1 - t))
-        if new_sock and os.path.exists(new_sock):
-            _set_volume(new_sock, target_vol * t)
+# -------------------------
+# Crossfade
+# -------------------------
+def _stop_player(proc, ipc):
+    if proc:
+        _supervisor.stop(proc)
+    if ipc:
+        ipc.close()
+
+def _crossfade(old_proc, old_ipc, new_ipc, target_vol, seconds, fade_out_old=True):
+    """Schedule the fade from the old player to the new one; returns at once"""
+    if seconds <= 0:
+        _stop_player(old_proc, old_ipc)
+        if new_ipc:
+            _scheduler.cancel_ramp(new_ipc)
+            _set_volume(new_ipc, target_vol)
+        return
 
-        time.sleep(step_delay)
+    if new_ipc:
+        _fade_volume(new_ipc, target_vol, seconds)
 
-    if old_proc and _proc_alive(old_proc):
-        old_proc.terminate()
+    if old_ipc is None or old_ipc.closed or not _proc_alive(old_proc):
+        _stop_player(old_proc, old_ipc)
+    elif fade_out_old:
+        _fade_volume(old_ipc, 0, seconds, done=lambda: _stop_player(old_proc, old_ipc))
+    else:
+        # keeps playing as it is (a loop's last seconds) until the new one is in
+        _scheduler.cancel_ramp(old_ipc)
+        _scheduler.call_later(seconds, _stop_player, old_proc, old_ipc)
 
 # -------------------------
 # Playlist helpers
@@ -170,57 +440,208 @@ def _set_playlist(key):
         state[key]["playlist_index"] = 0
 
 # -------------------------
-# Loop worker (shared)
+# Playback tracking (mpv events)
 # -------------------------
-def _loop_worker(key):
+def _track(key, ipc):
+    """Mirror position and duration into state[key] from mpv property changes,
+    and keep the loop transition scheduled from the known duration"""
     player = _PLAYERS[key]
-    stop = player["loop_stop"]
-
-    while not stop.is_set():
-        proc, sock = player["proc"], player["sock"]
-        if not proc or not sock:
-            return
 
-        pos = _get_prop(sock, "time-pos")
-        dur = _get_prop(sock, "duration")
+    def current():
+        return player["ipc"] is ipc
+
+    def on_position(value):
+        if current():
+            state[key]["position"] = value
+
+    def on_duration(value):
+        if current():
+            state[key]["duration"] = value
+            _schedule_next(key, ipc)
+
+    def on_pause(value):
+        if current():
+            player["paused"] = bool(value)
+            _schedule_next(key, ipc)
+
+    def on_event(event):
+        name = event.get("event")
+        if name == "playback-restart" and current():  # after a seek
+            _schedule_next(key, ipc)
+        elif name == "end-file" and event.get("reason") == "eof":
+            if _continue_queued(key, ipc):
+                return
+            # Backstop if the timer did not fire first (e.g. crossfade longer than the track)
+            _scheduler.run(_advance, key, ipc)
+
+    player["paused"] = False
+    ipc.add_listener(on_event)
+    ipc.observe("time-pos", on_position)
+    ipc.observe("duration", on_duration)
+    ipc.observe("pause", on_pause)
+
+def _cancel_timer(player):
+    timer, player["timer"] = player.get("timer"), None
+    _scheduler.cancel(timer)
+
+def _schedule_next(key, ipc, min_delay=0.0):
+    """(Re-)arm the timer that starts the next track crossfade_time before this one ends
+
+    Runs on mpv reader threads, so it only uses the values events already delivered.
+    """
+    player = _PLAYERS[key]
+    with _timer_lock:
+        _cancel_timer(player)
 
+        duration = state[key].get("duration")
+        if (
+            player["ipc"] is not ipc
+            or player["loop_stop"].is_set()
+            or player.get("paused")
+            or state[key].get("loop_mode") not in ("list", "track")
+            or duration is None
+        ):
+            return
+        remaining = duration - (state[key].get("position") or 0.0)
+        delay = remaining - state[key].get("crossfade_time", 0)
+        if player.get("next") is None and player.get("prefetch_failed") is not ipc:
+            delay -= PREFETCH_SECONDS
+        delay = max(min_delay, delay)
+        player["timer"] = _scheduler.call_later(delay, _transition_due, key, ipc)
+
+def _transition_due(key, ipc):
+    """Scheduler job: prefetch or start the next track, or re-arm if playback drifted (pause, seek, slow start)"""
+    player = _PLAYERS[key]
+    pos, dur = ipc.pipeline([("get_property", "time-pos"), ("get_property", "duration")])
+    if pos is None or dur is None:
+        if not ipc.closed:
+            # between two files: look again shortly (end-file covers a real end)
+            _schedule_next(key, ipc, TRANSITION_SLACK_SECONDS)
+            return
+    else:
         state[key]["position"] = pos
-        state[key]["duration"] = dur
+        if dur - pos > state[key].get("crossfade_time", 0) + TRANSITION_SLACK_SECONDS:
+            if player.get("next") is None and player.get("prefetch_failed") is not ipc:
+                _prefetch(key, ipc)
+            _schedule_next(key, ipc)
+            return
+    upcoming = player.get("next")
+    if upcoming is not None and upcoming["ipc"] is None:
+        return  # queued in mpv's playlist: it moves on by itself
+    _advance(key, ipc)
+
+def _next_entry(key):
+    """(playlist index, track) the loop plays after the current one"""
+    playlist = state[key]["playlist"]
+    index = state[key]["playlist_index"]
+    if state[key].get("loop_mode") == "list":
+        index = (index + 1) % len(playlist)
+    return index, os.path.relpath(playlist[index], os.path.join(DATA_DIR, key))
+
+def _loop_active(key, ipc):
+    player = _PLAYERS[key]
+    return (
+        player["ipc"] is ipc
+        and not player["loop_stop"].is_set()
+        and state[key].get("loop_mode") in ("list", "track")
+        and bool(state[key]["playlist"])
+    )
 
-        if pos is None or dur is None:
-            time.sleep(0.2)
-            continue
+def _prefetch(key, ipc):
+    """Open the next entry ahead of the transition
 
-        remaining = dur - pos
-        crossfade = state[key].get("crossfade_time", 0)
+    Without a crossfade it is appended to this mpv's playlist, which plays it
+    gaplessly; otherwise it waits paused on a second player at volume 0, so the
+    crossfade starts on a stream that is already open and decoding.
+    """
+    player = _PLAYERS[key]
+    with _advance_lock:
+        if not _loop_active(key, ipc) or player.get("next") is not None:
+            return
+        index, track = _next_entry(key)
+        full = os.path.join(DATA_DIR, key, track)
+        if state[key].get("crossfade_time", 0) <= 0:
+            _load(key, ipc, full, "append")
+            player["next"] = {"index": index, "track": track, "proc": None, "ipc": None}
+            return
 
-        mode = state[key].get("loop_mode")
+    try:
+        proc, next_ipc = _start_player(key, full, volume=0, paused=True)
+    except RuntimeError:
+        # Each attempt costs a spawn timeout: wait for the transition and start it then
+        player["prefetch_failed"] = ipc
+        return
+    with _advance_lock:
+        if _loop_active(key, ipc) and player.get("next") is None:
+            player["next"] = {"index": index, "track": track, "proc": proc, "ipc": next_ipc}
+            return
+    _stop_player(proc, next_ipc)
 
-        if (
-            mode in ("list", "track")
-            and remaining <= crossfade
-            and state[key]["playlist"]
-        ):
-            if mode == "list":
-                state[key]["playlist_index"] = (
-                    state[key]["playlist_index"] + 1
-                ) % len(state[key]["playlist"])
-
-            next_path = state[key]["playlist"][state[key]["playlist_index"]]
-            rel = os.path.relpath(next_path, os.path.join(DATA_DIR, key))
-            play(key, rel, False)
+def _continue_queued(key, ipc):
+    """Reader thread, at end-file: mpv moves on to the queued entry by itself; follow it in state"""
+    player = _PLAYERS[key]
+    with _advance_lock:
+        upcoming = player.get("next")
+        if player["ipc"] is not ipc or upcoming is None or upcoming["ipc"] is not None:
+            return False
+        player["next"] = None
+        state[key]["track"] = upcoming["track"]
+        state[key]["playlist_index"] = upcoming["index"]
+        state[key]["position"] = 0.0
+    _schedule_next(key, ipc)
+    return True
+
+def _drop_next(key):
+    """Discard the prefetched entry (loop settings or the track changed)"""
+    player = _PLAYERS[key]
+    with _advance_lock:
+        upcoming, player["next"] = player.get("next"), None
+    if upcoming is None:
+        return
+    if upcoming["ipc"] is not None:
+        _stop_player(upcoming["proc"], upcoming["ipc"])
+    elif player["ipc"] is not None:
+        player["ipc"].send("playlist-clear")
+
+def _advance(key, ipc):
+    """Start the next playlist entry (or the same track again) in place of the player on ipc; once per player"""
+    player = _PLAYERS[key]
+    with _advance_lock:
+        if not _loop_active(key, ipc):
             return
+        player["loop_stop"].set()
+        index, track = _next_entry(key)
+        state[key]["playlist_index"] = index
+        upcoming, player["next"] = player.get("next"), None
+
+    prefetched = None
+    if upcoming is not None and upcoming["ipc"] is not None:
+        if upcoming["track"] == track and _proc_alive(upcoming["proc"]) and not upcoming["ipc"].closed:
+            prefetched = upcoming["proc"], upcoming["ipc"]
+        else:
+            _stop_player(upcoming["proc"], upcoming["ipc"])
+    play(key, track, False, prefetched=prefetched)
+
+def _reschedule(key):
+    _drop_next(key)
+    ipc = _PLAYERS[key].get("ipc")
+    if ipc and state[key]["playing"]:
+        _schedule_next(key, ipc)
 
 # -------------------------
 # Core player API
 # -------------------------
-def play(key, track, fade_out_old=True):
+def play(key, track, fade_out_old=True, prefetched=None):
+    """Start track on key; prefetched is a paused (proc, ipc) already on it"""
     player = _PLAYERS[key]
     if "loop_stop" in player:
         player["loop_stop"].set()
+        _drop_next(key)
 
     full = os.path.join(DATA_DIR, key, track)
     if not os.path.exists(full):
+        if prefetched:
+            _stop_player(*prefetched)
         state[key].update({"playing": False, "track": None, "position": None, "duration": None})
         return
 
@@ -230,68 +651,72 @@ def play(key, track, fade_out_old=True):
 
     vol = state[key].get("volume", 100)
     fade = state[key].get("crossfade_time", 0)
-    loop = False
 
-    sock = f"/tmp/mpv_{key}_{int(time.time()*1000)}.sock"
-    proc = _spawn(full, sock, loop=loop, volume=0 if key != "fx" else vol)
+    if prefetched:
+        proc, ipc = prefetched
+        ipc.set("pause", False)
+    else:
+        proc, ipc = _start_player(key, full, volume=0 if key != "fx" else vol)
 
     if key != "fx":
-        threading.Thread(
-            target=_crossfade, args=(player["proc"], player["sock"], sock, vol, fade, fade_out_old), daemon=True
-        ).start()
+        _crossfade(player["proc"], player["ipc"], ipc, vol, fade, fade_out_old)
 
-    player["proc"], player["sock"] = proc, sock
+    player["proc"], player["sock"], player["ipc"] = proc, ipc.path, ipc
     state[key]["playing"] = True
     if key == "fx":
         state[key]["position"] = 0
-        state[key]["duration"] = _get_prop(sock, "duration")
-
-        # track FX in background and clear when finished
-        def _watch_fx():
-            while _proc_alive(proc):
-                pos = _get_prop(sock, "time-pos")
-                state[key]["position"] = pos
-                time.sleep(0.05)
-            state[key].update({"playing": False, "track": None, "position": None, "duration": None})
-        threading.Thread(target=_watch_fx, daemon=True).start()
-    elif state[key].get("loop_mode") in ("list", "track"):
+        state[key]["duration"] = None
+
+        # Follow the FX through mpv events; mpv quits when it ends
+        def update(field):
+            def on_change(value):
+                if player["ipc"] is ipc:
+                    state[key][field] = value
+            return on_change
+
+        def finished():
+            if player["ipc"] is ipc:
+                state[key].update({"playing": False, "track": None, "position": None, "duration": None})
+
+        ipc.observe("time-pos", update("position"))
+        ipc.observe("duration", update("duration"))
+        ipc.on_close(finished)
+    else:
         player["loop_stop"].clear()
-        threading.Thread(target=_loop_worker, args=(key,), daemon=True).start()
+        _track(key, ipc)
 
 def stop(key):
     player = _PLAYERS[key]
     if "loop_stop" in player:
         player["loop_stop"].set()
+        with _timer_lock:
+            _cancel_timer(player)
+        _drop_next(key)
 
     if _proc_alive(player.get("proc")):
-        _crossfade(player.get("proc"), player.get("sock"), None, 0, state[key].get("crossfade_time", 0))
+        _crossfade(player.get("proc"), player.get("ipc"), None, 0, state[key].get("crossfade_time", 0))
 
-    player["proc"] = player["sock"] = None
+    player["proc"] = player["sock"] = player["ipc"] = None
     state[key].update({"playing": False, "track": None, "position": None, "duration": None})
 
 def set_volume(key, vol, fade_duration=0):
     vol = max(0, min(100, int(vol)))
     state[key]["volume"] = vol
 
-    sock = _PLAYERS[key].get("sock")
-    if not sock:
+    ipc = _PLAYERS[key].get("ipc")
+    if not ipc:
         return
 
     if fade_duration:
-        threading.Thread(
-            target=_fade_volume,
-            args=(sock, vol, fade_duration),
-            daemon=True
-        ).start()
+        _fade_volume(ipc, vol, fade_duration)
     else:
-        _set_volume(sock, vol)
+        _scheduler.cancel_ramp(ipc)
+        _set_volume(ipc, vol)
 
 def set_loop_mode(key, mode):
     state[key]["loop_mode"] = mode
     _set_playlist(key)
-    if mode in ("list", "track") and state[key]["playing"]:
-        _PLAYERS[key]["loop_stop"].clear()
-        threading.Thread(target=_loop_worker, args=(key,), daemon=True).start()
+    _reschedule(key)
 
 def set_crossfade_time(key, seconds: float):
     try:
@@ -299,6 +724,7 @@ def set_crossfade_time(key, seconds: float):
     except (TypeError, ValueError):
         return
     state[key]["crossfade_time"] = max(0.0, seconds)
+    _reschedule(key)
 
 # -------------------------
 # Public wrappers
@@ -315,8 +741,12 @@ def set_ambient_volume(v): set_volume("ambient", v, VOLUME_FADE_SECONDS)
 def set_ambient_loop_mode(m): set_loop_mode("ambient", m)
 def set_ambient_crossfade_time(s): set_crossfade_time("ambient", s)
 
-def set_fx_volume(v): set_volume("fx", v)
+def set_fx_volume(v):
+    set_volume("fx", v)
+    if _sampler is not None:
+        _sampler.volume = state["fx"]["volume"] / 100
 
-def play_fx(track): 
+def play_fx(track, gain=1.0):
     state.setdefault("fx", {})
-    play("fx", track)
+    if not _play_sampled(track, gain):
+        play("fx", track)
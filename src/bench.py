@@ -0,0 +1,203 @@
+"""Offline DSP benchmark for every voice preset in effects.json.
+
+Runs each preset's effect chain on a synthetic voice signal at the
+modulator's SAMPLE_RATE/BLOCK_SIZE, without opening an audio stream:
+
+    python -m src.bench
+    python -m src.bench --seconds 20 --json bench.json --max-load 0.5
+    python -m src.bench --backend numba
+
+Every available kernel backend (NumPy, and Numba when installed) is run
+unless --backend picks one.
+"""
+import argparse
+import json
+import math
+import sys
+import time
+
+import numpy as np
+from scipy.signal import lfilter
+
+from .dsp import (
+    build_chain, allocation_profile,
+    available_backends, get_backend, set_backend, BACKENDS,
+)
+from .modulator import SAMPLE_RATE, BLOCK_SIZE, PRESETS_FILE, list_custom_presets, _normalize_params
+
+WARMUP_BLOCKS = 10
+
+# =========================
+# TEST SIGNAL
+# =========================
+def voice_signal(seconds, sample_rate, seed=0):
+    """Synthetic voice: gliding glottal pulses through three formants, in syllables"""
+    rng = np.random.default_rng(seed)
+    n = int(seconds * sample_rate)
+    t = np.arange(n) / sample_rate
+
+    f0 = 140 + 40 * np.sin(2 * math.pi * 0.7 * t) + 5 * np.sin(2 * math.pi * 5.5 * t)
+    phase = np.cumsum(f0 / sample_rate)
+    source = 2 * (phase % 1.0) - 1 + 0.05 * rng.standard_normal(n)
+
+    voice = np.zeros(n)
+    for freq, bandwidth in ((700, 130), (1220, 70), (2600, 160)):
+        r = math.exp(-math.pi * bandwidth / sample_rate)
+        theta = 2 * math.pi * freq / sample_rate
+        voice += lfilter([1 - r], [1, -2 * r * math.cos(theta), r * r], source)
+
+    # ~3 syllables per second with a pause every few seconds
+    envelope = 0.5 * (1 - np.cos(2 * math.pi * 3 * t))
+    envelope *= np.sin(2 * math.pi * 0.25 * t) > -0.5
+    voice *= envelope
+    return (0.5 * voice / np.max(np.abs(voice))).astype(np.float32)
+
+# =========================
+# BENCHMARK
+# =========================
+def _percentiles(samples):
+    ms = np.asarray(samples) * 1000.0
+    return {
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "max_ms": float(ms.max()),
+    }
+
+def bench_preset(params, signal, sample_rate=SAMPLE_RATE, block_size=BLOCK_SIZE):
+    """Time one preset's chain block by block; None if the preset enables nothing"""
+    params = _normalize_params(params)
+    chain = build_chain(params, sample_rate, block_size)
+    if chain is None:
+        return None
+
+    blocks = [signal[i:i + block_size] for i in range(0, len(signal) - block_size + 1, block_size)]
+    out = np.zeros(block_size, dtype=np.float32)
+    clock = time.perf_counter
+
+    for block in blocks[:WARMUP_BLOCKS]:
+        chain.process(block, out)
+    durations = []
+    for block in blocks:
+        start = clock()
+        chain.process(block, out)
+        durations.append(clock() - start)
+
+    # Per-stage timing on a fresh chain, so timer overhead stays out of the totals
+    timed = build_chain(params, sample_rate, block_size)
+    timings = {}
+    for block in blocks:
+        timed.process_timed(block, out, timings, clock)
+    stages = {name: 1000.0 * total / len(blocks) for name, total in timings.items()}
+
+    def make_process(n):
+        profiled = build_chain(params, sample_rate, n)
+        block, block_out = np.resize(signal, n), np.zeros(n, dtype=np.float32)
+        return lambda: profiled.process(block, block_out)
+    allocated, allocation_free = allocation_profile(make_process)
+
+    deadline_ms = 1000.0 * block_size / sample_rate
+    result = _percentiles(durations)
+    result.update({
+        "stages_ms": stages,
+        "deadline_ms": deadline_ms,
+        "realtime_factor": result["mean_ms"] / deadline_ms,
+        "margin_ms": deadline_ms - result["p99_ms"],
+        "latency_ms": chain.latency_ms,
+        "alloc_peak_bytes": max(allocated.values()),
+        "allocation_free": allocation_free,
+    })
+    return result
+
+def run(seconds=10.0, sample_rate=SAMPLE_RATE, block_size=BLOCK_SIZE, presets=None, backends=None):
+    """Benchmark every preset (or the given name -> params dict) under each kernel backend"""
+    if presets is None:
+        presets = list_custom_presets()
+    if backends is None:
+        backends = available_backends()
+    signal = voice_signal(seconds, sample_rate)
+
+    previous = get_backend()
+    report = {}
+    try:
+        for backend in backends:
+            set_backend(backend)
+            results = {}
+            for name, params in presets.items():
+                if params is None:
+                    continue
+                result = bench_preset(params, signal, sample_rate, block_size)
+                if result is not None:
+                    results[name] = result
+            report[backend] = results
+    finally:
+        set_backend(previous)
+    return {
+        "sample_rate": sample_rate,
+        "block_size": block_size,
+        "seconds": seconds,
+        "presets_file": PRESETS_FILE,
+        "backends": report,
+    }
+
+# =========================
+# REPORT
+# =========================
+def format_table(report):
+    header = f"{'preset':<14}{'backend':<8}{'mean':>8}{'p50':>8}{'p99':>8}{'max':>8}{'RTF':>7}{'margin':>9}{'alloc':>8}  stages (mean ms)"
+    lines = [
+        f"{report['sample_rate']} Hz, block {report['block_size']} "
+        f"({1000.0 * report['block_size'] / report['sample_rate']:.2f} ms deadline), "
+        f"{report['seconds']:g} s of synthetic voice",
+        header,
+        "-" * len(header),
+    ]
+    backends = report["backends"]
+    names = list(dict.fromkeys(name for results in backends.values() for name in results))
+    for name in names:
+        for backend, results in backends.items():
+            r = results.get(name)
+            if r is None:
+                continue
+            stages = ", ".join(f"{stage} {ms:.3f}" for stage, ms in r["stages_ms"].items())
+            lines.append(
+                f"{name:<14}{backend:<8}{r['mean_ms']:>8.3f}{r['p50_ms']:>8.3f}{r['p99_ms']:>8.3f}{r['max_ms']:>8.3f}"
+                f"{r['realtime_factor']:>7.3f}{r['margin_ms']:>9.2f}{r['alloc_peak_bytes']:>8}  {stages}"
+            )
+    return "\n".join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark voice presets offline")
+    parser.add_argument("--seconds", type=float, default=10.0, help="length of the test signal")
+    parser.add_argument("--block-size", type=int, default=BLOCK_SIZE)
+    parser.add_argument("--backend", choices=BACKENDS, action="append",
+                        help="kernel backend to run (repeatable; default: every installed one)")
+    parser.add_argument("--json", metavar="PATH", help="also write the report as JSON ('-' for stdout)")
+    parser.add_argument("--max-load", type=float, default=None,
+                        help="exit with status 1 if any preset's p99 exceeds this fraction of the deadline")
+    args = parser.parse_args(argv)
+
+    report = run(args.seconds, SAMPLE_RATE, args.block_size, backends=args.backend)
+    if args.json == "-":
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        print(format_table(report))
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(report, f, indent=2)
+
+    if args.max_load is not None:
+        slow = [
+            f"{name} ({backend})"
+            for backend, results in report["backends"].items()
+            for name, r in results.items()
+            if r["p99_ms"] > args.max_load * r["deadline_ms"]
+        ]
+        if slow:
+            print(f"Over {args.max_load:.0%} of the deadline: {', '.join(slow)}", file=sys.stderr)
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
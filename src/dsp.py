@@ -0,0 +1,1268 @@
+import math
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Every engine preallocates its scratch for this many frames and only grows
+# (allocates) when a larger block arrives.
+DEFAULT_BLOCK_SIZE = 1024
+
+# Parameter changes on a running chain: cutoffs, LFO rates and similar
+# per-block settings glide over this many blocks; gains ramp within one block.
+PARAM_RAMP_BLOCKS = 8
+# Equal-power crossfade between chains when a switch changes the stage layout
+CROSSFADE_MS = 20
+
+
+def _grow(buf, n, dtype=np.float32):
+    """Return buf if it holds n samples, otherwise a larger zeroed buffer"""
+    if len(buf) >= n:
+        return buf
+    return np.zeros(n, dtype=dtype)
+
+
+# =========================
+# KERNEL BACKEND
+# =========================
+# The recursive loops (one-pole filters, feedback delay, reverb combs) run as
+# the NumPy formulations in this file, or as Numba kernels from jit.py.
+BACKENDS = ("numpy", "numba")
+_jit = None
+
+
+def set_backend(name="auto"):
+    """Select "numpy", "numba" or "auto" (numba when installed); returns the backend in use
+
+    Selecting numba imports jit.py, which compiles every kernel up front.
+    """
+    global _jit
+    if name not in ("auto",) + BACKENDS:
+        raise ValueError(f"DSP backend must be 'auto' or one of {BACKENDS}")
+    if name == "numpy":
+        _jit = None
+        return "numpy"
+    try:
+        from . import jit
+    except ImportError:
+        if name == "numba":
+            raise RuntimeError("DSP backend 'numba' requested but numba is not installed")
+        _jit = None
+        return "numpy"
+    _jit = jit
+    return "numba"
+
+
+def get_backend():
+    return "numpy" if _jit is None else "numba"
+
+
+def available_backends():
+    try:
+        import numba  # noqa: F401
+    except ImportError:
+        return ("numpy",)
+    return BACKENDS
+
+
+# =========================
+# PARAMETER SMOOTHING
+# =========================
+class _Ramp:
+    """Gain that moves to a new target as a per-sample linear ramp over one block
+
+    set() may be called from any thread; apply() runs on the audio thread.
+    """
+
+    def __init__(self, value, block_size=DEFAULT_BLOCK_SIZE):
+        self.value = self.target = np.float32(value)
+        self._unit = (np.arange(1, block_size + 1) / block_size).astype(np.float32)
+        self._buf = np.zeros(block_size, dtype=np.float32)
+
+    def set(self, value):
+        self.target = np.float32(value)
+
+    def apply(self, y, out=None):
+        """out = y * gain (in place by default)"""
+        if out is None:
+            out = y
+        target = self.target
+        if target == self.value:
+            np.multiply(y, target, out=out)
+            return out
+        n = len(y)
+        r = self._buf[:n]
+        np.multiply(self._unit[:n], target - self.value, out=r)
+        r += self.value
+        np.multiply(y, r, out=out)
+        # A short block only covers part of the ramp; the rest continues next block
+        self.value = target if n == len(self._unit) else np.float32(r[n - 1])
+        return out
+
+
+class _Glide:
+    """Per-block setting that reaches a new target in PARAM_RAMP_BLOCKS steps
+
+    Geometric steps suit frequencies; linear steps suit amounts.
+    """
+
+    def __init__(self, value, geometric=False, blocks=PARAM_RAMP_BLOCKS):
+        self.value = self.target = value
+        self.geometric = geometric
+        self.blocks = blocks
+        self._from = self._to = value
+        self._step = blocks
+
+    def set(self, value):
+        self.target = value
+
+    def next(self):
+        """Value for the next block"""
+        target = self.target
+        if target != self._to:
+            self._from, self._to, self._step = self.value, target, 0
+        if self._step < self.blocks:
+            self._step += 1
+            t = self._step / self.blocks
+            if self.geometric and self._from > 0 and self._to > 0:
+                self.value = self._from * (self._to / self._from) ** t
+            else:
+                self.value = self._from + (self._to - self._from) * t
+        return self.value
+
+
+# =========================
+# ONE-POLE KERNEL
+# =========================
+def _one_pole_tables(coef, gain, block_size):
+    """Precompute weights for y[n] = coef * y[n-1] + gain * x[n]
+
+    Unrolled, y[n] = coef**(n+1) * (y[-1] + sum(gain * x[k] * coef**-(k+1))),
+    which is one cumsum per chunk. Chunks are short enough that coef**-n
+    stays far from float64 overflow.
+    """
+    if coef >= 1.0 or coef <= 0.0:
+        raise ValueError("One-pole coefficient must be in (0, 1)")
+    chunk = max(1, min(block_size, int(250 / -math.log10(coef))))
+    k = np.arange(1, chunk + 1, dtype=np.float64)
+    up = gain * coef ** -k
+    down = coef ** k
+    return up, down
+
+
+def _one_pole(x, out, state, up, down, scratch):
+    """Run the recursion described by _one_pole_tables; out may alias x
+
+    Mixed float32/float64 ufunc calls make NumPy allocate cast buffers, so
+    dtype changes only happen through slice assignment.
+    """
+    chunk = len(up)
+    for start in range(0, len(x), chunk):
+        m = min(chunk, len(x) - start)
+        t = scratch[:m]
+        t[:] = x[start:start + m]
+        t *= up[:m]
+        np.cumsum(t, out=t)
+        t += state
+        t *= down[:m]
+        state = float(t[m - 1])
+        out[start:start + m] = t
+    return state
+
+
+# =========================
+# FILTERS
+# =========================
+class OnePoleLowPass:
+    """One-pole low-pass filter, processed block-wise with carried state"""
+
+    def __init__(self, sample_rate, block_size=DEFAULT_BLOCK_SIZE):
+        self.sample_rate = sample_rate
+        self.block_size = block_size
+        self.cutoff = None
+        self.state = 0.0
+        self._coef = self._gain = None
+        self._up = self._down = None
+        self._scratch = np.zeros(block_size, dtype=np.float64)
+        # Per-block (cutoff, coef, gain, up, down) steps of a pending glide; swapped by assignment
+        self._glide = self._gliding = ()
+        self._glide_pos = 0
+
+    def _coefficients(self, cutoff_hz):
+        rc = 1.0 / (2.0 * math.pi * cutoff_hz)
+        dt = 1.0 / self.sample_rate
+        alpha = dt / (rc + dt)
+        # y[n] = y[n-1] + alpha * (x[n] - y[n-1])
+        return 1.0 - alpha, alpha
+
+    def set_cutoff(self, cutoff_hz):
+        if cutoff_hz == self.cutoff:
+            return
+        self._coef, self._gain = self._coefficients(cutoff_hz)
+        self._up, self._down = _one_pole_tables(self._coef, self._gain, self.block_size)
+        self.cutoff = cutoff_hz
+
+    def glide_to(self, cutoff_hz, blocks=PARAM_RAMP_BLOCKS):
+        """Move to cutoff_hz in geometric per-block steps
+
+        The tables are built here, on the calling thread; the audio thread
+        only picks up one precomputed pair per block.
+        """
+        start = self.cutoff
+        steps = []
+        for k in range(1, blocks + 1):
+            cutoff = start * (cutoff_hz / start) ** (k / blocks)
+            coef, gain = self._coefficients(cutoff)
+            steps.append((cutoff, coef, gain, *_one_pole_tables(coef, gain, self.block_size)))
+        self._glide = tuple(steps)
+
+    def _next_tables(self):
+        glide = self._glide
+        if glide is not self._gliding:
+            self._gliding = glide
+            self._glide_pos = 0
+        if self._glide_pos < len(glide):
+            self.cutoff, self._coef, self._gain, self._up, self._down = glide[self._glide_pos]
+            self._glide_pos += 1
+
+    def reset(self):
+        self.state = 0.0
+
+    def process(self, x, out):
+        """Filter x into out (may be x itself)"""
+        self._next_tables()
+        if _jit is not None:
+            self.state = _jit.one_pole(x, out, self.state, self._coef, self._gain)
+        else:
+            self.state = _one_pole(x, out, self.state, self._up, self._down, self._scratch)
+        return out
+
+
+class OnePoleHighPass(OnePoleLowPass):
+    """One-pole high-pass filter, processed block-wise with carried state"""
+
+    def __init__(self, sample_rate, block_size=DEFAULT_BLOCK_SIZE):
+        super().__init__(sample_rate, block_size)
+        self.last_input = 0.0
+        self._diff = np.zeros(block_size, dtype=np.float32)
+
+    def _coefficients(self, cutoff_hz):
+        rc = 1.0 / (2.0 * math.pi * cutoff_hz)
+        dt = 1.0 / self.sample_rate
+        alpha = rc / (rc + dt)
+        # y[n] = alpha * (y[n-1] + x[n] - x[n-1])
+        return alpha, alpha
+
+    def reset(self):
+        self.state = 0.0
+        self.last_input = 0.0
+
+    def process(self, x, out):
+        """Filter x into out (may be x itself)"""
+        self._next_tables()
+        n = len(x)
+        self._diff = _grow(self._diff, n)
+        diff = self._diff[:n]
+        np.subtract(x[1:], x[:-1], out=diff[1:])
+        diff[0] = x[0] - self.last_input
+        self.last_input = float(x[n - 1])
+        if _jit is not None:
+            self.state = _jit.one_pole(diff, out, self.state, self._coef, self._gain)
+        else:
+            self.state = _one_pole(diff, out, self.state, self._up, self._down, self._scratch)
+        return out
+
+
+# =========================
+# RING BUFFER HELPERS
+# =========================
+def _ring_read(buf, start, out):
+    """Copy len(out) samples from ring buffer starting at start (wraps once)"""
+    size = len(buf)
+    start %= size
+    first = min(len(out), size - start)
+    out[:first] = buf[start:start + first]
+    if first < len(out):
+        out[first:] = buf[:len(out) - first]
+
+
+def _ring_write(buf, start, data):
+    """Copy data into ring buffer starting at start (wraps once)"""
+    size = len(buf)
+    start %= size
+    first = min(len(data), size - start)
+    buf[start:start + first] = data[:first]
+    if first < len(data):
+        buf[:len(data) - first] = data[first:]
+
+
+# =========================
+# DELAY
+# =========================
+class FeedbackDelay:
+    """Ring-buffer delay line with feedback, processed slice by slice"""
+
+    def __init__(self, max_samples, block_size=DEFAULT_BLOCK_SIZE):
+        self.buffer = np.zeros(max_samples, dtype=np.float32)
+        self.feedback = np.zeros(max_samples, dtype=np.float32)
+        self.index = 0
+        self._wet = np.zeros(block_size, dtype=np.float32)
+        self._scratch = np.zeros(block_size, dtype=np.float32)
+
+    def reset(self):
+        self.buffer.fill(0)
+        self.feedback.fill(0)
+        self.index = 0
+
+    def process(self, x, delay_samples):
+        """Return the wet signal for block x delayed by delay_samples
+
+        The result is a view of an internal buffer, valid until the next call.
+        """
+        delay = max(1, min(int(delay_samples), len(self.buffer) - 1))
+        n = len(x)
+        self._wet = _grow(self._wet, n)
+        self._scratch = _grow(self._scratch, n)
+
+        wet = self._wet[:n]
+        if _jit is not None:
+            self.index = _jit.feedback_delay(x, wet, self.buffer, self.feedback, self.index, delay)
+            return wet
+
+        pos = 0
+        # Segments never exceed the delay, so every read hits already-written samples
+        while pos < n:
+            seg = min(delay, n - pos)
+            w = wet[pos:pos + seg]
+            fb = self._scratch[:seg]
+            _ring_read(self.buffer, self.index - delay, w)
+            _ring_read(self.feedback, self.index - delay, fb)
+            w *= 0.6
+            fb *= 0.3
+            w += fb
+            _ring_write(self.buffer, self.index, x[pos:pos + seg])
+            np.multiply(w, 0.5, out=fb)
+            _ring_write(self.feedback, self.index, fb)
+            self.index = (self.index + seg) % len(self.buffer)
+            pos += seg
+        return wet
+
+
+# =========================
+# REVERB
+# =========================
+# Freeverb tunings at 44.1 kHz, rescaled to the stream sample rate
+_COMB_TUNING = [1116, 1188, 1277, 1356, 1422, 1491, 1557, 1617]
+_ALLPASS_TUNING = [556, 441, 341, 225]
+_ALLPASS_FEEDBACK = 0.5
+# Twice Freeverb's fixed gain. At reverb 0.4 and size 0 the wet level is within
+# 1 dB of the old four-tap loop and the decay is about as long (0.5 s against
+# 0.4 s RT60), but it is a different reverb, not a copy of that loop
+_REVERB_INPUT_GAIN = 0.03
+_REVERB_DAMPING = 0.2
+
+
+class _Comb:
+    """Feedback comb with a one-pole damping filter in the loop"""
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.index = 0
+        self.state = 0.0
+
+    def reset(self):
+        self.buffer.fill(0)
+        self.index = 0
+        self.state = 0.0
+
+    def process(self, x, acc, feedback, up, down, scratch, scratch64):
+        """Add the comb output for x into acc"""
+        if _jit is not None:
+            self.index, self.state = _jit.comb(
+                x, acc, self.buffer, self.index, self.state, feedback,
+                _REVERB_DAMPING, 1.0 - _REVERB_DAMPING,
+            )
+            return
+        size = len(self.buffer)
+        pos = 0
+        while pos < len(x):
+            # The ring is exactly one delay long: read the old slice, then overwrite it
+            seg = min(size - self.index, len(x) - pos)
+            delayed = self.buffer[self.index:self.index + seg]
+            acc[pos:pos + seg] += delayed
+            out = scratch[:seg]
+            self.state = _one_pole(delayed, out, self.state, up, down, scratch64)
+            out *= feedback
+            out += x[pos:pos + seg]
+            delayed[:] = out
+            self.index = (self.index + seg) % size
+            pos += seg
+
+
+class _Allpass:
+    """Schroeder allpass section"""
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.index = 0
+
+    def reset(self):
+        self.buffer.fill(0)
+        self.index = 0
+
+    def process(self, x, scratch):
+        """Filter x in place"""
+        size = len(self.buffer)
+        pos = 0
+        while pos < len(x):
+            seg = min(size - self.index, len(x) - pos)
+            delayed = self.buffer[self.index:self.index + seg]
+            block = x[pos:pos + seg]
+            out = scratch[:seg]
+            np.multiply(delayed, _ALLPASS_FEEDBACK, out=out)
+            out += block
+            np.subtract(delayed, block, out=block)
+            delayed[:] = out
+            self.index = (self.index + seg) % size
+            pos += seg
+
+
+class Reverb:
+    """Freeverb-style network: parallel damped combs into series allpasses"""
+
+    def __init__(self, sample_rate, buffer=None, block_size=DEFAULT_BLOCK_SIZE):
+        scale = sample_rate / 44100.0
+        lengths = [int(t * scale) for t in _COMB_TUNING + _ALLPASS_TUNING]
+        if buffer is None:
+            buffer = np.zeros(sum(lengths), dtype=np.float32)
+        if sum(lengths) > len(buffer):
+            raise ValueError("Reverb buffer too small")
+
+        # Carve every element's ring out of the shared buffer
+        views = []
+        offset = 0
+        for n in lengths:
+            views.append(buffer[offset:offset + n])
+            offset += n
+        self.combs = [_Comb(v) for v in views[:len(_COMB_TUNING)]]
+        self.allpasses = [_Allpass(v) for v in views[len(_COMB_TUNING):]]
+
+        # filter[n] = damping * filter[n-1] + (1 - damping) * delayed[n]
+        self._up, self._down = _one_pole_tables(_REVERB_DAMPING, 1.0 - _REVERB_DAMPING, block_size)
+        self._scratch64 = np.zeros(len(self._up), dtype=np.float64)
+        self._input = np.zeros(block_size, dtype=np.float32)
+        self._wet = np.zeros(block_size, dtype=np.float32)
+        self._scratch = np.zeros(block_size, dtype=np.float32)
+
+    def reset(self):
+        for element in self.combs + self.allpasses:
+            element.reset()
+
+    def process(self, x, size):
+        """Return the wet signal for block x; size (0..1) sets the decay time
+
+        The result is a view of an internal buffer, valid until the next call.
+        """
+        n = len(x)
+        self._input = _grow(self._input, n)
+        self._wet = _grow(self._wet, n)
+        self._scratch = _grow(self._scratch, n)
+        feedback = 0.7 + 0.28 * max(0.0, min(1.0, size))
+
+        inp = self._input[:n]
+        np.multiply(x, _REVERB_INPUT_GAIN, out=inp)
+        wet = self._wet[:n]
+        wet.fill(0)
+        for comb in self.combs:
+            comb.process(inp, wet, feedback, self._up, self._down, self._scratch, self._scratch64)
+        for allpass in self.allpasses:
+            allpass.process(wet, self._scratch)
+        return wet
+
+
+# =========================
+# CHORUS
+# =========================
+class Chorus:
+    """Multi-voice chorus/flanger with a per-sample LFO and interpolated delay"""
+
+    def __init__(self, sample_rate, buffers, delays=(0.005, 0.008, 0.011),
+                 rates=(0.5, 0.8, 1.1), depths=(0.001, 0.0015, 0.002),
+                 block_size=DEFAULT_BLOCK_SIZE):
+        self.sample_rate = sample_rate
+        self.buffers = buffers
+        self.delays = [d * sample_rate for d in delays]
+        self.increments = [2 * math.pi * r / sample_rate for r in rates]
+        self.depths = [d * sample_rate for d in depths]
+        self.phases = [0.0] * len(buffers)
+        self.index = 0
+        self._allocate(block_size)
+
+    def _allocate(self, n):
+        self._ramp = np.arange(1, n + 1, dtype=np.float64)
+        self._pos = np.zeros(n, dtype=np.float64)
+        self._floor = np.zeros(n, dtype=np.float64)
+        self._frac = np.zeros(n, dtype=np.float32)
+        self._i0 = np.zeros(n, dtype=np.intp)
+        self._i1 = np.zeros(n, dtype=np.intp)
+        self._s0 = np.zeros(n, dtype=np.float32)
+        self._s1 = np.zeros(n, dtype=np.float32)
+
+    def reset(self):
+        for buf in self.buffers:
+            buf.fill(0)
+        self.phases = [0.0] * len(self.buffers)
+        self.index = 0
+
+    def process(self, x, amount):
+        """Mix every modulated voice into x, in place"""
+        n = len(x)
+        if len(self._ramp) < n:
+            self._allocate(n)
+        size = len(self.buffers[0])
+        ramp, pos, floor, frac = self._ramp[:n], self._pos[:n], self._floor[:n], self._frac[:n]
+        i0, i1, s0, s1 = self._i0[:n], self._i1[:n], self._s0[:n], self._s1[:n]
+
+        # Write first so voices shorter than the block can read this block's samples
+        for buf in self.buffers:
+            _ring_write(buf, self.index, x)
+
+        wet_gain = amount * 0.3
+        for i, buf in enumerate(self.buffers):
+            # delay = base + depth * (1 + sin(phase)), one LFO value per sample
+            np.multiply(ramp, self.increments[i], out=pos)
+            pos += self.phases[i]
+            self.phases[i] = float(pos[n - 1]) % (2 * math.pi)
+            np.sin(pos, out=pos)
+            pos += 1.0
+            pos *= -self.depths[i]
+            # read position = index + j - delay
+            pos += ramp
+            pos += self.index - 1.0 - self.delays[i]
+            np.mod(pos, size, out=pos)
+
+            np.floor(pos, out=floor)
+            np.copyto(i0, floor, casting="unsafe")
+            pos -= floor
+            frac[:] = pos
+            np.add(i0, 1, out=i1)
+            # mode="raise" would buffer out; "wrap" also handles the ring's end
+            np.take(buf, i0, out=s0, mode="wrap")
+            np.take(buf, i1, out=s1, mode="wrap")
+            s1 -= s0
+            s1 *= frac
+            s0 += s1
+            s0 *= wet_gain
+            x += s0
+
+        self.index = (self.index + n) % size
+        x /= 1 + len(self.buffers) * wet_gain
+        return x
+
+
+# =========================
+# PITCH SHIFT
+# =========================
+def _pitch_geometry(semitones, grain=1024, tolerance=256):
+    """(factor, lookahead, latency) of a PitchShifter shifting by semitones"""
+    factor = max(2 ** (semitones / 12.0), 0.0625)  # Limit -48 semitones
+    # Every grain needs its whole resampled span plus the search window in the past
+    span = int(math.ceil(grain * factor))
+    lookahead = tolerance + span + 2
+    # Delay seen at the grain centre, where the window peaks
+    return factor, lookahead, lookahead + (grain - span) // 2
+
+
+class PitchShifter:
+    """Streaming WSOLA pitch shifter: resampled Hann grains overlap-added at a fixed hop"""
+
+    def __init__(self, sample_rate, grain=1024, tolerance=256, block_size=DEFAULT_BLOCK_SIZE):
+        self.sample_rate = sample_rate
+        self.grain = grain
+        self.hop = grain // 2
+        self.tolerance = tolerance
+        self.block_size = block_size
+        self.window = (0.5 - 0.5 * np.cos(2 * math.pi * np.arange(grain) / grain)).astype(np.float32)
+        self.semitones = None
+        self.factor = 1.0
+        self.lookahead = 0
+        self.latency = 0
+        self._hist = np.zeros(0, dtype=np.float32)
+        self._acc = np.zeros(0, dtype=np.float32)
+        self._pos = np.zeros(grain, dtype=np.float64)
+        self._floor = np.zeros(grain, dtype=np.float64)
+        self._frac = np.zeros(grain, dtype=np.float32)
+        self._i0 = np.zeros(grain, dtype=np.intp)
+        self._i1 = np.zeros(grain, dtype=np.intp)
+        self._g0 = np.zeros(grain, dtype=np.float32)
+        self._g1 = np.zeros(grain, dtype=np.float32)
+        self.reset()
+
+    def set_semitones(self, semitones):
+        if semitones == self.semitones:
+            return
+        self.semitones = semitones
+        self.factor, self.lookahead, self.latency = _pitch_geometry(semitones, self.grain, self.tolerance)
+
+        self._offsets = self.factor * np.arange(self.grain, dtype=np.float64)
+        self._width = max(1, int(self.hop * self.factor))
+        candidates = 2 * self.tolerance + 1
+        self._windows = np.zeros((candidates, self._width), dtype=np.float32)
+        self._corr = np.zeros(candidates, dtype=np.float32)
+        self._score = np.zeros(candidates, dtype=np.float64)
+        self._ratio = np.zeros(candidates, dtype=np.float64)
+        self._energy = np.zeros(candidates + self._width, dtype=np.float64)
+        self._hist = np.zeros(0, dtype=np.float32)
+        self._acc = np.zeros(0, dtype=np.float32)
+        self._ensure_buffers(self.block_size)
+        self.reset()
+
+    def reset(self):
+        self._hist.fill(0)
+        self._acc.fill(0)
+        self._in_pos = 0        # absolute index of the next input sample
+        self._out_pos = 0       # absolute index of the next output sample
+        self._next_grain = 0    # absolute output time of the next grain
+        self._last_start = None  # analysis start of the previous grain
+
+    @property
+    def latency_ms(self):
+        return 1000.0 * self.latency / self.sample_rate
+
+    def _ensure_buffers(self, n):
+        span = int(math.ceil(self.grain * self.factor))
+        hist_len = n + self.lookahead + 2 * self.tolerance + self.hop + span + 2
+        if len(self._hist) < hist_len:
+            hist = np.zeros(hist_len, dtype=np.float32)
+            if len(self._hist):
+                hist[-len(self._hist):] = self._hist
+            self._hist = hist
+            # Every width-long window of the history, as one strided view
+            self._hist_windows = sliding_window_view(hist, self._width)
+        if len(self._acc) < n + self.grain:
+            acc = np.zeros(n + self.grain, dtype=np.float32)
+            acc[:len(self._acc)] = self._acc
+            self._acc = acc
+
+    def _find_start(self, nominal, hist_start):
+        """Pick the analysis start near nominal that best continues the previous grain"""
+        if self._last_start is None:
+            return nominal
+        width = self._width
+        natural = int(self._last_start + self.hop * self.factor) - hist_start
+        template = self._hist[natural:natural + width]
+        if not template.any():
+            return nominal
+        lo = nominal - self.tolerance - hist_start
+        region = self._hist[lo:lo + 2 * self.tolerance + width]
+
+        # Normalised cross-correlation of the template against every candidate
+        np.copyto(self._windows, self._hist_windows[lo:lo + 2 * self.tolerance + 1])
+        np.matmul(self._windows, template, out=self._corr)
+        energy = self._energy
+        squares = energy[1:]
+        squares[:] = region
+        squares *= squares
+        np.cumsum(squares, out=squares)
+        norm = self._score
+        np.subtract(energy[width:], energy[:-width], out=norm)
+        norm += 1e-9
+        np.sqrt(norm, out=norm)
+        ratio = self._ratio
+        ratio[:] = self._corr
+        ratio /= norm
+        return nominal - self.tolerance + int(ratio.argmax())
+
+    def process(self, x, out):
+        """Write one pitch-shifted block per input block into out (may be x itself)
+
+        Output is delayed by about latency samples.
+        """
+        n = len(x)
+        self._ensure_buffers(n)
+        hist = self._hist
+        hist[:-n] = hist[n:]
+        hist[-n:] = x
+        self._in_pos += n
+        hist_start = self._in_pos - len(hist)
+
+        pos, floor, frac, i0, i1 = self._pos, self._floor, self._frac, self._i0, self._i1
+        g0, g1 = self._g0, self._g1
+        end = self._out_pos + n
+        while self._next_grain < end:
+            nominal = self._next_grain - self.lookahead
+            start = self._find_start(nominal, hist_start)
+            # Linear-interpolated read of grain * factor input samples
+            np.add(self._offsets, start - hist_start, out=pos)
+            np.floor(pos, out=floor)
+            np.copyto(i0, floor, casting="unsafe")
+            pos -= floor
+            frac[:] = pos
+            np.add(i0, 1, out=i1)
+            np.take(hist, i0, out=g0, mode="clip")
+            np.take(hist, i1, out=g1, mode="clip")
+            g1 -= g0
+            g1 *= frac
+            g0 += g1
+            g0 *= self.window
+            offset = self._next_grain - self._out_pos
+            self._acc[offset:offset + self.grain] += g0
+            self._last_start = start
+            self._next_grain += self.hop
+
+        acc = self._acc
+        out[:] = acc[:n]
+        acc[:-n] = acc[n:]
+        acc[-n:] = 0
+        self._out_pos = end
+        return out
+
+
+# =========================
+# EFFECT CHAIN
+# =========================
+class _Stage:
+    """One enabled step of an EffectChain; process() works in place on y
+
+    retune() takes the stage's new setting (see _stage_settings) from a
+    control thread and only assigns targets that process() glides towards.
+    """
+    name = "stage"
+    latency = 0
+
+    def reset(self):
+        pass
+
+    def retune(self, value):
+        pass
+
+    def process(self, y):
+        return y
+
+
+class GainStage(_Stage):
+    name = "gain"
+
+    def __init__(self, gain_db, block_size=DEFAULT_BLOCK_SIZE):
+        self.gain = _Ramp(10 ** (gain_db / 20.0), block_size)
+
+    def retune(self, gain_db):
+        self.gain.set(10 ** (gain_db / 20.0))
+
+    def process(self, y):
+        return self.gain.apply(y)
+
+
+class DriveStage(_Stage):
+    name = "drive"
+
+    def __init__(self, drive, block_size=DEFAULT_BLOCK_SIZE):
+        self.pre_gain = _Ramp(1.0 + drive * 3.0, block_size)
+
+    def retune(self, drive):
+        self.pre_gain.set(1.0 + drive * 3.0)
+
+    def process(self, y):
+        self.pre_gain.apply(y)
+        np.tanh(y, out=y)
+        return y
+
+
+class PitchStage(_Stage):
+    name = "pitch"
+
+    def __init__(self, sample_rate, block_size, semitones):
+        self.shifter = PitchShifter(sample_rate, block_size=block_size)
+        self.shifter.set_semitones(semitones)
+        self.latency = self.shifter.latency
+
+    def reset(self):
+        self.shifter.reset()
+
+    def process(self, y):
+        return self.shifter.process(y, y)
+
+
+class FilterStage(_Stage):
+    def __init__(self, name, filt, cutoff_hz):
+        self.name = name
+        self.filter = filt
+        self.filter.set_cutoff(cutoff_hz)
+
+    def reset(self):
+        self.filter.reset()
+
+    def retune(self, cutoff_hz):
+        self.filter.glide_to(cutoff_hz)
+
+    def process(self, y):
+        return self.filter.process(y, y)
+
+
+class ChorusStage(_Stage):
+    name = "chorus"
+
+    def __init__(self, sample_rate, block_size, amount):
+        # 30 ms of modulated delay plus one block, so a whole block can be written before reading
+        size = int(sample_rate * 0.03) + block_size
+        buffers = [np.zeros(size, dtype=np.float32) for _ in range(3)]
+        self.chorus = Chorus(sample_rate, buffers, block_size=block_size)
+        self.amount = _Glide(amount)
+
+    def reset(self):
+        self.chorus.reset()
+
+    def retune(self, amount):
+        self.amount.set(amount)
+
+    def process(self, y):
+        return self.chorus.process(y, self.amount.next())
+
+
+class _OscillatorStage(_Stage):
+    """Multiplies the block by an LFO carried across blocks"""
+
+    def __init__(self, sample_rate, block_size, freq_hz):
+        self.sample_rate = sample_rate
+        self.step = 2 * math.pi * freq_hz / sample_rate
+        self.rate = _Glide(self.step, geometric=True)
+        self.index = np.arange(block_size, dtype=np.float64)
+        self.ramp = self.step * self.index
+        self.scratch = np.zeros(block_size, dtype=np.float64)
+        self.sine = np.zeros(block_size, dtype=np.float32)
+        self.phase = 0.0
+
+    def reset(self):
+        self.phase = 0.0
+
+    def retune(self, freq_hz):
+        self.rate.set(2 * math.pi * freq_hz / self.sample_rate)
+
+    def _sine(self, n):
+        step = self.rate.next()
+        if step != self.step:
+            # Phase stays continuous; only the per-sample increment changes
+            self.step = step
+            np.multiply(self.index, step, out=self.ramp)
+        # Phase in float64, then one cast into the float32 result
+        s = self.scratch[:n]
+        np.add(self.ramp[:n], self.phase, out=s)
+        np.sin(s, out=s)
+        self.phase = (self.phase + self.step * n) % (2 * math.pi)
+        out = self.sine[:n]
+        out[:] = s
+        return out
+
+
+class RingModStage(_OscillatorStage):
+    name = "ring_mod"
+
+    def process(self, y):
+        s = self._sine(len(y))
+        s *= 0.7
+        s += 1.0
+        y *= s
+        return y
+
+
+class TremoloStage(_OscillatorStage):
+    name = "tremolo"
+
+    def process(self, y):
+        s = self._sine(len(y))
+        s *= -0.5
+        s += 0.5
+        y *= s
+        return y
+
+
+class BitcrushStage(_Stage):
+    name = "bitcrusher"
+
+    def __init__(self, amount):
+        self.retune(amount)
+
+    def retune(self, amount):
+        # Quantizer steps cannot be interpolated; the new depth applies from the next block
+        self.levels = np.float32(2 ** (16 - int(amount * 12)))
+
+    def process(self, y):
+        levels = self.levels
+        y *= levels
+        np.round(y, out=y)
+        y /= levels
+        return y
+
+
+class DelayStage(_Stage):
+    name = "delay"
+
+    def __init__(self, sample_rate, block_size, delay_ms):
+        self.line = FeedbackDelay(sample_rate * 2, block_size)  # 2 seconds max delay
+        self.samples = int(sample_rate * delay_ms / 1000)
+
+    def reset(self):
+        self.line.reset()
+
+    def process(self, y):
+        wet = self.line.process(y, self.samples)
+        wet *= 0.7
+        y += wet
+        return y
+
+
+class ReverbStage(_Stage):
+    name = "reverb"
+
+    def __init__(self, sample_rate, block_size, amount, size):
+        self.reverb = Reverb(sample_rate, block_size=block_size)
+        self.dry = _Ramp(1 - amount * 0.3, block_size)
+        self.amount = _Ramp(amount, block_size)
+        self.size = _Glide(size)
+
+    def reset(self):
+        self.reverb.reset()
+
+    def retune(self, value):
+        amount, size = value
+        self.dry.set(1 - amount * 0.3)
+        self.amount.set(amount)
+        self.size.set(size)
+
+    def process(self, y):
+        wet = self.reverb.process(y, self.size.next())
+        self.amount.apply(wet)
+        self.dry.apply(y)
+        y += wet
+        return y
+
+
+class EffectChain:
+    """Enabled stages of one parameter set, with coefficients and scratch precomputed
+
+    process() runs entirely in preallocated float32 buffers and writes the
+    clipped result straight into the caller's output array.
+    """
+
+    def __init__(self, stages, mix, block_size, sample_rate, params=None):
+        self.stages = stages
+        self.wet_gain = _Ramp(mix, block_size)
+        self.dry_gain = _Ramp(1 - mix, block_size)
+        self.block_size = block_size
+        self.sample_rate = sample_rate
+        self.params = params
+        self.layout = _layout(params) if params is not None else None
+        # Set by a control thread when a used chain is handed out again;
+        # the audio thread clears the buffers before its first block.
+        self.stale = False
+        self._work = np.zeros(block_size, dtype=np.float32)
+        self._dry = np.zeros(block_size, dtype=np.float32)
+
+    @property
+    def latency(self):
+        return sum(stage.latency for stage in self.stages)
+
+    @property
+    def latency_ms(self):
+        return 1000.0 * self.latency / self.sample_rate
+
+    def reset(self):
+        for stage in self.stages:
+            stage.reset()
+
+    def retune(self, params):
+        """Glide to params in place if they enable the same layout; False if a new chain is needed"""
+        if self.layout is None or _layout(params) != self.layout:
+            return False
+        for stage, (_, value) in zip(self.stages, _stage_settings(params)):
+            stage.retune(value)
+        mix = params.get("mix", 1.0)
+        self.wet_gain.set(mix)
+        self.dry_gain.set(1 - mix)
+        self.params = params
+        return True
+
+    def process(self, x, out):
+        """Run x through the chain into out, in chunks of at most block_size"""
+        if self.stale:
+            self.reset()
+            self.stale = False
+        if len(x) <= self.block_size:
+            self._process_block(x, out)
+            return out
+        for start in range(0, len(x), self.block_size):
+            end = min(start + self.block_size, len(x))
+            self._process_block(x[start:end], out[start:end])
+        return out
+
+    def _process_block(self, x, out):
+        n = len(x)
+        y = self._work[:n]
+        np.copyto(y, x)
+        for stage in self.stages:
+            stage.process(y)
+        self._mix(x, y, out)
+
+    def _mix(self, x, y, out):
+        # DRY/WET mix
+        wet, dry_gain = self.wet_gain, self.dry_gain
+        if wet.value < 1.0 or wet.target < 1.0:
+            dry = self._dry[:len(x)]
+            dry_gain.apply(x, out=dry)
+            wet.apply(y)
+            y += dry
+
+        np.clip(y, -1.0, 1.0, out=out)
+
+    def process_timed(self, x, out, timings, clock):
+        """Same as process() for one block, adding each stage's clock() time to timings[name]"""
+        n = len(x)
+        y = self._work[:n]
+        np.copyto(y, x)
+        for stage in self.stages:
+            start = clock()
+            stage.process(y)
+            timings[stage.name] = timings.get(stage.name, 0.0) + clock() - start
+
+        start = clock()
+        self._mix(x, y, out)
+        timings["mix"] = timings.get("mix", 0.0) + clock() - start
+        return out
+
+
+def _stage_settings(params):
+    """(stage name, setting) for every stage params enable, in processing order"""
+    p = params or {}
+    settings = []
+
+    if p.get("gain", 0) != 0:
+        settings.append(("gain", p["gain"]))
+    if p.get("drive", 0) > 0:
+        settings.append(("drive", p["drive"]))
+    if p.get("pitch", 0) != 0:
+        settings.append(("pitch", p["pitch"]))
+
+    tone = p.get("tone", 0.5)
+    if tone < 0.5:
+        settings.append(("tone", 1000 + 15000 * (tone * 2)))
+    if p.get("low_pass", 0) > 0:
+        settings.append(("low_pass", p["low_pass"]))
+    if p.get("high_pass", 0) > 0:
+        settings.append(("high_pass", p["high_pass"]))
+
+    if p.get("chorus", 0) > 0:
+        settings.append(("chorus", p["chorus"]))
+    if p.get("ring_mod", 0) > 0:
+        settings.append(("ring_mod", p["ring_mod"]))
+    if p.get("bitcrusher", 0) > 0:
+        settings.append(("bitcrusher", p["bitcrusher"]))
+    if p.get("delay", 0) > 0:
+        settings.append(("delay", p["delay"]))
+    if p.get("reverb", 0) > 0:
+        settings.append(("reverb", (p["reverb"], p.get("reverb_size", 0.0))))
+    if p.get("tremolo", 0) > 0:
+        settings.append(("tremolo", p["tremolo"]))
+    return settings
+
+
+# Settings that change buffer layout or latency; any change needs a new chain
+_FIXED_SETTINGS = ("pitch", "delay")
+
+
+def _layout(params):
+    return tuple(
+        (name, value if name in _FIXED_SETTINGS else None)
+        for name, value in _stage_settings(params)
+    )
+
+
+def can_retune(params, new_params):
+    """True if a chain built for params glides to new_params in place (see EffectChain.retune)"""
+    if params is None or new_params is None:
+        return False
+    layout = _layout(params)
+    return bool(layout) and _layout(new_params) == layout
+
+
+def chain_latency_ms(params, sample_rate):
+    """Latency of the chain build_chain(params) makes, without building it"""
+    semitones = dict(_stage_settings(params)).get("pitch")
+    if semitones is None:
+        return 0.0
+    return 1000.0 * _pitch_geometry(semitones)[2] / sample_rate
+
+
+def build_chain(params, sample_rate, block_size):
+    """Compile effect parameters into an EffectChain, or None if nothing is enabled"""
+    stages = []
+    for name, value in _stage_settings(params):
+        if name == "gain":
+            stages.append(GainStage(value, block_size))
+        elif name == "drive":
+            stages.append(DriveStage(value, block_size))
+        elif name == "pitch":
+            stages.append(PitchStage(sample_rate, block_size, value))
+        elif name in ("tone", "low_pass"):
+            stages.append(FilterStage(name, OnePoleLowPass(sample_rate, block_size), value))
+        elif name == "high_pass":
+            stages.append(FilterStage(name, OnePoleHighPass(sample_rate, block_size), value))
+        elif name == "chorus":
+            stages.append(ChorusStage(sample_rate, block_size, value))
+        elif name == "ring_mod":
+            stages.append(RingModStage(sample_rate, block_size, value))
+        elif name == "bitcrusher":
+            stages.append(BitcrushStage(value))
+        elif name == "delay":
+            stages.append(DelayStage(sample_rate, block_size, value))
+        elif name == "reverb":
+            stages.append(ReverbStage(sample_rate, block_size, *value))
+        elif name == "tremolo":
+            stages.append(TremoloStage(sample_rate, block_size, value))
+
+    if not stages:
+        return None
+    return EffectChain(stages, (params or {}).get("mix", 1.0), block_size, sample_rate, params)
+
+
+# =========================
+# CHAIN SWITCHING
+# =========================
+class ChainSwitcher:
+    """Renders the current EffectChain and moves to a posted one with an equal-power crossfade
+
+    post() runs on control threads and only swaps a reference. The audio thread
+    picks the new chain up on its next block, and hands chains it has finished
+    with back through retired() so they are freed (or reused) off the audio thread.
+    None stands for pass-through.
+    """
+
+    def __init__(self, sample_rate, block_size=DEFAULT_BLOCK_SIZE, fade_ms=CROSSFADE_MS, chain=None):
+        self.sample_rate = sample_rate
+        self.block_size = block_size
+        self._posted = self._taken = (chain,)
+        self.chain = chain
+        self.switches = 0  # chains taken by the audio thread so far
+        self._old = None
+        self._fading = False
+        self._pos = 0
+
+        n = max(1, int(sample_rate * fade_ms / 1000))
+        t = (np.arange(n) + 0.5) / n
+        self._fade_in = np.sin(0.5 * math.pi * t).astype(np.float32)
+        self._fade_out = np.cos(0.5 * math.pi * t).astype(np.float32)
+        self._old_out = np.zeros(block_size, dtype=np.float32)
+        self._retired = [None] * 8
+        self._retired_index = 0
+
+    @property
+    def current(self):
+        """The most recently posted chain"""
+        return self._posted[0]
+
+    def post(self, chain):
+        self._posted = (chain,)
+
+    def retired(self):
+        """Chains the audio thread no longer uses; clears the hand-back slots"""
+        chains = []
+        for i, chain in enumerate(self._retired):
+            if chain is not None:
+                self._retired[i] = None
+                chains.append(chain)
+        return chains
+
+    def _retire(self, chain):
+        if chain is not None:
+            self._retired[self._retired_index] = chain
+            self._retired_index = (self._retired_index + 1) % len(self._retired)
+
+    def _render(self, chain, x, out):
+        if chain is None:
+            np.clip(x, -1.0, 1.0, out=out)
+        else:
+            chain.process(x, out)
+
+    def process(self, x, out):
+        posted = self._posted
+        # A switch posted mid-fade waits for that fade to finish rather than cutting it
+        if posted is not self._taken and not self._fading:
+            self._taken = posted
+            new = posted[0]
+            if new is not self.chain:
+                self._old, self.chain = self.chain, new
+                self._fading = True
+                self._pos = 0
+                self.switches += 1
+
+        self._render(self.chain, x, out)
+        if not self._fading:
+            return out
+
+        n = len(x)
+        self._old_out = _grow(self._old_out, n)
+        prev = self._old_out[:n]
+        self._render(self._old, x, prev)
+        pos = self._pos
+        m = min(n, len(self._fade_in) - pos)
+        out[:m] *= self._fade_in[pos:pos + m]
+        prev[:m] *= self._fade_out[pos:pos + m]
+        out[:m] += prev[:m]
+        self._pos = pos + m
+        if self._pos >= len(self._fade_in):
+            self._fading = False
+            self._retire(self._old)
+            self._old = None
+        return out
+
+
+# =========================
+# DIAGNOSTICS
+# =========================
+# A steady-state block allocates no array buffers: every stage works in its
+# own preallocated float32/float64 scratch through out= ufuncs and slice
+# assignment. What tracemalloc still sees are Python objects NumPy cannot
+# avoid, each freed when its statement ends:
+#   - the ndarray header of every slice view (buf[:n], x[start:start + m]),
+#     about 100 bytes plus shape/strides;
+#   - bound methods and the ints/floats outside CPython's small-object caches
+#     (ring positions, carried filter state, glide values).
+# None of them grows with the block, while an array temporary does, so a
+# chain counts as allocation-free when its per-block peak stays under
+# OBJECT_CHURN_BYTES and grows by at most BLOCK_GROWTH_BYTES between the
+# smallest and largest of ALLOCATION_BLOCK_SIZES (a float32 temporary at
+# 4096 frames alone is 16 KB). Measured: chains peak at 1.5-2.3 KB per block,
+# the full modulator callback at 2.2-2.8 KB.
+OBJECT_CHURN_BYTES = 3072
+BLOCK_GROWTH_BYTES = 512
+ALLOCATION_BLOCK_SIZES = (256, 4096)
+
+
+def measure_allocations(process, blocks=200, warmup=20):
+    """Peak bytes allocated above baseline by one call of process(), in steady state
+
+    Uses tracemalloc, so it counts every allocation including short-lived
+    Python objects such as slice views; array buffers show up as kilobytes.
+    """
+    import tracemalloc
+
+    for _ in range(warmup):
+        process()
+    tracemalloc.start()
+    try:
+        worst = 0
+        for _ in range(blocks):
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            process()
+            worst = max(worst, tracemalloc.get_traced_memory()[1] - before)
+    finally:
+        tracemalloc.stop()
+    return worst
+
+
+def allocation_profile(make_process, sizes=ALLOCATION_BLOCK_SIZES):
+    """({block size: peak bytes per block}, allocation-free?) in steady state
+
+    make_process(n) returns a callable that processes one block of n frames.
+    """
+    peaks = {n: measure_allocations(make_process(n)) for n in sizes}
+    growth = peaks[max(sizes)] - peaks[min(sizes)]
+    return peaks, max(peaks.values()) <= OBJECT_CHURN_BYTES and growth <= BLOCK_GROWTH_BYTES
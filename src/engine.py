@@ -0,0 +1,293 @@
+"""Voice DSP in its own process, driven through shared memory
+
+With MODULATOR_ENGINE=process the sounddevice stream and every effect chain
+run in a child process with its own GIL, so API requests, the mpv threads and
+the WebSocket loop in the server process cannot hold up the audio callback.
+
+The server writes parameters, routing and stream commands into a ControlBlock.
+The engine polls it from a control thread (never from the audio callback) and
+writes callback stats back through a CallbackMonitor kept in the same block.
+Every field has a single writer, and neither process ever waits on a lock the
+other one holds.
+"""
+import multiprocessing as mp
+import os
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from .monitor import CallbackMonitor
+
+ENGINE_POLL_SECONDS = 0.005  # how often the engine looks for control changes
+ENGINE_START_TIMEOUT = 60.0  # child imports, Numba cache load (or a cold compile)
+ENGINE_COMMAND_TIMEOUT = 5.0  # stream open/close round trip
+
+# Header slots (int64)
+_STREAM_SEQ, _BLOCK_SIZE, _RUNNING, _STREAM_ACK, _ROUTING_SEQ, _READY, _STOP = range(7)
+_HEADER = 8
+_ERROR_BYTES = 256
+
+
+def _aligned(n):
+    return (n + 7) // 8 * 8
+
+# =========================
+# CONTROL BLOCK
+# =========================
+class ControlBlock:
+    """Parameters, routing and stream commands for one engine process, plus its callback monitor
+
+    The server writes params, routing and commands; the engine writes command
+    acknowledgements, stream latency and the monitor. Multi-value fields are
+    read under a sequence counter: odd while the writer is mid-copy, and the
+    reader retries if it changed during its copy. This relies on stores
+    reaching the other process in program order, which holds on x86-64 and for
+    the word-sized counters numpy writes here.
+    """
+
+    def __init__(self, channels, outputs, keys, name=None):
+        """Create a new block, or attach to the one called name"""
+        self.channels = channels
+        self.outputs = outputs
+        self.keys = tuple(keys)
+        layout = (
+            ("header", np.int64, (_HEADER,)),
+            ("latency", np.float64, (2,)),
+            ("error_bytes", np.uint8, (_ERROR_BYTES,)),
+            ("param_seq", np.int64, (channels,)),
+            # column 0: 1.0 if an effect is on, then one value per key
+            ("params", np.float64, (channels, len(self.keys) + 1)),
+            ("routing", np.float32, (channels, outputs)),
+        )
+        sizes = [_aligned(np.dtype(dtype).itemsize * int(np.prod(shape))) for _, dtype, shape in layout]
+        size = sum(sizes) + CallbackMonitor.nbytes()
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.name = self.shm.name
+
+        offset = 0
+        for (field, dtype, shape), nbytes in zip(layout, sizes):
+            setattr(self, field, np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=offset))
+            offset += nbytes
+        self.monitor = self.shm.buf[offset:]
+        self._write_lock = threading.Lock()  # server threads only
+
+    def close(self, unlink=False):
+        # Views must go before the mapping can close
+        for field in ("header", "latency", "error_bytes", "param_seq", "params", "routing", "monitor"):
+            setattr(self, field, None)
+        try:
+            self.shm.close()
+        except BufferError:  # a monitor still holds a view; the mapping goes with the process
+            pass
+        if unlink:
+            self.shm.unlink()
+
+    @staticmethod
+    def _read(seq, i, field):
+        """(sequence number, copy of field) once the writer is not mid-copy"""
+        while True:
+            before = int(seq[i])
+            if before & 1:
+                time.sleep(0)
+                continue
+            data = field.copy()
+            if int(seq[i]) == before:
+                return before, data
+
+    # -------------------------
+    # Server side
+    # -------------------------
+    def post_params(self, channel, params):
+        """Publish a channel's parameters (None: effect off)"""
+        with self._write_lock:
+            self.param_seq[channel] += 1
+            row = self.params[channel]
+            row[0] = params is not None
+            if params is not None:
+                row[1:] = [params[key] for key in self.keys]
+            self.param_seq[channel] += 1
+
+    def set_routing(self, routing):
+        with self._write_lock:
+            self.header[_ROUTING_SEQ] += 1
+            self.routing[:] = routing
+            self.header[_ROUTING_SEQ] += 1
+
+    def command(self, block_size, running):
+        """Ask for the stream to run at block_size (or stop); returns the command's sequence number"""
+        with self._write_lock:
+            self.header[_BLOCK_SIZE] = block_size
+            self.header[_RUNNING] = running
+            self.header[_STREAM_SEQ] += 1
+            return int(self.header[_STREAM_SEQ])
+
+    def acknowledged(self, seq):
+        return int(self.header[_STREAM_ACK]) >= seq
+
+    @property
+    def error(self):
+        return bytes(self.error_bytes).rstrip(b"\0").decode("utf-8", "replace")
+
+    # -------------------------
+    # Engine side
+    # -------------------------
+    def read_params(self, channel):
+        """(sequence number, params dict or None)"""
+        seq, row = self._read(self.param_seq, channel, self.params[channel])
+        if not row[0]:
+            return seq, None
+        return seq, dict(zip(self.keys, row[1:].tolist()))
+
+    def read_routing(self):
+        return self._read(self.header, _ROUTING_SEQ, self.routing)
+
+    def acknowledge(self, seq, latency=(0.0, 0.0), error=""):
+        """Report a finished stream command; a non-empty error fails it"""
+        self.latency[:] = latency
+        message = error.encode("utf-8")[:_ERROR_BYTES - 1]
+        self.error_bytes[:] = 0
+        self.error_bytes[:len(message)] = np.frombuffer(message, dtype=np.uint8)
+        self.header[_STREAM_ACK] = seq
+
+
+def serve(control, on_params, on_routing, on_stream, poll=ENGINE_POLL_SECONDS):
+    """Engine side: apply control changes until the server stops it or goes away
+
+    on_params(channel, params), on_routing(matrix) and on_stream(block_size, running)
+    run on this thread; on_stream returns the stream's (input, output) latency.
+    """
+    parent = os.getppid()
+    header = control.header
+    seen_params = [0] * control.channels
+    seen_routing = seen_stream = 0
+    header[_READY] = 1
+    while not header[_STOP] and os.getppid() == parent:
+        for channel in range(control.channels):
+            if int(control.param_seq[channel]) != seen_params[channel]:
+                seen_params[channel], params = control.read_params(channel)
+                on_params(channel, params)
+
+        if int(header[_ROUTING_SEQ]) != seen_routing:
+            seen_routing, routing = control.read_routing()
+            on_routing(routing)
+
+        seq = int(header[_STREAM_SEQ])
+        if seq != seen_stream:
+            seen_stream = seq
+            try:
+                latency = on_stream(int(header[_BLOCK_SIZE]), bool(header[_RUNNING]))
+                control.acknowledge(seq, latency)
+            except Exception as e:
+                control.acknowledge(seq, error=str(e) or type(e).__name__)
+
+        time.sleep(poll)
+    on_stream(0, False)
+
+# =========================
+# SERVER SIDE
+# =========================
+class EngineProcess:
+    """Server-side handle: target(name) runs in a fresh interpreter attached to the ControlBlock name"""
+
+    def __init__(self, target, channels, outputs, keys):
+        self.control = ControlBlock(channels, outputs, keys)
+        self.monitor = CallbackMonitor(buffer=self.control.monitor)
+        self.monitor.reset()
+        self._posted = [None] * channels
+        # spawn, not fork: the server process has threads (uvicorn, mpv watchers) mid-flight
+        self.process = mp.get_context("spawn").Process(
+            target=target, args=(self.control.name,), name="modulator-engine", daemon=True
+        )
+        self._closed = False
+
+    @property
+    def pid(self):
+        return self.process.pid
+
+    @property
+    def alive(self):
+        return not self._closed and self.process.is_alive()
+
+    def start(self, routing, timeout=ENGINE_START_TIMEOUT):
+        self.control.set_routing(routing)
+        self.process.start()
+        deadline = time.monotonic() + timeout
+        while not self.control.header[_READY]:
+            if not self.process.is_alive():
+                self.close()
+                raise RuntimeError(f"Modulator engine exited during start-up (code {self.process.exitcode})")
+            if time.monotonic() > deadline:
+                self.close()
+                raise RuntimeError("Modulator engine did not start in time")
+            time.sleep(0.01)
+
+    def params(self, channel):
+        """Parameters last posted on channel"""
+        return self._posted[channel]
+
+    def post(self, channel, params):
+        self._posted[channel] = params
+        self.control.post_params(channel, params)
+
+    def set_routing(self, routing):
+        self.control.set_routing(routing)
+
+    def command(self, block_size, running, timeout=ENGINE_COMMAND_TIMEOUT):
+        """Open (at block_size) or close the engine's stream and wait until it has"""
+        seq = self.control.command(block_size, running)
+        deadline = time.monotonic() + timeout
+        while not self.control.acknowledged(seq):
+            if not self.alive:
+                raise RuntimeError("Modulator engine is not running")
+            if time.monotonic() > deadline:
+                raise RuntimeError("Modulator engine did not answer in time")
+            time.sleep(0.001)
+        error = self.control.error
+        if error:
+            raise RuntimeError(error)
+
+    @property
+    def latency(self):
+        input_latency, output_latency = self.control.latency
+        return float(input_latency), float(output_latency)
+
+    def close(self):
+        """Stop the child (politely, then not) and free the shared memory"""
+        if self._closed:
+            return
+        self._closed = True
+        if self.process.pid is not None:
+            self.control.header[_STOP] = 1
+            self.process.join(2.0)
+            if self.process.is_alive():
+                self.process.terminate()
+                self.process.join(1.0)
+        self.monitor = None
+        self.control.close(unlink=True)
+
+
+class EngineStream:
+    """Stands in for sd.Stream in the server process; the real stream runs in the engine"""
+
+    def __init__(self, engine, block_size):
+        self.engine = engine
+        self.blocksize = block_size
+
+    @property
+    def latency(self):
+        return self.engine.latency
+
+    def start(self):
+        self.engine.command(self.blocksize, True)
+
+    def stop(self):
+        if self.engine.alive:
+            self.engine.command(self.blocksize, False)
+
+    def close(self):
+        pass
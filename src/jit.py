@@ -0,0 +1,58 @@
+"""Numba kernels for the recursive loops in dsp.py (one-pole, feedback delay, reverb comb)
+
+Only imported when the numba backend is selected. Every kernel has an explicit
+signature, so it compiles (or loads from the on-disk cache) at import time and
+never inside an audio callback.
+"""
+import numba as nb
+import numpy as np
+
+_f32 = nb.float32[:]
+
+
+@nb.njit(nb.float64(_f32, _f32, nb.float64, nb.float64, nb.float64), cache=True, nogil=True)
+def one_pole(x, out, state, coef, gain):
+    """y[n] = coef * y[n-1] + gain * x[n] into out (may alias x); returns the last y"""
+    y = state
+    for i in range(x.shape[0]):
+        y = coef * y + gain * x[i]
+        out[i] = y
+    return y
+
+
+@nb.njit(nb.int64(_f32, _f32, _f32, _f32, nb.int64, nb.int64), cache=True, nogil=True)
+def feedback_delay(x, wet, buffer, feedback, index, delay):
+    """FeedbackDelay.process, one sample at a time; returns the new write index"""
+    size = buffer.shape[0]
+    read = index - delay
+    if read < 0:
+        read += size
+    for i in range(x.shape[0]):
+        w = np.float32(0.6) * buffer[read] + np.float32(0.3) * feedback[read]
+        wet[i] = w
+        buffer[index] = x[i]
+        feedback[index] = np.float32(0.5) * w
+        index += 1
+        if index == size:
+            index = 0
+        read += 1
+        if read == size:
+            read = 0
+    return index
+
+
+@nb.njit(nb.types.Tuple((nb.int64, nb.float64))(_f32, _f32, _f32, nb.int64, nb.float64, nb.float64, nb.float64, nb.float64),
+         cache=True, nogil=True)
+def comb(x, acc, buffer, index, state, feedback, coef, gain):
+    """_Comb.process: add the damped comb output into acc; returns (index, filter state)"""
+    size = buffer.shape[0]
+    fb = np.float32(feedback)
+    for i in range(x.shape[0]):
+        delayed = buffer[index]
+        acc[i] += delayed
+        state = coef * state + gain * delayed
+        buffer[index] = np.float32(state) * fb + x[i]
+        index += 1
+        if index == size:
+            index = 0
+    return index, state
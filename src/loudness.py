@@ -0,0 +1,430 @@
+"""EBU R128 loudness index of the audio library
+
+Every audio file under the library root is measured once (integrated
+loudness per ITU-R BS.1770 with R128 gating, and sample peak) in a pool of
+worker processes, one file per job. Results are kept in a JSON index keyed by
+path, size and mtime: a rescan only measures files that are new or changed
+and drops the ones that are gone. Players look the gain up in memory:
+
+    python -m src.loudness
+    python -m src.loudness --workers 4 --target -18
+"""
+import argparse
+import json
+import math
+import multiprocessing as mp
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+from scipy.io import wavfile
+from scipy.signal import sosfilt
+
+from .pcm_cache import SAMPLE_RATE, CHANNELS, _decode_mpv
+from .utils import list_audio_files
+
+try:
+    import soundfile as sf
+except (ImportError, OSError):  # libsndfile missing: WAV through scipy, the rest through mpv
+    sf = None
+
+INDEX_NAME = ".loudness.json"  # kept in the library root
+TARGET_LUFS = -18.0  # ReplayGain 2.0 reference level
+MAX_GAIN_DB = 12.0  # largest correction either way
+PEAK_CEILING_DB = -1.0  # a boost stops where the sample peak would pass this
+CHUNK_SECONDS = 10  # decoded audio held at once per worker
+SAVE_SECONDS = 5.0  # how often a running scan writes the index
+RESCAN_SECONDS = 60.0  # how often the library is checked for changes
+WORKER_NICE = 10  # analysis runs below the audio threads' priority
+CLOSE_SECONDS = 2.0  # how long close() waits for the scan thread to wind down
+
+ABSOLUTE_GATE = -70.0
+RELATIVE_GATE = -10.0
+
+
+# =========================
+# MEASUREMENT
+# =========================
+def _k_weighting(rate):
+    """Second-order sections of the BS.1770 K-weighting filter at rate"""
+    # Pre-filter (high shelf), from the 48 kHz reference coefficients
+    f0, gain, q = 1681.974450955533, 3.999843853973347, 0.7071752369554196
+    k = math.tan(math.pi * f0 / rate)
+    vh = 10 ** (gain / 20)
+    vb = vh ** 0.4996667741545416
+    a0 = 1 + k / q + k * k
+    shelf = [
+        (vh + vb * k / q + k * k) / a0, 2 * (k * k - vh) / a0, (vh - vb * k / q + k * k) / a0,
+        1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0,
+    ]
+    # RLB weighting (high pass)
+    f0, q = 38.13547087602444, 0.5003270373238773
+    k = math.tan(math.pi * f0 / rate)
+    a0 = 1 + k / q + k * k
+    highpass = [1.0, -2.0, 1.0, 1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0]
+    return np.array([shelf, highpass])
+
+
+def _channel_weights(channels):
+    # Mono is heard on both speakers of the stereo mix, as mpv upmixes it
+    if channels == 1:
+        return np.array([2.0])
+    weights = np.ones(channels)
+    if channels >= 6:  # L R C LFE Ls Rs ...
+        weights[3] = 0.0
+        weights[4:6] = 1.41
+    return weights
+
+
+def _chunks(path):
+    """(sample_rate, iterator of (frames, channels) float32 chunks) of path"""
+    if sf is not None:
+        info = sf.info(path)
+
+        def read():
+            with sf.SoundFile(path) as f:
+                yield from f.blocks(info.samplerate * CHUNK_SECONDS, dtype="float32", always_2d=True)
+        return info.samplerate, read()
+
+    if path.lower().endswith(".wav"):
+        rate, data = wavfile.read(path, mmap=True)
+        if data.ndim == 1:
+            data = data[:, None]
+
+        def read():
+            step = rate * CHUNK_SECONDS
+            for start in range(0, len(data), step):
+                chunk = np.asarray(data[start:start + step])
+                if chunk.dtype.kind in "iu":
+                    scale = float(np.iinfo(chunk.dtype).max) + 1.0
+                    offset = scale if chunk.dtype.kind == "u" else 0.0
+                    chunk = (chunk.astype(np.float32) - offset) / scale
+                yield chunk.astype(np.float32, copy=False)
+        return rate, read()
+
+    def read():
+        # mp3/ogg without libsndfile: mpv decodes to a temporary raw file, read back in chunks
+        fd, tmp = tempfile.mkstemp(suffix=".f32")
+        os.close(fd)
+        try:
+            _decode_mpv(path, tmp, SAMPLE_RATE, CHANNELS)
+            frames = os.path.getsize(tmp) // (4 * CHANNELS)
+            if frames:
+                data = np.memmap(tmp, dtype=np.float32, mode="r", shape=(frames, CHANNELS))
+                step = SAMPLE_RATE * CHUNK_SECONDS
+                for start in range(0, frames, step):
+                    yield np.array(data[start:start + step])
+                del data
+        finally:
+            os.remove(tmp)
+    return SAMPLE_RATE, read()
+
+
+def measure(path):
+    """{"lufs", "peak_db", "seconds"} of one file; lufs is None for silence or under 400 ms of audio
+
+    The K-weighted signal is reduced to mean squares per 100 ms segment as it
+    streams through, so memory stays at one chunk whatever the file's length;
+    gating blocks are 400 ms, i.e. four consecutive segments (75% overlap).
+    """
+    rate, chunks = _chunks(path)
+    sos = _k_weighting(rate)
+    segment = int(round(rate * 0.1))
+    zi = None
+    weights = None
+    carry = None  # filtered frames not yet filling a segment
+    energies = []  # per segment: weighted sum over channels of the mean square
+    peak = 0.0
+    frames = 0
+
+    for chunk in chunks:
+        if not len(chunk):
+            continue
+        frames += len(chunk)
+        peak = max(peak, float(np.max(np.abs(chunk))))
+        if zi is None:
+            weights = _channel_weights(chunk.shape[1])
+            zi = np.zeros((len(sos), 2, chunk.shape[1]))
+        filtered, zi = sosfilt(sos, chunk.astype(np.float64), axis=0, zi=zi)
+        if carry is not None:
+            filtered = np.concatenate([carry, filtered])
+        whole = len(filtered) // segment * segment
+        if whole:
+            squares = filtered[:whole].reshape(-1, segment, filtered.shape[1]) ** 2
+            energies.append(squares.mean(axis=1) @ weights)
+        carry = filtered[whole:]
+
+    peak_db = 20 * math.log10(peak) if peak > 0 else None
+    result = {"lufs": None, "peak_db": None if peak_db is None else round(peak_db, 2), "seconds": round(frames / rate, 3)}
+    if not energies:
+        return result
+    segments = np.concatenate(energies)
+    if len(segments) < 4:
+        return result
+
+    blocks = (segments[:-3] + segments[1:-2] + segments[2:-1] + segments[3:]) / 4
+    with np.errstate(divide="ignore"):
+        loudness = -0.691 + 10 * np.log10(blocks)
+    gated = blocks[loudness > ABSOLUTE_GATE]
+    if not len(gated):
+        return result
+    relative = -0.691 + 10 * math.log10(gated.mean()) + RELATIVE_GATE
+    gated = blocks[(loudness > ABSOLUTE_GATE) & (loudness > relative)]
+    result["lufs"] = round(-0.691 + 10 * math.log10(gated.mean()), 2)
+    return result
+
+
+def gain_for(lufs, peak_db, target=TARGET_LUFS):
+    """dB that bring a track from lufs to target: boosts stop short of clipping, both ways within MAX_GAIN_DB"""
+    if lufs is None:
+        return 0.0
+    gain = target - lufs
+    if gain > 0 and peak_db is not None:
+        gain = min(gain, max(0.0, PEAK_CEILING_DB - peak_db))
+    return round(max(-MAX_GAIN_DB, min(MAX_GAIN_DB, gain)), 2)
+
+
+def _lower_priority():
+    try:
+        os.nice(WORKER_NICE)
+    except (AttributeError, OSError):
+        pass
+
+# =========================
+# INDEX
+# =========================
+def _stop_pool(pool):
+    """Cancel queued measurements and kill the running ones instead of waiting for them"""
+    processes = list((pool._processes or {}).values())  # shutdown() drops the table
+    pool.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+
+class LoudnessIndex:
+    """Measured loudness of every audio file under root, persisted at path (default: root/INDEX_NAME)
+
+    A background thread scans the library when started, every RESCAN_SECONDS
+    after that and on scan(); each scan measures only new or changed files, in
+    a process pool of workers (default: all cores) that exists while it runs.
+    gain_db() never blocks on analysis: an unmeasured or changed file gets 0 dB
+    until the scan reaches it.
+    """
+
+    def __init__(self, root, path=None, target=TARGET_LUFS, workers=None, rescan_seconds=RESCAN_SECONDS):
+        self.root = root
+        self.path = path or os.path.join(root, INDEX_NAME)
+        self.target = target
+        self.workers = workers or os.cpu_count() or 1
+        self.rescan_seconds = rescan_seconds
+        self.pending = 0
+        self.measured = 0
+        self.failed = 0
+        self.last_scan = None  # {"files", "measured", "removed", "elapsed_s"}
+        self._entries = {}  # path relative to root -> {"size", "mtime_ns", "lufs", "peak_db", ...}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._pool = None
+        self._closed = False
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        self._entries = data.get("files", {})
+        if data.get("target") != self.target:  # gains depend on the target; measurements do not
+            for entry in self._entries.values():
+                entry["gain_db"] = gain_for(entry.get("lufs"), entry.get("peak_db"), self.target)
+
+    def _save(self):
+        with self._lock:
+            data = {"target": self.target, "files": dict(self._entries)}
+        tmp = self.path + ".part"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+
+    # -------------------------
+    # Lookups
+    # -------------------------
+    def gain_db(self, full_path):
+        """Gain for full_path at the target level; 0.0 while it is unmeasured or changed since"""
+        rel = os.path.relpath(full_path, self.root)
+        with self._lock:
+            entry = self._entries.get(rel)
+        if entry is None:
+            self._wake.set()
+            return 0.0
+        try:
+            st = os.stat(full_path)
+        except OSError:
+            return 0.0
+        if st.st_mtime_ns != entry["mtime_ns"] or st.st_size != entry["size"]:
+            self._wake.set()
+            return 0.0
+        return entry.get("gain_db", 0.0)
+
+    def get(self, full_path):
+        with self._lock:
+            return self._entries.get(os.path.relpath(full_path, self.root))
+
+    def stats(self):
+        with self._lock:
+            files = len(self._entries)
+            loud = [e["lufs"] for e in self._entries.values() if e.get("lufs") is not None]
+        return {
+            "target_lufs": self.target,
+            "files": files,
+            "pending": self.pending,
+            "measured": self.measured,
+            "failed": self.failed,
+            "workers": self.workers,
+            "lufs_range": [min(loud), max(loud)] if loud else None,
+            "last_scan": self.last_scan,
+        }
+
+    # -------------------------
+    # Scanning
+    # -------------------------
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._scan_loop, name="loudness-scan", daemon=True)
+            self._thread.start()
+
+    def scan(self):
+        """Check the library for new or changed files now (in the background)"""
+        self._wake.set()
+
+    def close(self):
+        """Stop scanning without waiting for the file being measured; its result is dropped"""
+        self._closed = True
+        self._wake.set()
+        pool = self._pool
+        if pool is not None:
+            _stop_pool(pool)
+        if self._thread is not None:
+            self._thread.join(CLOSE_SECONDS)
+
+    def _changes(self):
+        """(files to measure as (rel, size, mtime_ns), entries gone from disk)"""
+        current = {}
+        for rel in list_audio_files(self.root):
+            if rel.startswith("."):
+                continue  # the PCM cache and other hidden state
+            try:
+                st = os.stat(os.path.join(self.root, rel))
+            except OSError:
+                continue
+            current[rel] = (st.st_size, st.st_mtime_ns)
+        with self._lock:
+            stale = [
+                (rel, size, mtime) for rel, (size, mtime) in sorted(current.items())
+                if rel not in self._entries
+                or (self._entries[rel]["size"], self._entries[rel]["mtime_ns"]) != (size, mtime)
+            ]
+            removed = [rel for rel in self._entries if rel not in current]
+        return stale, removed
+
+    def run_scan(self):
+        """One incremental scan in the calling thread; returns its summary"""
+        start = time.perf_counter()
+        stale, removed = self._changes()
+        with self._lock:
+            for rel in removed:
+                del self._entries[rel]
+        measured = 0
+        self.pending = len(stale)
+        if stale:
+            saved = time.monotonic()
+            context = mp.get_context("spawn")  # no fork of a server full of threads
+            workers = min(self.workers, len(stale))
+            pool = ProcessPoolExecutor(workers, mp_context=context, initializer=_lower_priority)
+            self._pool = pool
+            try:
+                futures = {
+                    pool.submit(measure, os.path.join(self.root, rel)): (rel, size, mtime)
+                    for rel, size, mtime in stale
+                }
+                for future in as_completed(futures):
+                    if self._closed or future.cancelled():
+                        break
+                    rel, size, mtime = futures[future]
+                    entry = {"size": size, "mtime_ns": mtime}
+                    try:
+                        entry.update(future.result())
+                        measured += 1
+                        self.measured += 1
+                    except BrokenProcessPool:
+                        break  # a worker died: what is left waits for the next scan
+                    except Exception as e:
+                        # kept, so it is not retried until the file changes
+                        entry.update({"lufs": None, "peak_db": None, "error": str(e)})
+                        self.failed += 1
+                    entry["gain_db"] = gain_for(entry["lufs"], entry["peak_db"], self.target)
+                    with self._lock:
+                        self._entries[rel] = entry
+                    self.pending -= 1
+                    if time.monotonic() - saved > SAVE_SECONDS:
+                        self._save()
+                        saved = time.monotonic()
+            finally:
+                self._pool = None
+                if self._closed:
+                    _stop_pool(pool)
+                else:
+                    pool.shutdown(wait=True)
+        if stale or removed or not os.path.exists(self.path):
+            self._save()
+        self.pending = 0
+        self.last_scan = {
+            "files": len(self._entries),
+            "measured": measured,
+            "removed": len(removed),
+            "elapsed_s": round(time.perf_counter() - start, 3),
+        }
+        return self.last_scan
+
+    def _scan_loop(self):
+        while not self._closed:
+            try:
+                self.run_scan()
+            except Exception as e:
+                if not self._closed:  # close() pulls the pool from under a running scan
+                    print(f"⚠️ Loudness scan failed: {e}")
+            self._wake.wait(self.rescan_seconds)
+            self._wake.clear()
+
+# =========================
+# CLI
+# =========================
+def main(argv=None):
+    data_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
+
+    parser = argparse.ArgumentParser(description="Measure the loudness of every file under data/ (incremental)")
+    parser.add_argument("--root", default=data_dir, help="library root (default: data/)")
+    parser.add_argument("--index", default=None, help=f"index file (default: <root>/{INDEX_NAME})")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--target", type=float, default=TARGET_LUFS, help="target loudness in LUFS")
+    args = parser.parse_args(argv)
+
+    index = LoudnessIndex(args.root, args.index, args.target, args.workers)
+    report = index.run_scan()
+    for rel, entry in sorted(index._entries.items()):
+        if entry.get("error"):
+            print(f"FAILED {rel}: {entry['error']}", file=sys.stderr)
+        else:
+            print(f"{rel}  {entry['lufs']} LUFS, peak {entry['peak_db']} dBFS -> {entry['gain_db']:+.2f} dB")
+    print(f"{report['measured']} measured, {report['removed']} removed, {report['files']} indexed in {report['elapsed_s']:.1f} s")
+    return 1 if index.failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,5 @@
 import asyncio
+from typing import Optional
 from fastapi import FastAPI, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
@@ -22,7 +23,21 @@ from .audio import (
     set_ambient_crossfade_time,
     set_ambient_loop_mode,
     play_fx,
-    set_fx_volume
+    set_fx_volume,
+    start_pools,
+    clean_sockets,
+    close_players,
+    get_pool_stats,
+    get_process_stats,
+    start_fx_sampler,
+    warm_pcm_cache,
+    close_fx_sampler,
+    get_fx_stats,
+    get_pcm_cache_stats,
+    start_loudness,
+    close_loudness,
+    scan_loudness,
+    get_loudness_stats
 )
 from .modulator import (
     list_custom_presets,
@@ -30,8 +45,16 @@ from .modulator import (
     load_custom_preset,
     save_custom_preset,
     delete_custom_preset,
-    set_modulator_volume
+    set_modulator_volume,
+    set_latency_mode,
+    get_latency_info,
+    get_stream_stats,
+    reset_stream_stats,
+    get_channels,
+    set_channel_output,
+    set_channel_volume
 )
+from .render import render_directory
 from .utils import get_local_ip, list_audio_files
 from .state import state
 
@@ -59,6 +82,26 @@ def status():
     return state
 
 
+@app.get("/status/players")
+def status_players():
+    return {"processes": get_process_stats(), "pools": get_pool_stats(), "pcm_cache": get_pcm_cache_stats()}
+
+
+# =======================
+# LOUDNESS
+# =======================
+
+@app.get("/loudness")
+def loudness_stats():
+    return get_loudness_stats()
+
+
+@app.post("/loudness/scan")
+def loudness_scan():
+    scan_loudness()
+    return get_loudness_stats()
+
+
 # =======================
 # MUSIC
 # =======================
@@ -131,8 +174,9 @@ def voice_effects():
 
 
 @app.post("/modulator")
-def voice_effect(effect: str):
-    state["modulator"]["effect"] = load_custom_preset(effect)
+def voice_effect(effect: str, channel: int = 0):
+    # Per-channel effect lands in state["modulator"]["channels"]; channel 0 also at the top level
+    load_custom_preset(effect, channel)
     return state["modulator"]
 
 @app.post("/modulator/custom")
@@ -145,11 +189,13 @@ def voice_effect(
     chorus: float = 0.0,        # 0..1      -> głębokość efektu chorus
     delay: float = 0.0,         # 0..500    -> czas delay w ms
     reverb: float = 0.0,        # 0..1      -> ilość pogłosu
+    reverb_size: float = 0.0,   # 0..1      -> wielkość pomieszczenia / czas wybrzmiewania pogłosu
     ring_mod: float = 0.0,      # 0..2000   -> częstotliwość modulacji ring w Hz
     bitcrusher: float = 0.0,    # 0..1      -> ilość redukcji bitów / cyfrowego szumu
     low_pass: float = 0.0,      # 0..20000  -> częstotliwość odcięcia filtra dolnoprzepustowego (Hz)
     high_pass: float = 0.0,     # 0..20000  -> częstotliwość odcięcia filtra górnoprzepustowego (Hz)
-    tremolo: float = 0.0        # 0..20     -> częstotliwość tremolo w Hz
+    tremolo: float = 0.0,       # 0..20     -> częstotliwość tremolo w Hz
+    channel: int = 0            # 0..MODULATOR_CHANNELS-1 -> kanał wejściowy (mikrofon)
 ):
     # Validate and clamp parameters
     gain = max(-20.0, min(20.0, gain))           # -20dB to +20dB range
@@ -160,13 +206,15 @@ def voice_effect(
     chorus = max(0.0, min(1.0, chorus))
     delay = max(0.0, min(500.0, delay))
     reverb = max(0.0, min(1.0, reverb))
+    reverb_size = max(0.0, min(1.0, reverb_size))
     ring_mod = max(0.0, min(2000.0, ring_mod))
     bitcrusher = max(0.0, min(1.0, bitcrusher))
     low_pass = max(0.0, min(20000.0, low_pass))
     high_pass = max(0.0, min(20000.0, high_pass))
     tremolo = max(0.0, min(20.0, tremolo))
     
-    state["modulator"]["effect"] = set_custom_effect(
+    set_custom_effect(
+        channel=channel,
         gain=gain,
         drive=drive,
         tone=tone,
@@ -175,6 +223,7 @@ def voice_effect(
         chorus=chorus,
         delay=delay,
         reverb=reverb,
+        reverb_size=reverb_size,
         ring_mod=ring_mod,
         bitcrusher=bitcrusher,
         low_pass=low_pass,
@@ -182,28 +231,11 @@ def voice_effect(
         tremolo=tremolo
     )
     
-    # Update state with current parameters
-    state["modulator"]["params"] = {
-        "gain": gain,
-        "drive": drive,
-        "tone": tone,
-        "mix": mix,
-        "pitch": pitch,
-        "chorus": chorus,
-        "delay": delay,
-        "reverb": reverb,
-        "ring_mod": ring_mod,
-        "bitcrusher": bitcrusher,
-        "low_pass": low_pass,
-        "high_pass": high_pass,
-        "tremolo": tremolo
-    }
-    
     return state["modulator"]
 
 @app.put("/modulator")
-def save_voice_effect(name: str):
-    save_custom_preset(name)
+def save_voice_effect(name: str, channel: int = 0):
+    save_custom_preset(name, channel)
     return state["modulator"]
 
 @app.delete("/modulator")
@@ -216,15 +248,58 @@ def modulator_volume(volume: str):
     set_modulator_volume(volume)
     return state["modulator"]
 
+@app.get("/modulator/channels")
+def modulator_channels():
+    return get_channels()
+
+@app.post("/modulator/channels/output")
+def modulator_channel_output(channel: int, output: int):
+    return set_channel_output(channel, output)
+
+@app.post("/modulator/channels/volume")
+def modulator_channel_volume(channel: int, volume: str):
+    return set_channel_volume(channel, volume)
+
+@app.get("/modulator/latency")
+def modulator_latency():
+    return get_latency_info()
+
+@app.post("/modulator/latency")
+def modulator_latency_mode(mode: str):
+    return set_latency_mode(mode)
+
+@app.get("/modulator/stats")
+def modulator_stats():
+    return get_stream_stats()
+
+@app.delete("/modulator/stats")
+def modulator_stats_reset():
+    return reset_stream_stats()
+
+@app.post("/modulator/render")
+async def modulator_render(directory: str, presets: str, workers: Optional[int] = None):
+    # directory: under data/ (relative to it); presets: comma-separated names from effects.json;
+    # output goes to data/fx/<preset>/
+    names = [name.strip() for name in presets.split(",") if name.strip()]
+    # A batch takes seconds to minutes: wait for it off the event loop, which keeps serving the rest
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        None, lambda: render_directory(directory, names, workers=workers, root=DATA_DIR)
+    )
+
 # =======================
 # FX
 # =======================
 
 @app.post("/fx/play")
-def fx_play(track: str):
-    play_fx(track)
+def fx_play(track: str, gain: float = 1.0):
+    play_fx(track, gain)
     return state["fx"]
 
+@app.get("/fx/stats")
+def fx_stats():
+    return get_fx_stats()
+
 @app.post("/fx/volume")
 def fx_volume(volume: str):
     set_fx_volume(volume)
@@ -316,3 +391,20 @@ def serve_react_app(full_path: str):
 def announce_ip():
     api_url = get_api_url()
     print(f"\n🚀 The server is available at {api_url} in your local network\n")
+
+
+@app.on_event("startup")
+def warm_players():
+    clean_sockets()
+    # The sampler first: FX need no mpv pool while it runs
+    start_fx_sampler()
+    warm_pcm_cache()
+    start_pools()
+    start_loudness()
+
+
+@app.on_event("shutdown")
+def stop_players():
+    close_players()
+    close_fx_sampler()
+    close_loudness()
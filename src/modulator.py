@@ -1,50 +1,81 @@
+import atexit
 import os
 import threading
-import sounddevice as sd
+import time as _time
 import numpy as np
 import json
-import math
+import tempfile
+from .dsp import build_chain, can_retune, chain_latency_ms, ChainSwitcher, set_backend
+from .engine import ControlBlock, EngineProcess, EngineStream, serve
+from .monitor import CallbackMonitor
 from .state import state
 
+try:
+    import sounddevice as sd
+except OSError:  # PortAudio missing: offline tools (benchmark) still import this module
+    sd = None
+
 # =========================
 # CONFIG
 # =========================
 SAMPLE_RATE = 48000
 BLOCK_SIZE = 1024  # Increased for better performance
-CHANNELS = 1
+# Kernels for the recursive DSP loops: "numpy", "numba", or "auto" (numba when installed)
+DSP_BACKEND = os.environ.get("MODULATOR_DSP_BACKEND", "auto")
+# "thread": audio callback in this process; "process": a separate engine process
+# (own GIL) driven through shared memory, so API load cannot stall the voice
+ENGINE_MODE = os.environ.get("MODULATOR_ENGINE", "thread")
+# Independent voice inputs, each with its own preset, mixed into OUTPUT_CHANNELS
+CHANNELS = int(os.environ.get("MODULATOR_CHANNELS", 1))
+OUTPUT_CHANNELS = int(os.environ.get("MODULATOR_OUTPUTS", 1))
+
+# Latency mode: one of LATENCY_BLOCK_SIZES, or "auto" to probe the smallest safe one
+LATENCY_BLOCK_SIZES = (128, 256, 512, 1024)
+LATENCY_MODE = os.environ.get("MODULATOR_LATENCY", "auto")
+STREAM_LATENCY = "low"  # PortAudio suggested device latency
+AUTO_PROBE_SECONDS = 1.0  # callback timing window per candidate block size
+AUTO_SETTLE_SECONDS = 0.25  # ignore callbacks (and start-up xruns) right after a stream restart
+AUTO_SAFETY_MARGIN = 0.5  # p99 callback cost must stay under this fraction of the block deadline
 
 DATA_DIR = os.path.join(os.path.dirname(__file__), "../data")
 PRESETS_FILE = os.path.join(DATA_DIR, "effects.json")
+PRESETS_RECHECK_SECONDS = 1.0  # how often reads stat effects.json for outside edits
 
 # =========================
 # INTERNAL STATE
 # =========================
-_effect_lock = threading.Lock()
-_current_effect = None
+# Numba kernels compile here, at import, so no callback ever waits on the JIT
+_dsp_backend = set_backend(DSP_BACKEND)
+state["modulator"]["dsp_backend"] = _dsp_backend
+
 _stream = None
+_stream_lock = threading.Lock()  # stream (re)starts and chain rebuilds; never taken by the audio thread
+_block_size = BLOCK_SIZE
+_latency_mode = LATENCY_MODE
+_probe_generation = 0  # bumped to cancel a running auto probe
 
-_custom_params_lock = threading.Lock()
-_custom_params = None
+# Callback timing, xruns and effect switches; written only by the audio thread.
+# In process mode this is the engine's monitor, read from shared memory.
+_monitor = CallbackMonitor()
 
-# =========================
-# DSP STATE (PERSISTENT)
-# =========================
-_low_pass_state = 0.0
-_high_pass_state = 0.0
-_ring_phase = 0.0
-_tremolo_phase = 0.0
+# Engine process handle (process mode, started with the first stream or effect)
+_engine = None
+
+_custom_params_lock = threading.Lock()
+_custom_params = [None] * CHANNELS
 
-# Ring buffers for effects
-_delay_buffer = np.zeros(SAMPLE_RATE * 2)  # 2 seconds max delay
-_delay_index = 0
-_delay_feedback_buffer = np.zeros(SAMPLE_RATE * 2)
+# Compiled effect chains, one switcher per input channel; None means pass-through.
+# New chains are posted to a switcher by plain assignment and crossfaded in on
+# the audio thread, so the audio thread never takes a lock to read them.
+_switchers = [ChainSwitcher(SAMPLE_RATE, BLOCK_SIZE) for _ in range(CHANNELS)]
 
-_chorus_buffers = [np.zeros(int(SAMPLE_RATE * 0.03)) for _ in range(3)]
-_chorus_indices = [0, 0, 0]
-_chorus_phases = [0.0, 0.0, 0.0]
+# De-interleaved (channels, frames) input and processed rows, sized for _block_size
+_inputs = np.zeros((CHANNELS, BLOCK_SIZE), dtype=np.float32)
+_outputs = np.zeros((CHANNELS, BLOCK_SIZE), dtype=np.float32)
 
-_reverb_buffer = np.zeros(int(SAMPLE_RATE * 1.5))  # 1.5 second reverb buffer
-_reverb_index = 0
+# Chains the audio thread has finished with, by parameter set, for quick re-use
+CHAIN_CACHE_SIZE = 4
+_chain_cache = {}
 
 # =========================
 # VOLUME STATE
@@ -61,9 +92,44 @@ except Exception:
 with _volume_lock:
     _volume = max(0.0, min(1.0, initial_volume / 100.0))
 
+# =========================
+# CHANNEL ROUTING
+# =========================
+# Output each input channel is mixed into, and its volume (0..1)
+_routes = [min(ch, OUTPUT_CHANNELS - 1) for ch in range(CHANNELS)]
+_channel_volumes = [1.0] * CHANNELS
+# (channels, outputs) gains: routing, channel volume and master volume in one matrix.
+# Rebuilt on change and swapped by assignment.
+_routing = None
+
+def _update_routing():
+    global _routing
+    routing = np.zeros((CHANNELS, OUTPUT_CHANNELS), dtype=np.float32)
+    with _volume_lock:
+        for ch, output in enumerate(_routes):
+            routing[ch, output] = _channel_volumes[ch] * _volume
+    _routing = routing
+    engine = _engine
+    if engine is not None:
+        engine.set_routing(routing)
+
+_update_routing()
+
+state["modulator"]["channels"] = [
+    {"effect": "off", "params": None, "output": _routes[ch], "volume": 100, "pitch_latency_ms": 0.0}
+    for ch in range(CHANNELS)
+]
+
 # =========================
 # PRESET FILE
 # =========================
+# In-memory copy of effects.json. Never mutated in place: writers build a new
+# dict and swap it in, so readers can use a snapshot without the lock.
+_presets_lock = threading.Lock()  # serializes writers and reloads
+_presets = None
+_presets_stat = None  # (mtime_ns, size) of the file _presets was read from / written to
+_presets_checked = 0.0
+
 def _ensure_presets_file():
     os.makedirs(DATA_DIR, exist_ok=True)
     if not os.path.exists(PRESETS_FILE):
@@ -78,6 +144,7 @@ def _ensure_presets_file():
                 "chorus": 0.4,
                 "delay": 45,
                 "reverb": 0.4,
+                "reverb_size": 0.0,
                 "ring_mod": 60,
                 "bitcrusher": 0.05,
                 "low_pass": 1800
@@ -91,57 +158,134 @@ def _ensure_presets_file():
                 "chorus": 0.7,
                 "delay": 200,
                 "reverb": 0.8,
+                "reverb_size": 0.0,
                 "ring_mod": 0.2,
                 "bitcrusher": 0.02,
                 "high_pass": 800,
                 "tremolo": 5
             }
         }
-        with open(PRESETS_FILE, "w") as f:
-            json.dump(default_presets, f, indent=2)
+        _write_presets(default_presets)
+
+def _file_stat():
+    st = os.stat(PRESETS_FILE)
+    return st.st_mtime_ns, st.st_size
+
+def _write_presets(data):
+    """Write effects.json atomically: temp file in the same directory, then rename"""
+    global _presets, _presets_stat
+    fd, tmp = tempfile.mkstemp(dir=DATA_DIR, prefix=".effects.", suffix=".json")
+    try:
+        # mkstemp creates 0600; keep the existing file's permissions
+        mode = os.stat(PRESETS_FILE).st_mode & 0o777 if os.path.exists(PRESETS_FILE) else 0o644
+        os.chmod(tmp, mode)
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, PRESETS_FILE)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    _presets = data
+    _presets_stat = _file_stat()
+
+def _reload_presets():
+    """Re-read effects.json if it changed on disk; caller holds _presets_lock"""
+    global _presets, _presets_stat, _presets_checked
+    _ensure_presets_file()
+    stat = _file_stat()
+    if _presets is None or stat != _presets_stat:
+        with open(PRESETS_FILE, "r") as f:
+            _presets = json.load(f)
+        _presets_stat = stat
+    _presets_checked = _time.monotonic()
+    return _presets
+
+def _get_presets():
+    """Current presets from memory; effects.json is stat'ed at most every PRESETS_RECHECK_SECONDS"""
+    data = _presets
+    if data is not None and _time.monotonic() - _presets_checked < PRESETS_RECHECK_SECONDS:
+        return data
+    with _presets_lock:
+        return _reload_presets()
+
+def _update_presets(change):
+    """Apply change(copy) to the latest presets and write them through; writers run one at a time"""
+    with _presets_lock:
+        data = dict(_reload_presets())
+        change(data)
+        _write_presets(data)
 
 # =========================
 # AUDIO CALLBACK
 # =========================
 def _audio_callback(indata, outdata, frames, time, status):
-    if status:
-        print(f"Audio status: {status}")
-    
-    x = indata[:, 0].copy()
+    start = _time.perf_counter()
     
-    with _effect_lock:
-        fx_func = _current_effect
-    
-    with _volume_lock:
-        vol = _volume
+    switchers = _switchers
+    inputs = _inputs[:, :frames]
+    outputs = _outputs[:, :frames]
 
-    if fx_func is None:
-        # Off mode safe assignment
-        outdata[:, 0] = np.clip(x * vol, -1.0, 1.0)
-    else:
-        y = fx_func(x)
-        outdata[:, 0] = np.clip(y * vol, -1.0, 1.0)
+    # Everything below writes into preallocated rows and outdata in place, no per-block allocation.
+    # One strided copy de-interleaves every channel into a contiguous row.
+    np.copyto(inputs, indata.T)
+    switches = 0
+    for ch in range(len(switchers)):
+        switcher = switchers[ch]
+        switcher.process(inputs[ch], outputs[ch])
+        switches += switcher.switches
+    # Routing, channel volumes and master volume as one (frames, channels) x (channels, outputs) product
+    np.matmul(outputs.T, _routing, out=outdata)
+    np.clip(outdata, -1.0, 1.0, out=outdata)
 
+    _monitor.record(start, _time.perf_counter(), frames, SAMPLE_RATE, status, switches)
 
 
 # =========================
 # STREAM CONTROL
 # =========================
 def _start_stream():
+    """Open the stream if it is closed; in auto mode probe the block size once it opens
+
+    Effect and parameter changes never probe: a probe step reopens the stream,
+    which would cut the chain crossfade with a dropout.
+    """
+    with _stream_lock:
+        opened = _stream is None
+        if opened:
+            _open_stream(_block_size)
+    if opened and _latency_mode == "auto":
+        _start_auto_probe()
+
+def _open_stream(block_size):
+    """Open the duplex stream at block_size and recompile the chain to match; caller holds _stream_lock"""
     global _stream
-    if _stream:
-        return
-    
-    _stream = sd.Stream(
-        samplerate=SAMPLE_RATE,
-        blocksize=BLOCK_SIZE,
-        dtype="float32",
-        channels=(CHANNELS, CHANNELS),
-        callback=_audio_callback,
-    )
-    _stream.start()
+    engine = _ensure_engine()
+    if engine is None and sd is None:
+        raise RuntimeError("sounddevice unavailable: PortAudio library not found")
 
-def _stop_stream():
+    if block_size != _block_size:
+        _set_block_size(block_size)
+    
+    if engine is not None:
+        stream = EngineStream(engine, block_size)
+    else:
+        stream = sd.Stream(
+            samplerate=SAMPLE_RATE,
+            blocksize=block_size,
+            latency=STREAM_LATENCY,
+            dtype="float32",
+            channels=(CHANNELS, OUTPUT_CHANNELS),
+            callback=_audio_callback,
+        )
+    stream.start()
+    _stream = stream
+    _update_latency_state()
+
+def _close_stream():
+    """Stop and close the stream; caller holds _stream_lock"""
     global _stream
     if not _stream:
         return
@@ -149,297 +293,415 @@ def _stop_stream():
     _stream.close()
     _stream = None
 
+def _stop_stream():
+    global _probe_generation
+    _probe_generation += 1
+    with _stream_lock:
+        _close_stream()
+    _update_latency_state()
+
+def _restart_stream(block_size):
+    with _stream_lock:
+        _close_stream()
+        _open_stream(block_size)
+
+def _set_block_size(block_size):
+    """Change the block size and recompile every channel's chain for it; caller holds _stream_lock"""
+    global _block_size, _switchers, _inputs, _outputs
+    _block_size = block_size
+    switchers = []
+    for switcher in _switchers:
+        chain = switcher.current
+        if chain is not None:
+            chain = build_chain(chain.params, SAMPLE_RATE, block_size)
+        switchers.append(ChainSwitcher(SAMPLE_RATE, block_size, chain=chain))
+    _chain_cache.clear()
+    _inputs = np.zeros((CHANNELS, block_size), dtype=np.float32)
+    _outputs = np.zeros((CHANNELS, block_size), dtype=np.float32)
+    _switchers = switchers
+
 # =========================
-# FILTER FUNCTIONS
+# ENGINE PROCESS
 # =========================
-def _pitch_shift(x: np.ndarray, semitones: float) -> np.ndarray:
-    """Real-time safe pitch shift for any semitone -36 to +24"""
-    if semitones == 0:
-        return x
-    factor = 2 ** (semitones / 12.0)
-    factor = max(factor, 0.0625)  # Limit -36 semitones
-    old_len = len(x)
-    new_len = int(old_len / factor)
-    new_indices = np.linspace(0, old_len - 1, new_len)
-    y = np.interp(new_indices, np.arange(old_len), x)
-    if len(y) > old_len:
-        y = y[:old_len]
-    else:
-        y = np.pad(y, (0, old_len - len(y)), 'constant')
-    return y
-
-def _apply_low_pass(signal, cutoff_hz):
-    """Apply one-pole low-pass filter"""
-    global _low_pass_state
-    if cutoff_hz <= 0:
-        return signal
-    
-    rc = 1.0 / (2.0 * math.pi * cutoff_hz)
-    dt = 1.0 / SAMPLE_RATE
-    alpha = dt / (rc + dt)
-    
-    result = np.zeros_like(signal)
-    last = _low_pass_state
-    
-    for i in range(len(signal)):
-        last = last + alpha * (signal[i] - last)
-        result[i] = last
-    
-    _low_pass_state = last
-    return result
-
-def _apply_high_pass(signal, cutoff_hz):
-    """Apply one-pole high-pass filter"""
-    global _high_pass_state
-    if cutoff_hz <= 0:
-        return signal
-    
-    rc = 1.0 / (2.0 * math.pi * cutoff_hz)
-    dt = 1.0 / SAMPLE_RATE
-    alpha = rc / (rc + dt)
-    
-    result = np.zeros_like(signal)
-    last = _high_pass_state
-    
-    for i in range(len(signal)):
-        highpass = alpha * (last + signal[i] - (signal[i-1] if i > 0 else 0))
-        result[i] = highpass
-        last = highpass
-    
-    _high_pass_state = last
-    return result
+def _ensure_engine():
+    """The engine process in process mode, started (or restarted after a crash) on demand; None in thread mode
+
+    Caller holds _stream_lock.
+    """
+    global _engine, _monitor, _stream
+    if ENGINE_MODE != "process":
+        return None
+    old = _engine
+    if old is not None and old.alive:
+        return old
+
+    engine = EngineProcess(_engine_main, CHANNELS, OUTPUT_CHANNELS, PARAM_KEYS)
+    engine.start(_routing)
+    if old is None:
+        atexit.register(_close_engine)
+    with _custom_params_lock:
+        for channel, params in enumerate(_custom_params):
+            if params is not None:
+                engine.post(channel, params)
+    _monitor = engine.monitor
+    _engine = engine
+    engine.set_routing(_routing)  # in case it changed during start-up
+    if old is not None:
+        # Crashed: its stream is gone too
+        _stream = None
+        old.close()
+    return engine
+
+def _close_engine():
+    """Stop the engine process and free its shared memory (at exit)"""
+    global _engine, _monitor, _stream
+    engine = _engine
+    if engine is None:
+        return
+    _engine = None
+    _stream = None
+    _monitor = CallbackMonitor()  # drop the last views into the shared block
+    engine.close()
+
+def _engine_main(name):
+    """Engine process entry point: runs the stream and chains here, as in thread mode, driven by the control block"""
+    global ENGINE_MODE, _monitor
+    ENGINE_MODE = "thread"
+    control = ControlBlock(CHANNELS, OUTPUT_CHANNELS, PARAM_KEYS, name=name)
+    _monitor = CallbackMonitor(buffer=control.monitor)
+    serve(control, _serve_params, _serve_routing, _serve_stream)
+    _monitor = CallbackMonitor()
+    control.close()
+
+def _serve_params(channel, params):
+    if params is not None:
+        params = _normalize_params(params)
+    with _stream_lock:
+        _post_params(channel, params)
+
+def _serve_routing(routing):
+    global _routing
+    _routing = routing
+
+def _serve_stream(block_size, running):
+    with _stream_lock:
+        _close_stream()
+        if not running:
+            return 0.0, 0.0
+        _open_stream(block_size)
+        return _stream.latency
 
 # =========================
-# EFFECT PROCESSOR
+# LATENCY
 # =========================
-def _apply_custom_effect(x: np.ndarray) -> np.ndarray:
-    global _ring_phase, _tremolo_phase, _delay_index, _reverb_index, _chorus_indices, _chorus_phases
+def _update_latency_state(probing=False, callback_p99_ms=None):
+    """Publish the stream configuration and its round-trip latency to state["modulator"]["latency"]"""
+    stream = _stream
+    input_ms = output_ms = 0.0
+    if stream is not None:
+        input_latency, output_latency = stream.latency
+        input_ms, output_ms = 1000.0 * input_latency, 1000.0 * output_latency
+    # Slowest channel
+    effect_ms = max(chain_latency_ms(params, SAMPLE_RATE) for params in _custom_params)
+
+    previous = state["modulator"].get("latency") or {}
+    if callback_p99_ms is None:
+        callback_p99_ms = previous.get("callback_p99_ms")
+    state["modulator"]["latency"] = {
+        "mode": _latency_mode,
+        "block_size": _block_size,
+        "block_ms": round(1000.0 * _block_size / SAMPLE_RATE, 2),
+        "input_ms": round(input_ms, 2),
+        "output_ms": round(output_ms, 2),
+        "effect_ms": round(effect_ms, 2),
+        "round_trip_ms": round(input_ms + output_ms + effect_ms, 2),
+        "callback_p99_ms": callback_p99_ms,
+        "probing": probing,
+        "running": stream is not None,
+    }
+
+def _measure_callbacks(seconds):
+    """p99 callback duration (s) and xrun count over the next `seconds` of audio"""
+    _time.sleep(AUTO_SETTLE_SECONDS)
+    count, xruns = _monitor.count, _monitor.xruns
+    _time.sleep(seconds)
+    recent = _monitor.recent(_monitor.count - count)
+    if not len(recent):
+        return None, _monitor.xruns - xruns
+    return float(np.percentile(recent, 99)), _monitor.xruns - xruns
+
+def _auto_probe(generation):
+    """Find the smallest block size whose callback p99 stays within AUTO_SAFETY_MARGIN of its deadline
+
+    Starts at the current block size. Steps down while the live callback keeps the
+    margin and up while it misses it, restarting the stream each step.
+    """
+    sizes = LATENCY_BLOCK_SIZES
+    index = sizes.index(_block_size) if _block_size in sizes else len(sizes) - 1
+    passed = None
+    p99_ms = None
+    while generation == _probe_generation:
+        _update_latency_state(probing=True)
+        p99, xruns = _measure_callbacks(AUTO_PROBE_SECONDS)
+        if generation != _probe_generation:
+            return
+        deadline = sizes[index] / SAMPLE_RATE
+        ok = p99 is not None and xruns == 0 and p99 < AUTO_SAFETY_MARGIN * deadline
+        if ok or passed is None:
+            p99_ms = round(1000.0 * p99, 3) if p99 is not None else None
+
+        if ok:
+            passed = index
+            if index == 0:
+                break
+            index -= 1
+        elif passed is not None:
+            index = passed
+        elif index < len(sizes) - 1:
+            index += 1
+        else:
+            break
+
+        with _stream_lock:
+            if generation != _probe_generation or _stream is None:
+                return
+            _close_stream()
+            _open_stream(sizes[index])
+        if not ok and passed is not None:
+            break
+
+    if generation == _probe_generation:
+        _update_latency_state(probing=False, callback_p99_ms=p99_ms)
+
+def _start_auto_probe():
+    global _probe_generation
+    _probe_generation += 1
+    if _block_size != LATENCY_BLOCK_SIZES[-1]:
+        _restart_stream(LATENCY_BLOCK_SIZES[-1])
+    threading.Thread(target=_auto_probe, args=(_probe_generation,), daemon=True).start()
+
+def set_latency_mode(mode):
+    """Select a fixed block size (128/256/512/1024) or "auto"; restarts a running stream"""
+    global _latency_mode, _probe_generation
+    mode = str(mode).strip().lower()
+    if mode != "auto":
+        if not mode.isdigit() or int(mode) not in LATENCY_BLOCK_SIZES:
+            raise ValueError(f"Latency mode must be 'auto' or one of {LATENCY_BLOCK_SIZES}")
+        mode = int(mode)
+
+    _latency_mode = mode
+    _probe_generation += 1
+    if _stream is None:
+        if mode != "auto":
+            with _stream_lock:
+                _set_block_size(mode)
+        _update_latency_state()
+    elif mode == "auto":
+        _start_auto_probe()
+    else:
+        _restart_stream(mode)
+    return get_latency_info()
 
-    with _custom_params_lock:
-        p = _custom_params.copy() if _custom_params else {}
-    
-    if not p:
-        return x
-
-    y = x.copy()
-
-    # GAIN
-    y *= 10 ** (p.get("gain", 0) / 20.0)
-
-    # DISTORTION
-    drive = p.get("drive", 0.0)
-    if drive > 0:
-        y = np.tanh(y * (1.0 + drive * 3.0))
-
-    # PITCH SHIFT
-    y = _pitch_shift(y, p.get("pitch", 0))
-
-    # TONE
-    tone = p.get("tone", 0.5)
-    if tone < 0.5:
-        cutoff = 1000 + 15000 * (tone * 2)
-        y = _apply_low_pass(y, cutoff)
-
-    # FILTERS
-    if p.get("low_pass", 0) > 0:
-        y = _apply_low_pass(y, p["low_pass"])
-    if p.get("high_pass", 0) > 0:
-        y = _apply_high_pass(y, p["high_pass"])
-
-    # CHORUS
-    chorus = p.get("chorus", 0)
-    if chorus > 0:
-        chorus_mixed = y.copy()
-        for i in range(3):
-            delay_samples = int(SAMPLE_RATE * (0.005 + i * 0.003))
-            rate = 0.5 + i * 0.3
-            depth = 0.001 + i * 0.0005
-            _chorus_phases[i] += 2 * math.pi * rate / SAMPLE_RATE
-            _chorus_phases[i] %= 2 * math.pi
-            mod_depth = int(depth * SAMPLE_RATE * (1 + math.sin(_chorus_phases[i])))
-            actual_delay = delay_samples + mod_depth
-            buf = _chorus_buffers[i]
-            idx = _chorus_indices[i]
-            buf_len = len(buf)
-            delayed = np.zeros_like(y)
-            for j in range(len(y)):
-                read_idx = (idx - actual_delay) % buf_len
-                delayed[j] = buf[int(read_idx)]
-                buf[idx] = y[j]
-                idx = (idx + 1) % buf_len
-            _chorus_indices[i] = idx
-            chorus_mixed += delayed * chorus * 0.3
-        y = chorus_mixed / (1 + 3 * chorus * 0.3)
-
-    # RING MOD
-    ring_freq = p.get("ring_mod", 0)
-    if ring_freq > 0:
-        t = np.arange(len(y)) / SAMPLE_RATE
-        y *= 1 + 0.7 * np.sin(2 * math.pi * ring_freq * t + _ring_phase)
-        _ring_phase += 2 * math.pi * ring_freq * len(y) / SAMPLE_RATE
-        _ring_phase %= 2 * math.pi
-
-    # BITCRUSHER
-    bitcrush = p.get("bitcrusher", 0)
-    if bitcrush > 0:
-        bits = 16 - int(bitcrush * 12)
-        levels = 2 ** bits
-        y = np.round(y * levels) / levels
-
-    # DELAY
-    delay_ms = p.get("delay", 0)
-    if delay_ms > 0:
-        delay_samples = int(SAMPLE_RATE * delay_ms / 1000)
-        wet = np.zeros_like(y)
-        buf = _delay_buffer
-        fb_buf = _delay_feedback_buffer
-        idx = _delay_index
-        for i in range(len(y)):
-            read_idx = (idx - delay_samples) % len(buf)
-            delayed = buf[read_idx] * 0.6 + fb_buf[read_idx] * 0.3
-            wet[i] = delayed
-            buf[idx] = y[i]
-            fb_buf[idx] = delayed * 0.5
-            idx = (idx + 1) % len(buf)
-        _delay_index = idx
-        y += wet * 0.7
-
-    # REVERB
-    reverb = p.get("reverb", 0)
-    if reverb > 0:
-        delays = [int(SAMPLE_RATE * t) for t in [0.0297, 0.0371, 0.0411, 0.0437]]
-        gains = [0.8, 0.6, 0.5, 0.4]
-        buf = _reverb_buffer
-        idx = _reverb_index
-        for i in range(len(y)):
-            reverb_sum = sum(buf[(idx - d) % len(buf)] * g * reverb for d, g in zip(delays, gains))
-            buf[idx] = y[i] + reverb_sum * 0.7
-            y[i] = y[i] * (1 - reverb * 0.3) + reverb_sum * reverb
-            idx = (idx + 1) % len(buf)
-        _reverb_index = idx
-
-    # TREMOLO
-    tremolo_hz = p.get("tremolo", 0)
-    if tremolo_hz > 0:
-        t = np.arange(len(y)) / SAMPLE_RATE
-        y *= 1.0 - 0.5 * (1 + np.sin(2 * math.pi * tremolo_hz * t + _tremolo_phase))
-        _tremolo_phase += 2 * math.pi * tremolo_hz * len(y) / SAMPLE_RATE
-        _tremolo_phase %= 2 * math.pi
-
-
-    # DRY/WET mix
-    mix = p.get("mix", 1.0)
-    if mix < 1.0:
-        y = y * mix + x * (1 - mix)
-
-    return np.clip(y, -1.0, 1.0)
+def get_latency_info():
+    """Current latency mode, block size and round-trip latency"""
+    return state["modulator"]["latency"]
+
+# Applies a fixed MODULATOR_LATENCY before the first stream opens; a bad value must not stop the server
+try:
+    set_latency_mode(LATENCY_MODE)
+except ValueError as e:
+    print(f"⚠️ MODULATOR_LATENCY={LATENCY_MODE!r} ignored ({e}), using auto")
+    set_latency_mode("auto")
 
 # =========================
 # PUBLIC API
 # =========================
-def set_custom_effect(**params):
+def _normalize_params(params):
+    """Fill defaults and coerce types of custom effect parameters"""
+    return {
+        "gain": float(params.get("gain", 0)),
+        "drive": float(params.get("drive", 0)),
+        "tone": float(params.get("tone", 0.5)),
+        "mix": float(params.get("mix", 1)),
+        "pitch": int(params.get("pitch", 0)),
+        "chorus": float(params.get("chorus", 0)),
+        "delay": float(params.get("delay", 0)),
+        "reverb": float(params.get("reverb", 0)),
+        "reverb_size": float(params.get("reverb_size", 0)),
+        "ring_mod": float(params.get("ring_mod", 0)),
+        "bitcrusher": float(params.get("bitcrusher", 0)),
+        "low_pass": float(params.get("low_pass", 0)),
+        "high_pass": float(params.get("high_pass", 0)),
+        "tremolo": float(params.get("tremolo", 0)),
+    }
+
+# Parameter names, in the order the engine process receives them
+PARAM_KEYS = tuple(_normalize_params({}))
+
+def _check_channel(channel):
+    channel = int(channel)
+    if not 0 <= channel < CHANNELS:
+        raise ValueError(f"Channel must be between 0 and {CHANNELS - 1}")
+    return channel
+
+def _publish_channel(channel, effect, params):
+    """Per-channel state; channel 0 is also mirrored at the top level of state["modulator"]"""
+    latency_ms = round(chain_latency_ms(params, SAMPLE_RATE), 1)
+    entry = state["modulator"]["channels"][channel]
+    entry["effect"] = effect
+    entry["params"] = params
+    entry["pitch_latency_ms"] = latency_ms
+    if channel == 0:
+        state["modulator"]["effect"] = effect
+        state["modulator"]["pitch_latency_ms"] = latency_ms
+        if params is not None:
+            state["modulator"]["params"] = params
+
+def set_custom_effect(channel=0, **params):
     """Set custom effect parameters"""
-    global _custom_params, _current_effect
-    
-    # Reset DSP states when changing effects
-    global _low_pass_state, _high_pass_state, _ring_phase, _tremolo_phase
-    global _delay_index, _reverb_index, _chorus_indices, _chorus_phases
-    
-    _low_pass_state = 0.0
-    _high_pass_state = 0.0
-    _ring_phase = 0.0
-    _tremolo_phase = 0.0
-    _delay_index = 0
-    _reverb_index = 0
-    _chorus_indices = [0, 0, 0]
-    _chorus_phases = [0.0, 0.0, 0.0]
-    
-    # Clear buffers
-    _delay_buffer.fill(0)
-    _delay_feedback_buffer.fill(0)
-    _reverb_buffer.fill(0)
-    for buf in _chorus_buffers:
-        buf.fill(0)
-    
-    with _custom_params_lock:
-        _custom_params = {
-            "gain": float(params.get("gain", 0)),
-            "drive": float(params.get("drive", 0)),
-            "tone": float(params.get("tone", 0.5)),
-            "mix": float(params.get("mix", 1)),
-            "pitch": int(params.get("pitch", 0)),
-            "chorus": float(params.get("chorus", 0)),
-            "delay": float(params.get("delay", 0)),
-            "reverb": float(params.get("reverb", 0)),
-            "ring_mod": float(params.get("ring_mod", 0)),
-            "bitcrusher": float(params.get("bitcrusher", 0)),
-            "low_pass": float(params.get("low_pass", 0)),
-            "high_pass": float(params.get("high_pass", 0)),
-            "tremolo": float(params.get("tremolo", 0)),
-        }
-    
-    with _effect_lock:
-        _current_effect = _apply_custom_effect
+    return _apply_custom_effect(params, "custom", channel)
+
+def _apply_custom_effect(params, name, channel=0):
+    """Set a channel's effect parameters; name labels the switch in the stats"""
+    channel = _check_channel(channel)
+    custom = _normalize_params(params)
+
+    # _stream_lock keeps the block size from changing under the build
+    with _stream_lock:
+        _post_params(channel, custom, name)
+        with _custom_params_lock:
+            _custom_params[channel] = custom
+    _publish_channel(channel, name, custom)
+    _update_latency_state()
     
     _start_stream()
     return "custom"
 
-def save_custom_preset(name):
-    """Save current effect settings as a named preset"""
-    _ensure_presets_file()
+def _post_params(channel, params, name=None):
+    """Retune the channel's running chain to params, or compile a new one and crossfade to it
+
+    params None turns the effect off. A switch is logged as name (unless None)
+    before the audio thread can pick it up. Caller holds _stream_lock.
+    """
+    engine = _ensure_engine()
+    if engine is not None:
+        if name is not None and not can_retune(engine.params(channel), params):
+            _monitor.note_switch(name, chain_latency_ms(params, SAMPLE_RATE), channel)
+        engine.post(channel, params)
+        return
+
+    switcher = _switchers[channel]
+    chain = switcher.current
+    if params is not None and chain is not None and chain.retune(params):
+        return
+    # Compile off the audio thread; a re-used chain is cleared by the audio thread
+    chain = _take_cached_chain(params)
+    if chain is None and params is not None:
+        chain = build_chain(params, SAMPLE_RATE, _block_size)
+    if name is not None:
+        _monitor.note_switch(name, chain.latency_ms if chain else 0.0, channel)
+    switcher.post(chain)
+
+def _chain_key(params):
+    return tuple(sorted(params.items()))
+
+def _take_cached_chain(params):
+    """Collect chains retired by the audio thread, then pop one compiled for params (marked stale)
+
+    Caller holds _stream_lock.
+    """
+    active = [s.current for s in _switchers]
+    for switcher in _switchers:
+        for chain in switcher.retired():
+            if all(chain is not c for c in active):
+                _chain_cache[_chain_key(chain.params)] = chain
+    while len(_chain_cache) > CHAIN_CACHE_SIZE:
+        del _chain_cache[next(iter(_chain_cache))]
+    if params is None:
+        return None
+    chain = _chain_cache.pop(_chain_key(params), None)
+    if chain is not None:
+        chain.stale = True
+    return chain
+
+def set_channel_output(channel, output):
+    """Route an input channel into one of the OUTPUT_CHANNELS"""
+    channel = _check_channel(channel)
+    output = int(output)
+    if not 0 <= output < OUTPUT_CHANNELS:
+        raise ValueError(f"Output must be between 0 and {OUTPUT_CHANNELS - 1}")
+    _routes[channel] = output
+    _update_routing()
+    state["modulator"]["channels"][channel]["output"] = output
+    return state["modulator"]["channels"]
+
+def set_channel_volume(channel, value):
+    """Set one input channel's volume (0-100)"""
+    channel = _check_channel(channel)
+    _channel_volumes[channel] = max(0.0, min(1.0, float(value) / 100.0))
+    _update_routing()
+    state["modulator"]["channels"][channel]["volume"] = int(float(value))
+    return state["modulator"]["channels"]
+
+def get_channels():
+    """Per-channel effect, routing and volume"""
+    return state["modulator"]["channels"]
+
+def get_stream_stats():
+    """Callback timing histogram, xrun counters and recent effect switches"""
+    stats = _monitor.snapshot()
+    stats["block_size"] = _block_size
+    stats["dsp_backend"] = _dsp_backend
+    stats["engine"] = ENGINE_MODE
+    stats["deadline_ms"] = round(1000.0 * _block_size / SAMPLE_RATE, 3)
+    stats["running"] = _stream is not None
+    return stats
+
+def reset_stream_stats():
+    _monitor.reset()
+    return get_stream_stats()
+
+def save_custom_preset(name, channel=0):
+    """Save a channel's current effect settings as a named preset"""
+    channel = _check_channel(channel)
     
     with _custom_params_lock:
-        if _custom_params is None:
+        if _custom_params[channel] is None:
             raise ValueError("No effect parameters to save")
-        preset = _custom_params.copy()
+        preset = _custom_params[channel].copy()
     
-    with open(PRESETS_FILE, "r+") as f:
-        data = json.load(f)
+    def change(data):
         data[name] = preset
-        f.seek(0)
-        json.dump(data, f, indent=2)
-        f.truncate()
+    _update_presets(change)
     
     return f"Preset '{name}' saved"
 
-def load_custom_preset(name):
-    """Load a named preset"""
-    _ensure_presets_file()
-    
+def load_custom_preset(name, channel=0):
+    """Load a named preset on a channel"""
     if name == 'off':
-        set_effect_off()
+        set_effect_off(channel)
         return 'off'
     
-    with open(PRESETS_FILE, 'r') as f:
-        data = json.load(f)
+    data = _get_presets()
     
     if name not in data:
         raise ValueError(f"Preset '{name}' not found")
     
     preset = data[name]
     if preset is None:  # "off" preset
-        set_effect_off()
+        set_effect_off(channel)
     else:
-        set_custom_effect(**preset)
+        _apply_custom_effect(preset, name, channel)
     
     return name
 
 def list_custom_presets():
     """List all available presets"""
-    _ensure_presets_file()
-    
-    with open(PRESETS_FILE, 'r') as f:
-        data = json.load(f)
-    
-    return data
+    return dict(_get_presets())
 
 def delete_custom_preset(name):
     """Delete a named preset"""
-    _ensure_presets_file()
-    
-    with open(PRESETS_FILE, "r+") as f:
-        data = json.load(f)
-        
+    def change(data):
         if name not in data:
             raise ValueError(f"Preset '{name}' not found")
         
@@ -447,18 +709,19 @@ def delete_custom_preset(name):
             raise ValueError(f"Cannot delete built-in preset '{name}'")
         
         del data[name]
-        f.seek(0)
-        json.dump(data, f, indent=2)
-        f.truncate()
+    _update_presets(change)
     
     return f"Preset '{name}' deleted"
 
-def set_effect_off():
-    """Turn off all effects"""
-    global _current_effect
-    
-    with _effect_lock:
-        _current_effect = None
+def set_effect_off(channel=0):
+    """Turn off all effects on a channel"""
+    channel = _check_channel(channel)
+    with _stream_lock:
+        _post_params(channel, None, "off")
+        with _custom_params_lock:
+            _custom_params[channel] = None
+    _publish_channel(channel, "off", None)
+    _update_latency_state()
     
     # Don't stop stream, just pass through
     _start_stream()
@@ -472,21 +735,20 @@ def set_ghost_effect():
     """Set ghost effect preset"""
     return load_custom_preset("ghost")
 
-def get_current_preset():
-    """Get name of current preset"""
-    _ensure_presets_file()
-    
-    with open(PRESETS_FILE, 'r') as f:
-        data = json.load(f)
+def get_current_preset(channel=0):
+    """Get name of a channel's current preset"""
+    channel = _check_channel(channel)
+    data = _get_presets()
     
     with _custom_params_lock:
-        if _custom_params is None:
+        params = _custom_params[channel]
+        if params is None:
             return "off"
         
         for name, preset in data.items():
             if preset is None:
                 continue
-            if all(abs(_custom_params.get(k, 0) - preset.get(k, 0)) < 0.01 
+            if all(abs(params.get(k, 0) - preset.get(k, 0)) < 0.01 
                    for k in preset.keys()):
                 return name
     
@@ -498,6 +760,7 @@ def set_modulator_volume(value):
     
     with _volume_lock:
         _volume = max(0.0, min(1.0, float(value) / 100.0))
+    _update_routing()
     
     # Save to state if available
     if hasattr(state, 'modulator'):
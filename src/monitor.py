@@ -0,0 +1,203 @@
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+# Load histogram bin edges, as a fraction of the block deadline (last bin: missed deadlines)
+LOAD_BINS = (0.0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0, np.inf)
+
+_FLAGS = ("input_overflow", "input_underflow", "output_overflow", "output_underflow", "priming_output")
+
+# Slots of the counters (int64) and clock (float64) fields
+_COUNT, _LATE, _XRUNS, _SWITCHES, _SWITCH_COUNT = range(5)
+_STARTED_AT, _SWITCH_REQUESTED = range(2)
+
+
+def _fields(capacity, events):
+    """(name, dtype, length) of the monitor's arrays, in buffer order (8-byte items only)"""
+    return (
+        ("counters", np.int64, 5),
+        ("clock", np.float64, 2),
+        ("flags", np.int64, len(_FLAGS)),
+        ("switch_delays", np.float64, events),
+        ("durations", np.float64, capacity),
+        ("loads", np.float64, capacity),
+    )
+
+
+class CallbackMonitor:
+    """Lock-free recorder for audio callback timing, xruns and effect switches
+
+    record() runs on the audio thread and only writes into preallocated arrays
+    (single writer). Readers take a snapshot without stopping the stream; a
+    reading may straddle one in-flight callback. The arrays can live in shared
+    memory, so the callback may run in another process than the readers.
+    """
+
+    def __init__(self, capacity=4096, events=64, buffer=None):
+        """buffer: optional memory of at least nbytes(capacity, events) for every field record() writes
+
+        Pass shared memory to read the stats in another process. A given buffer
+        is used as is; call reset() on a fresh one.
+        """
+        self.capacity = capacity
+        own = buffer is None
+        if own:
+            buffer = bytearray(self.nbytes(capacity, events))
+        fields = {}
+        offset = 0
+        for name, dtype, n in _fields(capacity, events):
+            fields[name] = np.ndarray(n, dtype=dtype, buffer=buffer, offset=offset)
+            offset += fields[name].nbytes
+        self._counters = fields["counters"]
+        self._clock = fields["clock"]
+        self._flags = fields["flags"]
+        self._switch_delays = fields["switch_delays"]
+        self._durations = fields["durations"]
+        self._loads = fields["loads"]
+        self._events = deque(maxlen=events)
+        self._events_lock = threading.Lock()  # control threads only
+        if own:
+            self.reset()
+
+    @staticmethod
+    def nbytes(capacity=4096, events=64):
+        return sum(np.dtype(dtype).itemsize * n for _, dtype, n in _fields(capacity, events))
+
+    @property
+    def count(self):
+        return int(self._counters[_COUNT])
+
+    @property
+    def late(self):
+        return int(self._counters[_LATE])
+
+    @property
+    def xruns(self):
+        return int(self._counters[_XRUNS])
+
+    @property
+    def started_at(self):
+        return float(self._clock[_STARTED_AT])
+
+    def reset(self):
+        self._counters[:] = 0
+        self._clock[_STARTED_AT] = time.time()
+        self._clock[_SWITCH_REQUESTED] = np.nan
+        self._flags[:] = 0
+        with self._events_lock:
+            self._events.clear()
+
+    # -------------------------
+    # Audio thread
+    # -------------------------
+    def record(self, start, end, frames, sample_rate, status, switches):
+        """Store one callback's duration and status flags; no allocation beyond scalars
+
+        switches is a running count of chains taken by the audio thread.
+        """
+        counters = self._counters
+        count = int(counters[_COUNT])
+        i = count % self.capacity
+        duration = end - start
+        load = duration * sample_rate / frames
+        self._durations[i] = duration
+        self._loads[i] = load
+        if load > 1.0:
+            counters[_LATE] += 1
+
+        if status:
+            counters[_XRUNS] += 1
+            flags = self._flags
+            if status.input_overflow:
+                flags[0] += 1
+            if status.input_underflow:
+                flags[1] += 1
+            if status.output_overflow:
+                flags[2] += 1
+            if status.output_underflow:
+                flags[3] += 1
+            if status.priming_output:
+                flags[4] += 1
+
+        # First block processed by a newly swapped chain
+        if switches != counters[_SWITCHES]:
+            counters[_SWITCHES] = switches
+            requested = self._clock[_SWITCH_REQUESTED]
+            if requested == requested:  # not NaN
+                taken = int(counters[_SWITCH_COUNT])
+                # Can go slightly negative when the post lands mid-callback, before this channel ran
+                self._switch_delays[taken % len(self._switch_delays)] = max(0.0, start - requested)
+                counters[_SWITCH_COUNT] = taken + 1
+                self._clock[_SWITCH_REQUESTED] = np.nan
+
+        counters[_COUNT] = count + 1
+
+    # -------------------------
+    # Control threads
+    # -------------------------
+    def note_switch(self, name, latency_ms=0.0, channel=0):
+        """Log an effect switch; the audio thread measures when it takes effect"""
+        # perf_counter is system-wide monotonic, so an engine process can compare against it
+        self._clock[_SWITCH_REQUESTED] = time.perf_counter()
+        with self._events_lock:
+            self._events.append({
+                "time": time.time(),
+                "channel": channel,
+                "effect": name,
+                "block": self.count,
+                "latency_ms": round(latency_ms, 2),
+            })
+
+    def recent(self, n):
+        """Durations (s) of the last n callbacks, oldest first"""
+        n = min(n, self.count, self.capacity)
+        if n <= 0:
+            return self._durations[:0].copy()
+        end = self.count % self.capacity
+        return np.roll(self._durations, -end)[self.capacity - n:]
+
+    def snapshot(self):
+        """Counters, percentiles and a deadline-load histogram over the ring"""
+        count = self.count
+        switch_count = int(self._counters[_SWITCH_COUNT])
+        n = min(count, self.capacity)
+        durations_ms = self._durations[:n] * 1000.0
+        loads = self._loads[:n]
+
+        histogram, _ = np.histogram(loads, bins=LOAD_BINS)
+        labels = [f"{lo:.0%}-{hi:.0%}" for lo, hi in zip(LOAD_BINS[:-2], LOAD_BINS[1:-1])] + [">100%"]
+
+        switches = min(switch_count, len(self._switch_delays))
+        switch_ms = self._switch_delays[:switches] * 1000.0
+        with self._events_lock:
+            events = list(self._events)
+
+        stats = {
+            "callbacks": count,
+            "window": n,
+            "uptime_s": round(time.time() - self.started_at, 1),
+            "late": self.late,
+            "xruns": self.xruns,
+            "flags": {name: int(v) for name, v in zip(_FLAGS, self._flags)},
+            "load_histogram": dict(zip(labels, (int(v) for v in histogram))),
+            "switches": {
+                "count": switch_count,
+                "apply_ms_mean": round(float(switch_ms.mean()), 3) if switches else None,
+                "apply_ms_max": round(float(switch_ms.max()), 3) if switches else None,
+                "events": events,
+            },
+        }
+        if n:
+            stats.update({
+                "duration_ms": {
+                    "mean": round(float(durations_ms.mean()), 3),
+                    "p50": round(float(np.percentile(durations_ms, 50)), 3),
+                    "p90": round(float(np.percentile(durations_ms, 90)), 3),
+                    "p99": round(float(np.percentile(durations_ms, 99)), 3),
+                    "max": round(float(durations_ms.max()), 3),
+                },
+                "load_p99": round(float(np.percentile(loads, 99)), 3),
+            })
+        return stats
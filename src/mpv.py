@@ -0,0 +1,323 @@
+"""Persistent JSON IPC client for mpv --input-ipc-server sockets, and pools of idle players"""
+import collections
+import itertools
+import json
+import select
+import socket
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError, TimeoutError as FutureTimeout
+
+COMMAND_TIMEOUT = 1.0  # seconds to wait for a reply (or to get a command out) before giving up on it
+POOL_CHECK_SECONDS = 1.0  # how often a pool looks for idle players that died
+
+
+def _resolve(future, result):
+    # The reader and a closing thread may race to resolve the same request
+    try:
+        future.set_result(result)
+    except InvalidStateError:
+        pass
+
+
+def _send_all(sock, payload, timeout):
+    """sendall that raises TimeoutError when the peer stops reading (a hung mpv) instead of blocking"""
+    view = memoryview(payload)
+    deadline = time.monotonic() + timeout
+    while view:
+        try:
+            view = view[sock.send(view, socket.MSG_DONTWAIT):]
+            continue
+        except BlockingIOError:
+            pass
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not select.select([], [sock], [], remaining)[1]:
+            raise TimeoutError("mpv is not reading its IPC socket")
+
+
+def _notify(callback, *args):
+    # A failing listener must not take the reader thread down with it
+    try:
+        callback(*args)
+    except Exception:
+        pass
+
+
+class MpvClient:
+    """One connection per player, shared by every thread that talks to it
+
+    Each command carries a request_id. A reader thread routes replies to the
+    caller waiting on that id and hands events to listeners, so events may
+    arrive between replies and several commands can be in flight at once.
+    Failures never raise: like the old per-command helpers, a command on a
+    closed or unreachable player just returns None.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.closed = False
+        self._sock = None
+        self._send_lock = threading.Lock()
+        self._pending = {}  # request_id -> Future, under _pending_lock
+        self._pending_lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._listeners = []
+        self._observers = {}  # observe_property id -> callback(value)
+        self._close_callbacks = []
+        self._reader = None
+
+    def connect(self):
+        """Open the connection and start the reader; False if mpv is not listening"""
+        with self._send_lock:
+            if self._sock is not None:
+                return True
+            if self.closed:
+                return False
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self.path)
+            except OSError:
+                sock.close()
+                return False
+            self._sock = sock
+        self._reader = threading.Thread(target=self._read_loop, args=(sock,), name=f"mpv-ipc {self.path}", daemon=True)
+        self._reader.start()
+        return True
+
+    def close(self):
+        self.closed = True
+        with self._send_lock:
+            sock, self._sock = self._sock, None
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+        self._fail_pending()
+        self._run_close_callbacks()
+
+    # -------------------------
+    # Commands
+    # -------------------------
+    def request(self, *args):
+        """Send a command; the returned Future resolves to its reply dict (None if the player went away)"""
+        return self._send([args], replies=True)[0]
+
+    def pipeline(self, commands, timeout=COMMAND_TIMEOUT):
+        """Send several commands in one write and wait for all replies; list of data (None on error)"""
+        futures = self._send([list(c) for c in commands], replies=True)
+        return [self._data(f, timeout) for f in futures]
+
+    def command(self, *args, timeout=COMMAND_TIMEOUT):
+        """Run a command and return its data (None on error, timeout or a closed player)"""
+        return self._data(self.request(*args), timeout)
+
+    def send(self, *args):
+        """Fire and forget: no waiting for the reply (dropped by the reader)"""
+        self._send([args], replies=False)
+
+    def send_named(self, name, **args):
+        """Fire and forget a command with named arguments, which stay put when mpv adds positional ones"""
+        self._send([dict(args, name=name)], replies=False)
+
+    def get(self, prop, timeout=COMMAND_TIMEOUT):
+        return self.command("get_property", prop, timeout=timeout)
+
+    def set(self, prop, value):
+        self.send("set_property", prop, value)
+
+    # -------------------------
+    # Events
+    # -------------------------
+    # Callbacks run on the reader thread: they must not wait for a reply
+    # (command/get/pipeline) from this same client, or the reader stalls.
+    def add_listener(self, listener):
+        """Call listener(event dict) for every mpv event"""
+        self._listeners = self._listeners + [listener]
+
+    def remove_listener(self, listener):
+        self._listeners = [l for l in self._listeners if l is not listener]
+
+    def observe(self, prop, callback):
+        """Call callback(value) with the property's current value and on every change (observe_property)"""
+        observer_id = next(self._ids)
+        self._observers[observer_id] = callback
+        self.send("observe_property", observer_id, prop)
+
+    def on_close(self, callback):
+        """Call callback() once the connection ends (mpv quit or close()); at once if it already has"""
+        self._close_callbacks.append(callback)
+        if self.closed:
+            self._run_close_callbacks()
+
+    # -------------------------
+    # Internals
+    # -------------------------
+    def _send(self, commands, replies):
+        futures = []
+        ids = []
+        lines = []
+        for args in commands:
+            request_id = next(self._ids)
+            if replies:
+                futures.append(Future())
+                ids.append(request_id)
+            command = args if isinstance(args, dict) else list(args)
+            lines.append(json.dumps({"command": command, "request_id": request_id}))
+        payload = ("\n".join(lines) + "\n").encode()
+
+        with self._pending_lock:
+            # After close() swept the table nothing would resolve them: they fail below instead
+            if not self.closed:
+                self._pending.update(zip(ids, futures))
+        if self.closed or (self._sock is None and not self.connect()):
+            # Only this call's requests: others may be in flight on a connection another thread opens
+            with self._pending_lock:
+                for request_id in ids:
+                    self._pending.pop(request_id, None)
+            for future in futures:
+                _resolve(future, None)
+            return futures
+        try:
+            with self._send_lock:
+                _send_all(self._sock, payload, COMMAND_TIMEOUT)
+        except (OSError, AttributeError):  # AttributeError: closed by another thread; TimeoutError: hung
+            self.close()
+        return futures
+
+    @staticmethod
+    def _data(future, timeout):
+        try:
+            reply = future.result(timeout)
+        except FutureTimeout:
+            return None
+        if not reply or reply.get("error") != "success":
+            return None
+        return reply.get("data")
+
+    def _fail_pending(self):
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+        for future in pending.values():
+            _resolve(future, None)
+
+    def _read_loop(self, sock):
+        try:
+            with sock.makefile("rb") as lines:
+                for line in lines:
+                    try:
+                        message = json.loads(line)
+                    except ValueError:
+                        continue
+                    if "event" in message:
+                        if message["event"] == "property-change":
+                            observer = self._observers.get(message.get("id"))
+                            if observer is not None:
+                                _notify(observer, message.get("data"))
+                        for listener in self._listeners:
+                            _notify(listener, message)
+                        continue
+                    with self._pending_lock:
+                        future = self._pending.pop(message.get("request_id"), None)
+                    if future is not None:
+                        _resolve(future, message)
+        except (OSError, ValueError):
+            pass
+        # EOF: mpv quit (or close() was called)
+        self.closed = True
+        with self._send_lock:
+            if self._sock is sock:
+                self._sock = None
+                sock.close()
+        self._fail_pending()
+        self._run_close_callbacks()
+
+    def _run_close_callbacks(self):
+        callbacks, self._close_callbacks = self._close_callbacks, []
+        for callback in callbacks:
+            _notify(callback)
+
+
+class MpvPool:
+    """Pre-started idle players for one channel, refilled in the background
+
+    spawn() starts a player and returns (proc, MpvClient), or raises. Idle
+    players wait with their IPC connection open, so starting a track is a
+    loadfile on one of them instead of a process start plus socket wait.
+    stop(proc, ipc) shuts down players the pool discards (dead, or left at close).
+    """
+
+    def __init__(self, spawn, size, name="mpv-pool", stop=None):
+        self.size = max(0, int(size))
+        self._spawn = spawn
+        self._stop = stop or _discard
+        self._idle = collections.deque()  # (proc, ipc), oldest first
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._thread = threading.Thread(target=self._refill_loop, name=name, daemon=True)
+        self.hits = 0
+        self.misses = 0
+
+    def start(self):
+        if self.size and not self._thread.is_alive():
+            self._thread.start()
+
+    def close(self):
+        self._closed = True
+        self._wake.set()
+        with self._lock:
+            idle, self._idle = list(self._idle), collections.deque()
+        for proc, ipc in idle:
+            self._stop(proc, ipc)
+
+    def acquire(self):
+        """An idle (proc, ipc), or None if none is ready; the pool refills behind it"""
+        with self._lock:
+            while self._idle:
+                proc, ipc = self._idle.popleft()
+                if proc.poll() is None and not ipc.closed:
+                    self.hits += 1
+                    self._wake.set()
+                    return proc, ipc
+                self._stop(proc, ipc)
+            self.misses += 1
+        self._wake.set()
+        return None
+
+    @property
+    def ready(self):
+        return len(self._idle)
+
+    def _refill_loop(self):
+        while not self._closed:
+            self._wake.clear()
+            dead = []
+            with self._lock:
+                for player in list(self._idle):
+                    proc, ipc = player
+                    if proc.poll() is not None or ipc.closed:
+                        self._idle.remove(player)
+                        dead.append(player)
+                missing = self.size - len(self._idle)
+            for proc, ipc in dead:
+                self._stop(proc, ipc)
+            for _ in range(missing):
+                try:
+                    player = self._spawn()
+                except Exception:
+                    break  # mpv missing or failing: retry on the next wake-up
+                with self._lock:
+                    if self._closed:
+                        self._stop(*player)
+                        return
+                    self._idle.append(player)
+            self._wake.wait(POOL_CHECK_SECONDS)
+
+
+def _discard(proc, ipc):
+    # Without a stop callback: no reaping or SIGKILL escalation beyond this
+    ipc.close()
+    if proc.poll() is None:
+        proc.terminate()
@@ -0,0 +1,302 @@
+"""mpv IPC benchmark: persistent MpvClient against one connection per command.
+
+Starts a silent `mpv --idle` and times the commands the players send most:
+property reads (position polling), volume writes (fades and crossfades) and a
+two-property read, pipelined on the client:
+
+    python -m src.mpv_bench
+    python -m src.mpv_bench --count 2000 --json mpv_bench.json
+
+Socket calls are counted per command; at these message sizes each one is a
+single syscall (socket/connect/send/recv/close).
+
+Track starts are timed too, until mpv reports a playback position: a fresh
+process per start against a loadfile on a warm MpvPool player (--starts).
+"""
+import argparse
+import itertools
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+from collections import Counter
+
+import numpy as np
+
+from .mpv import MpvClient, MpvPool
+
+# =========================
+# BASELINE
+# =========================
+# The helpers audio.py used before MpvClient: a new connection per command
+def _oneshot_send(sock, cmd):
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.connect(sock)
+            s.sendall(json.dumps(cmd).encode() + b"\n")
+    except Exception:
+        pass
+
+def _oneshot_get(sock, prop):
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.connect(sock)
+            s.sendall(json.dumps({"command": ["get_property", prop]}).encode() + b"\n")
+            return json.loads(s.recv(4096).decode()).get("data")
+    except Exception:
+        return None
+
+# =========================
+# SYSCALL COUNTING
+# =========================
+_calls = Counter()
+
+class _CountingSocket(socket.socket):
+    """socket.socket that counts the calls which reach the kernel"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        _calls["socket"] += 1
+
+    def connect(self, *args):
+        _calls["connect"] += 1
+        return super().connect(*args)
+
+    def sendall(self, *args):
+        _calls["send"] += 1
+        return super().sendall(*args)
+
+    def send(self, *args):
+        # MpvClient writes with send(MSG_DONTWAIT), one call per partial write
+        _calls["send"] += 1
+        return super().send(*args)
+
+    def recv(self, *args):
+        _calls["recv"] += 1
+        return super().recv(*args)
+
+    def recv_into(self, *args):
+        _calls["recv"] += 1
+        return super().recv_into(*args)
+
+    def close(self):
+        _calls["close"] += 1
+        return super().close()
+
+# =========================
+# BENCHMARK
+# =========================
+def _start_mpv(sock, track=None):
+    proc = subprocess.Popen(
+        ["mpv", track or "--idle=yes", "--no-config", "--no-video", "--ao=null", f"--input-ipc-server={sock}"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    for _ in range(100):
+        if os.path.exists(sock):
+            return proc
+        time.sleep(0.05)
+    proc.terminate()
+    raise RuntimeError("mpv IPC socket not created")
+
+def _answered(result):
+    if isinstance(result, (tuple, list)):
+        return all(r is not None for r in result)
+    return result is not None
+
+def _measure(run, count, expect_reply):
+    """Per-command latency (ms), socket calls per command and lost replies over count runs"""
+    run()  # warm-up
+    _calls.clear()
+    times = np.zeros(count)
+    lost = 0
+    clock = time.perf_counter
+    for i in range(count):
+        start = clock()
+        result = run()
+        times[i] = clock() - start
+        if expect_reply and not _answered(result):
+            lost += 1
+    ms = times * 1000.0
+    return {
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "calls_per_command": {name: n / count for name, n in sorted(_calls.items())},
+        "syscalls_per_command": sum(_calls.values()) / count,
+        # e.g. an mpv event read in place of the reply
+        "lost_replies": lost,
+    }
+
+def run(count=1000):
+    """Time each command pattern with the one-shot helpers and with MpvClient"""
+    sock = os.path.join(tempfile.mkdtemp(prefix="mpv_bench_"), "mpv.sock")
+    original = socket.socket
+    socket.socket = _CountingSocket
+    proc = _start_mpv(sock)
+    client = MpvClient(sock)
+    try:
+        client.connect()
+        # The reader thread's first (blocking) recv belongs to setup, not to any command
+        time.sleep(0.05)
+        volume = [0]
+
+        def next_volume():
+            volume[0] = (volume[0] + 1) % 100
+            return volume[0]
+
+        patterns = {
+            "get_property": (
+                lambda: _oneshot_get(sock, "volume"),
+                lambda: client.get("volume"),
+            ),
+            "set_property": (
+                lambda: _oneshot_send(sock, {"command": ["set_property", "volume", next_volume()]}),
+                lambda: client.set("volume", next_volume()),
+            ),
+            "get_two": (
+                lambda: (_oneshot_get(sock, "volume"), _oneshot_get(sock, "speed")),
+                lambda: client.pipeline([("get_property", "volume"), ("get_property", "speed")]),
+            ),
+        }
+        report = {}
+        for name, (oneshot, persistent) in patterns.items():
+            expect_reply = name != "set_property"
+            report[name] = {
+                "oneshot": _measure(oneshot, count, expect_reply),
+                "client": _measure(persistent, count, expect_reply),
+            }
+        # Let fire-and-forget replies drain before the counters go away
+        client.get("volume")
+    finally:
+        client.close()
+        proc.terminate()
+        proc.wait()
+        socket.socket = original
+        if os.path.exists(sock):
+            os.remove(sock)
+        os.rmdir(os.path.dirname(sock))
+    return {"count": count, "commands": report}
+
+def _connect(proc, sock):
+    client = MpvClient(sock)
+    if not client.connect():
+        proc.terminate()
+        proc.wait()
+        raise RuntimeError("mpv IPC socket not accepting connections")
+    return proc, client
+
+def _until_playing(client, timeout=5.0):
+    deadline = time.perf_counter() + timeout
+    while client.get("time-pos") is None:
+        if time.perf_counter() > deadline:
+            raise RuntimeError("mpv did not start playing")
+        time.sleep(0.002)
+
+def _stop(proc, client):
+    client.close()
+    proc.terminate()
+    proc.wait()
+
+def run_starts(count=20):
+    """Time track starts: spawn mpv on the file, against loadfile on a warm pooled player"""
+    folder = tempfile.mkdtemp(prefix="mpv_bench_")
+    track = os.path.join(folder, "silence.wav")
+    with wave.open(track, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(8000)
+        w.writeframes(b"\0\0" * 8000 * 5)
+    socks = (os.path.join(folder, f"mpv_{i}.sock") for i in itertools.count())
+
+    def spawn_idle():
+        sock = next(socks)
+        return _connect(_start_mpv(sock, "--idle=once"), sock)
+
+    pool = MpvPool(spawn_idle, size=2)
+    try:
+        spawn_times = np.zeros(count)
+        for i in range(count):
+            start = time.perf_counter()
+            sock = next(socks)
+            proc, client = _connect(_start_mpv(sock, track), sock)
+            _until_playing(client)
+            spawn_times[i] = time.perf_counter() - start
+            _stop(proc, client)
+
+        pool.start()
+        pool_times = np.zeros(count)
+        for i in range(count):
+            while pool.ready < pool.size:  # steady state: the pool had time to refill
+                time.sleep(0.01)
+            start = time.perf_counter()
+            proc, client = pool.acquire()
+            client.send("loadfile", track, "replace")
+            _until_playing(client)
+            pool_times[i] = time.perf_counter() - start
+            _stop(proc, client)
+    finally:
+        pool.close()
+        for name in os.listdir(folder):
+            os.remove(os.path.join(folder, name))
+        os.rmdir(folder)
+
+    report = {}
+    for name, times in (("spawn", spawn_times), ("pool", pool_times)):
+        ms = times * 1000.0
+        report[name] = {
+            "mean_ms": float(ms.mean()),
+            "p50_ms": float(np.percentile(ms, 50)),
+            "p99_ms": float(np.percentile(ms, 99)),
+        }
+    return {"count": count, "helpers": report}
+
+# =========================
+# REPORT
+# =========================
+def format_table(report):
+    header = f"{'command':<14}{'helper':<9}{'mean':>8}{'p50':>8}{'p99':>8}{'syscalls':>10}{'lost':>6}  calls per command"
+    lines = [f"{report['count']} commands per pattern, latency in ms", header, "-" * len(header)]
+    for name, results in report["commands"].items():
+        for helper, r in results.items():
+            calls = ", ".join(f"{call} {n:.2f}" for call, n in r["calls_per_command"].items())
+            lines.append(
+                f"{name:<14}{helper:<9}{r['mean_ms']:>8.3f}{r['p50_ms']:>8.3f}{r['p99_ms']:>8.3f}"
+                f"{r['syscalls_per_command']:>10.2f}{r['lost_replies']:>6}  {calls}"
+            )
+    return "\n".join(lines)
+
+def format_starts(starts):
+    lines = [f"{starts['count']} track starts, ms until mpv reports a position"]
+    for helper, r in starts["helpers"].items():
+        lines.append(f"{'start':<14}{helper:<9}{r['mean_ms']:>8.3f}{r['p50_ms']:>8.3f}{r['p99_ms']:>8.3f}")
+    return "\n".join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark mpv IPC: persistent client against a connection per command")
+    parser.add_argument("--count", type=int, default=1000, help="commands per pattern and helper")
+    parser.add_argument("--starts", type=int, default=20, help="track starts per helper (0 skips them)")
+    parser.add_argument("--json", metavar="PATH", help="also write the report as JSON ('-' for stdout)")
+    args = parser.parse_args(argv)
+
+    report = run(args.count)
+    if args.starts:
+        report["starts"] = run_starts(args.starts)
+    if args.json == "-":
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        print(format_table(report))
+        if args.starts:
+            print()
+            print(format_starts(report["starts"]))
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(report, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,210 @@
+"""Decoded-PCM cache for the audio library
+
+Files are decoded once into raw interleaved float32 at a fixed rate and
+channel count, one cache file per (path, size, mtime), and read back through
+np.memmap: every reader shares the page cache instead of holding its own
+decoded copy. The cache directory is kept under a byte budget by evicting the
+least recently used files; a file's mtime records its last use, so the order
+survives restarts. Mappings stay valid when their file is evicted.
+"""
+import hashlib
+import math
+import os
+import subprocess
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from scipy.io import wavfile
+from scipy.signal import resample_poly
+
+try:
+    import soundfile as sf
+except (ImportError, OSError):  # libsndfile missing: WAV through scipy, the rest through mpv
+    sf = None
+
+SAMPLE_RATE = 48000
+CHANNELS = 2
+CACHE_EXT = ".f32"
+DECODE_TIMEOUT = 120  # seconds for one mpv decode
+
+
+# =========================
+# DECODING
+# =========================
+def _decode_mpv(path, out, sample_rate, channels):
+    """Decode path straight into out (raw float32) with mpv's untimed PCM output"""
+    layout = {1: "mono", 2: "stereo"}.get(channels, str(channels))
+    result = subprocess.run(
+        [
+            "mpv", path, "--no-config", "--no-video", "--really-quiet",
+            "--ao=pcm", f"--ao-pcm-file={out}", "--ao-pcm-waveheader=no",
+            "--audio-format=float", f"--audio-samplerate={sample_rate}", f"--audio-channels={layout}",
+        ],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=DECODE_TIMEOUT,
+    )
+    if result.returncode != 0 or not os.path.exists(out):
+        raise RuntimeError(f"mpv could not decode {os.path.basename(path)}")
+
+
+def decode(path, sample_rate=SAMPLE_RATE, channels=CHANNELS):
+    """(frames, channels) float32 at sample_rate; mono is spread to every channel, extra channels dropped"""
+    if sf is not None:
+        data, rate = sf.read(path, dtype="float32", always_2d=True)
+    elif path.lower().endswith(".wav"):
+        rate, data = wavfile.read(path)
+        if data.dtype.kind in "iu":
+            scale = float(np.iinfo(data.dtype).max) + 1.0
+            offset = scale if data.dtype.kind == "u" else 0.0
+            data = (data.astype(np.float32) - offset) / scale
+        data = data.astype(np.float32, copy=False)
+        if data.ndim == 1:
+            data = data[:, None]
+    else:
+        raise RuntimeError(f"Decoding {os.path.basename(path)} needs the soundfile package")
+
+    if rate != sample_rate:
+        g = math.gcd(int(rate), int(sample_rate))
+        data = resample_poly(data, sample_rate // g, int(rate) // g, axis=0)
+    if data.shape[1] < channels:
+        data = np.repeat(data[:, :1], channels, axis=1)
+    return np.ascontiguousarray(data[:, :channels], dtype=np.float32)
+
+
+def _decode_to(path, out, sample_rate, channels):
+    try:
+        decode(path, sample_rate, channels).tofile(out)
+    except Exception:
+        # mp3/ogg without a capable libsndfile: mpv decodes everything it plays
+        _decode_mpv(path, out, sample_rate, channels)
+
+# =========================
+# CACHE
+# =========================
+class PcmCache:
+    """Decoded audio files as read-only np.memmap arrays of shape (frames, channels)"""
+
+    def __init__(self, root, budget_bytes, sample_rate=SAMPLE_RATE, channels=CHANNELS):
+        self.root = root
+        self.budget_bytes = budget_bytes
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._decoding = {}  # cache key -> Event, set once that decode finished
+        os.makedirs(root, exist_ok=True)
+
+        # key -> size in bytes, least recently used first
+        self._index = OrderedDict()
+        entries = []
+        for name in os.listdir(root):
+            full = os.path.join(root, name)
+            if name.endswith(CACHE_EXT):
+                st = os.stat(full)
+                entries.append((st.st_mtime, name[:-len(CACHE_EXT)], st.st_size))
+            elif name.endswith(".part"):
+                os.remove(full)  # a decode cut short by a restart
+        for _, key, size in sorted(entries):
+            self._index[key] = size
+
+    def _key(self, path):
+        st = os.stat(path)
+        ident = f"{os.path.abspath(path)}|{st.st_size}|{st.st_mtime_ns}|{self.sample_rate}|{self.channels}"
+        return hashlib.sha1(ident.encode()).hexdigest()
+
+    def _file(self, key):
+        return os.path.join(self.root, key + CACHE_EXT)
+
+    def get(self, path):
+        """np.memmap of path's decoded PCM, decoding it first on a miss"""
+        key = self._key(path)
+        while True:
+            with self._lock:
+                if key in self._index:
+                    self._index.move_to_end(key)
+                    self.hits += 1
+                    hit = True
+                    break
+                waiting = self._decoding.get(key)
+                if waiting is None:
+                    self._decoding[key] = threading.Event()
+                    self.misses += 1
+                    hit = False
+                    break
+            waiting.wait()  # another thread is decoding the same file
+
+        if hit:
+            try:
+                os.utime(self._file(key))
+                return self._open(key)
+            except FileNotFoundError:  # removed behind the cache's back
+                with self._lock:
+                    self._index.pop(key, None)
+                return self.get(path)
+
+        try:
+            fd, tmp = tempfile.mkstemp(dir=self.root, suffix=".part")
+            os.close(fd)
+            try:
+                _decode_to(path, tmp, self.sample_rate, self.channels)
+                os.replace(tmp, self._file(key))
+            finally:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+            with self._lock:
+                self._index[key] = os.path.getsize(self._file(key))
+                self._evict(keep=key)
+        finally:
+            with self._lock:
+                self._decoding.pop(key).set()
+        return self._open(key)
+
+    def _open(self, key):
+        path = self._file(key)
+        frames = os.path.getsize(path) // (4 * self.channels)
+        if frames == 0:  # np.memmap cannot map an empty file
+            return np.zeros((0, self.channels), dtype=np.float32)
+        return np.memmap(path, dtype=np.float32, mode="r", shape=(frames, self.channels))
+
+    def _evict(self, keep):
+        """Drop least recently used files until the cache fits its budget; caller holds _lock"""
+        total = sum(self._index.values())
+        for key in list(self._index):
+            if total <= self.budget_bytes:
+                break
+            if key == keep:
+                continue
+            total -= self._index.pop(key)
+            self.evictions += 1
+            try:
+                os.remove(self._file(key))
+            except FileNotFoundError:
+                pass
+
+    def warm(self, paths):
+        """Decode paths ahead of their first use; returns the ones that failed"""
+        failed = []
+        for path in paths:
+            try:
+                self.get(path)
+            except Exception:
+                failed.append(path)
+        return failed
+
+    def stats(self):
+        with self._lock:
+            files = len(self._index)
+            size = sum(self._index.values())
+        lookups = self.hits + self.misses
+        return {
+            "files": files,
+            "bytes": size,
+            "budget_bytes": self.budget_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,199 @@
+"""Offline rendering of audio files through voice presets from effects.json.
+
+Every (file, preset) pair runs in its own worker process; results land in
+data/fx/<preset>/ so they show up under /tracks/fx:
+
+    python -m src.render recordings/npc --preset demon --preset ghost
+    python -m src.render recordings/npc --preset demon --workers 4 --tail 2
+"""
+import argparse
+import multiprocessing as mp
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from scipy.io import wavfile
+
+from .dsp import build_chain
+from .modulator import DATA_DIR, list_custom_presets, _normalize_params
+
+try:
+    import soundfile as sf
+except (ImportError, OSError):  # libsndfile missing: WAV only, through scipy
+    sf = None
+
+FX_DIR = os.path.join(DATA_DIR, "fx")
+RENDER_EXTENSIONS = (".wav", ".flac")
+# Chains give the same output for any block size, so offline runs use big blocks
+RENDER_BLOCK_SIZE = 65536
+RENDER_TAIL_SECONDS = 1.0  # silence appended so delay and reverb ring out
+
+# =========================
+# FILE I/O
+# =========================
+def _read(path):
+    """(float32 frames x channels, sample_rate, soundfile subtype or None)"""
+    if sf is not None:
+        info = sf.info(path)
+        data, sample_rate = sf.read(path, dtype="float32", always_2d=True)
+        return data, sample_rate, info.subtype
+    if not path.lower().endswith(".wav"):
+        raise RuntimeError(f"Reading {os.path.basename(path)} needs the soundfile package")
+    sample_rate, data = wavfile.read(path)
+    if data.dtype.kind in "iu":
+        scale = float(np.iinfo(data.dtype).max) + 1.0
+        offset = scale if data.dtype.kind == "u" else 0.0
+        data = (data.astype(np.float32) - offset) / scale
+    data = data.astype(np.float32, copy=False)
+    if data.ndim == 1:
+        data = data[:, None]
+    return data, sample_rate, None
+
+
+def _write(path, data, sample_rate, subtype):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".part"
+    if sf is not None:
+        sf.write(tmp, data, sample_rate, subtype=subtype, format=os.path.splitext(path)[1][1:])
+    else:
+        wavfile.write(tmp, sample_rate, data)
+    os.replace(tmp, path)
+
+# =========================
+# RENDERING
+# =========================
+def render_signal(data, params, sample_rate, tail_seconds=RENDER_TAIL_SECONDS, block_size=RENDER_BLOCK_SIZE):
+    """Run every channel of data through its own chain for params
+
+    The result equals the live stream's output, sample for sample, shifted
+    earlier by the chain latency (pitch lookahead) so it lines up with the input.
+    """
+    params = _normalize_params(params)
+    chain = build_chain(params, sample_rate, block_size)
+    if chain is None:
+        return data.copy()
+
+    frames, channels = data.shape
+    tail = int(tail_seconds * sample_rate)
+    out = np.zeros((frames + tail, channels), dtype=np.float32)
+    for ch in range(channels):
+        if ch:
+            chain = build_chain(params, sample_rate, block_size)
+        latency = chain.latency
+        x = np.zeros(frames + tail + latency, dtype=np.float32)
+        x[:frames] = data[:, ch]
+        y = chain.process(x, np.zeros_like(x))
+        out[:, ch] = y[latency:]
+    return out
+
+
+def render_file(src, dst, params, tail_seconds=RENDER_TAIL_SECONDS):
+    """Render one file through params into dst; returns a summary dict"""
+    start = time.perf_counter()
+    data, sample_rate, subtype = _read(src)
+    out = render_signal(data, params, sample_rate, tail_seconds)
+    _write(dst, out, sample_rate, subtype)
+    return {
+        "source": src,
+        "output": dst,
+        "seconds": round(len(out) / sample_rate, 3),
+        "render_s": round(time.perf_counter() - start, 3),
+    }
+
+
+def _check_preset_name(name):
+    # Names become directories under out_dir
+    if not name or ".." in name or "/" in name or "\\" in name:
+        raise ValueError(f"Invalid preset name '{name}'")
+
+
+def _within(path, root):
+    """path (relative ones taken from root) resolved through symlinks; ValueError if it leaves root"""
+    root = os.path.realpath(root)
+    resolved = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([resolved, root]) != root:
+        raise ValueError(f"'{path}' is outside {root}")
+    return resolved
+
+
+def _find_files(src_dir):
+    files = []
+    for dirpath, _, filenames in os.walk(src_dir):
+        for name in sorted(filenames):
+            if name.lower().endswith(RENDER_EXTENSIONS):
+                files.append(os.path.join(dirpath, name))
+    return sorted(files)
+
+
+def render_directory(src_dir, presets, out_dir=FX_DIR, workers=None, tail_seconds=RENDER_TAIL_SECONDS, root=None):
+    """Render every WAV/FLAC under src_dir through each named preset, one process per job
+
+    Output keeps the relative path: <out_dir>/<preset>/<relative path>.
+    With root set (requests from the API), src_dir and out_dir must lie under it.
+    """
+    if root is not None:
+        src_dir = _within(src_dir, root)
+        out_dir = _within(out_dir, root)
+    for name in presets:
+        _check_preset_name(name)
+    if not os.path.isdir(src_dir):
+        raise ValueError(f"Directory '{src_dir}' not found")
+    available = list_custom_presets()
+    for name in presets:
+        if name not in available:
+            raise ValueError(f"Preset '{name}' not found")
+
+    files = _find_files(src_dir)
+    jobs = [
+        (src, os.path.join(out_dir, name, os.path.relpath(src, src_dir)), available[name] or {})
+        for name in presets
+        for src in files
+    ]
+
+    start = time.perf_counter()
+    results, errors = [], []
+    if jobs:
+        # spawn, not fork: the server calling this has audio and mpv threads running
+        with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context("spawn")) as pool:
+            futures = {pool.submit(render_file, src, dst, params, tail_seconds): src for src, dst, params in jobs}
+            for future in as_completed(futures):
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    errors.append({"source": futures[future], "error": str(e)})
+
+    elapsed = time.perf_counter() - start
+    audio = sum(r["seconds"] for r in results)
+    return {
+        "files": len(files),
+        "presets": list(presets),
+        "rendered": sorted(results, key=lambda r: r["output"]),
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "speed": round(audio / elapsed, 1) if elapsed > 0 else None,
+    }
+
+# =========================
+# CLI
+# =========================
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render WAV/FLAC files through voice presets")
+    parser.add_argument("directory", help="directory searched recursively for .wav/.flac files")
+    parser.add_argument("--preset", action="append", required=True, help="preset name from effects.json (repeatable)")
+    parser.add_argument("--out", default=FX_DIR, help="output root; files go to <out>/<preset>/")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--tail", type=float, default=RENDER_TAIL_SECONDS, help="seconds of effect tail to keep")
+    args = parser.parse_args(argv)
+
+    report = render_directory(args.directory, args.preset, args.out, args.workers, args.tail)
+    for r in report["rendered"]:
+        print(f"{r['output']}  ({r['seconds']:.1f} s in {r['render_s']:.2f} s)")
+    for e in report["errors"]:
+        print(f"FAILED {e['source']}: {e['error']}", file=sys.stderr)
+    print(f"{len(report['rendered'])} files in {report['elapsed_s']:.1f} s ({report['speed']}x real time)")
+    return 1 if report["errors"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
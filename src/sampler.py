@@ -0,0 +1,257 @@
+"""In-process polyphonic FX sampler
+
+Clips are decoded once into float32 buffers at the stream's sample rate and
+mixed by a single output stream, so a trigger costs no process start: the
+audio thread starts the voice on its next block. POLYPHONY voices play at
+once; a trigger with every voice busy steals the oldest one, which fades out
+over that block instead of cutting off with a click.
+"""
+import os
+import threading
+import time
+
+import numpy as np
+
+from .monitor import CallbackMonitor
+from .pcm_cache import decode
+
+try:
+    import sounddevice as sd
+except OSError:  # PortAudio missing: FX fall back to mpv
+    sd = None
+
+SAMPLE_RATE = 48000
+BLOCK_SIZE = 256  # a trigger waits at most one block (5.3 ms) for the audio thread
+CHANNELS = 2
+POLYPHONY = 16
+STEAL_FADE_MS = 5  # fade-out of a stolen voice, within the block that steals it
+TRIGGER_SLOTS = 64  # triggers that can be waiting for the audio thread at once
+
+
+def output_devices():
+    """(index, name) of every PortAudio device with outputs"""
+    if sd is None:
+        return []
+    return [(i, d["name"]) for i, d in enumerate(sd.query_devices()) if d["max_output_channels"] > 0]
+
+
+class Clip:
+    """One decoded FX file: (frames, CHANNELS) float32 at the sampler's rate (an array or a memmap)"""
+
+    def __init__(self, name, data, sample_rate):
+        self.name = name
+        self.data = data
+        self.frames = len(data)
+        self.duration = self.frames / sample_rate
+
+
+class Sampler:
+    """Voices mixed by one sounddevice output stream
+
+    trigger() runs on control threads: it fills the next slot of a ring and
+    bumps a counter, and the audio thread takes every new slot at the start
+    of its next block. Voice arrays are written only by the audio thread;
+    voices() reads them without stopping it, so a reading may be one block old.
+    """
+
+    def __init__(self, sample_rate=SAMPLE_RATE, block_size=BLOCK_SIZE, polyphony=POLYPHONY, channels=CHANNELS, cache=None):
+        """cache: a PcmCache at the same rate and channels to map clips from (else they are decoded into memory)"""
+        self.sample_rate = sample_rate
+        self.cache = cache
+        self.block_size = block_size
+        self.polyphony = polyphony
+        self.channels = channels
+        self._volume = np.ones(1, dtype=np.float32)  # master gain (volume), read once per block
+        self.monitor = CallbackMonitor()
+        self.stolen = 0
+        self._stream = None
+
+        self._clips = {}  # path -> (mtime, Clip)
+        self._clips_lock = threading.Lock()
+
+        # Trigger ring: written under _trigger_lock, read by the audio thread
+        self._slots = [None] * TRIGGER_SLOTS
+        self._written = 0
+        self._taken = 0
+        self._trigger_lock = threading.Lock()
+
+        # Voices (audio thread only)
+        self._voice_clip = [None] * polyphony
+        self._voice_pos = np.zeros(polyphony, dtype=np.int64)
+        self._voice_gain = np.zeros(polyphony, dtype=np.float32)
+        self._block_gain = np.zeros(polyphony, dtype=np.float32)  # voice gain x volume, this block
+        self._voice_id = np.zeros(polyphony, dtype=np.int64)
+        self._scratch = np.zeros((block_size, channels), dtype=np.float32)
+        fade = max(1, min(block_size, int(sample_rate * STEAL_FADE_MS / 1000)))
+        self._steal_fade = np.zeros((block_size, 1), dtype=np.float32)
+        self._steal_fade[:fade, 0] = np.linspace(1.0, 0.0, fade, endpoint=False)
+
+    @property
+    def volume(self):
+        return float(self._volume[0])
+
+    @volume.setter
+    def volume(self, value):
+        self._volume[0] = value
+
+    # -------------------------
+    # Clips
+    # -------------------------
+    def load(self, path):
+        """The decoded Clip for path, decoding it on first use or after the file changed"""
+        mtime = os.path.getmtime(path)
+        with self._clips_lock:
+            cached = self._clips.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        if self.cache is not None:
+            data = self.cache.get(path)
+            # Fault every page in here, not on the audio thread's first block
+            np.add.reduce(data[::max(1, 4096 // data.itemsize // self.channels), 0])
+        else:
+            data = decode(path, self.sample_rate, self.channels)
+        clip = Clip(path, data, self.sample_rate)
+        with self._clips_lock:
+            self._clips[path] = (mtime, clip)
+        return clip
+
+    def preload(self, paths):
+        """Decode paths ahead of their first trigger; returns the ones that failed"""
+        failed = []
+        for path in paths:
+            try:
+                self.load(path)
+            except Exception:
+                failed.append(path)
+        return failed
+
+    # -------------------------
+    # Stream
+    # -------------------------
+    @property
+    def running(self):
+        return self._stream is not None
+
+    def start(self, device=None):
+        if self._stream is not None:
+            return
+        if sd is None:
+            raise RuntimeError("sounddevice unavailable: PortAudio library not found")
+        stream = sd.OutputStream(
+            samplerate=self.sample_rate,
+            blocksize=self.block_size,
+            latency="low",
+            dtype="float32",
+            channels=self.channels,
+            device=device,
+            callback=self._callback,
+        )
+        stream.start()
+        self._stream = stream
+
+    def close(self):
+        stream, self._stream = self._stream, None
+        if stream is not None:
+            stream.stop()
+            stream.close()
+
+    # -------------------------
+    # Control threads
+    # -------------------------
+    def trigger(self, clip, gain=1.0):
+        """Queue clip to start on the next block; returns the voice id"""
+        with self._trigger_lock:
+            if self._written - self._taken >= TRIGGER_SLOTS:
+                raise RuntimeError("FX sampler is not keeping up with triggers")
+            voice_id = self._written + 1
+            self._slots[self._written % TRIGGER_SLOTS] = (clip, float(gain), voice_id)
+            self.monitor.note_switch(os.path.basename(clip.name))
+            self._written = voice_id
+        return voice_id
+
+    @property
+    def pending(self):
+        """Triggers the audio thread has not taken yet"""
+        return self._written - self._taken
+
+    def voices(self):
+        """Active voices, oldest first: id, clip name, position and duration (s), gain"""
+        rate = self.sample_rate
+        active = []
+        for v in range(self.polyphony):
+            clip = self._voice_clip[v]
+            if clip is not None:
+                active.append({
+                    "id": int(self._voice_id[v]),
+                    "track": clip.name,
+                    "position": round(int(self._voice_pos[v]) / rate, 3),
+                    "duration": round(clip.duration, 3),
+                    "gain": float(self._voice_gain[v]),
+                })
+        return sorted(active, key=lambda voice: voice["id"])
+
+    def stats(self):
+        stats = self.monitor.snapshot()
+        stats["triggers"] = stats.pop("switches")
+        stats["triggers"]["stolen"] = self.stolen
+        stats.update({
+            "polyphony": self.polyphony,
+            "block_size": self.block_size,
+            "active": len(self.voices()),
+            "clips": len(self._clips),
+        })
+        return stats
+
+    # -------------------------
+    # Audio thread
+    # -------------------------
+    def _start_voice(self, out, frames, clip, gain, voice_id):
+        clips = self._voice_clip
+        free = -1
+        for v in range(self.polyphony):
+            if clips[v] is None:
+                free = v
+                break
+        if free < 0:
+            # Steal the oldest voice: render its last block under a fade-out
+            free = int(np.argmin(self._voice_id))
+            self._mix(out, frames, free, self._steal_fade[:frames])
+            self.stolen += 1
+        clips[free] = clip
+        self._voice_pos[free] = 0
+        self._voice_gain[free] = gain
+        self._block_gain[free] = self._voice_gain[free] * self._volume[0]
+        self._voice_id[free] = voice_id
+
+    def _mix(self, out, frames, v, envelope=None):
+        """Add voice v's next block into out; returns False once the clip has ended"""
+        clip = self._voice_clip[v]
+        pos = int(self._voice_pos[v])
+        n = min(frames, clip.frames - pos)
+        scratch = self._scratch[:n]
+        # float32 gain: a float64 one would cast the whole block through a temporary
+        np.multiply(clip.data[pos:pos + n], self._block_gain[v], out=scratch)
+        if envelope is not None:
+            np.multiply(scratch, envelope[:n], out=scratch)
+        np.add(out[:n], scratch, out=out[:n])
+        self._voice_pos[v] = pos + n
+        return pos + n < clip.frames
+
+    def _callback(self, outdata, frames, time_info, status):
+        start = time.perf_counter()
+        outdata.fill(0.0)
+        np.multiply(self._voice_gain, self._volume[0], out=self._block_gain)
+
+        written = self._written
+        while self._taken < written:
+            clip, gain, voice_id = self._slots[self._taken % TRIGGER_SLOTS]
+            self._start_voice(outdata, frames, clip, gain, voice_id)
+            self._taken += 1
+
+        clips = self._voice_clip
+        for v in range(self.polyphony):
+            if clips[v] is not None and not self._mix(outdata, frames, v):
+                clips[v] = None
+        np.clip(outdata, -1.0, 1.0, out=outdata)
+
+        self.monitor.record(start, time.perf_counter(), frames, self.sample_rate, status, self._taken)
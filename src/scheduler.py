@@ -0,0 +1,185 @@
+"""One thread for every timed job of audio playback: volume ramps, fades, crossfades and loop transitions"""
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+RAMP_INTERVAL = 0.05  # seconds between two steps of a running ramp
+WORKERS = 2  # threads for due jobs, which may block (IPC round trips, mpv start-up)
+RAMP_WORKERS = 2  # threads for ramp steps only, so blocked jobs never hold up a fade
+
+
+def _notify(callback, *args):
+    # A failing job must not take the scheduler down with it
+    try:
+        callback(*args)
+    except Exception:
+        pass
+
+
+class Job:
+    def __init__(self, fn, args):
+        self.fn = fn
+        self.args = args
+        self.cancelled = False
+
+
+class Ramp:
+    """A value moving linearly from start to end over seconds, read from the clock at every step"""
+
+    def __init__(self, apply, start, end, seconds, done):
+        self.apply = apply
+        self.start = start
+        self.end = end
+        self.seconds = seconds
+        self.done = done
+        self.started = time.monotonic()
+
+    def value(self, now):
+        if self.seconds <= 0:
+            return self.end
+        t = min(1.0, (now - self.started) / self.seconds)
+        return self.start + (self.end - self.start) * t
+
+    def finished(self, now):
+        return now - self.started >= self.seconds
+
+
+class Scheduler:
+    """Timer thread with cancel-and-replace ramps
+
+    call_later() jobs are handed to a fixed pool of WORKERS threads when due,
+    so they may block. Ramp steps go to a pool of their own every
+    RAMP_INTERVAL, at most one in flight per key, so neither blocked jobs nor
+    a player that is slow to take a value hold back the timer thread or other
+    keys. Each key has at most one ramp: a new ramp for the key replaces the
+    running one where it stands.
+    The thread count stays the same however many jobs and ramps come in.
+    """
+
+    def __init__(self, interval=RAMP_INTERVAL, workers=WORKERS, ramp_workers=RAMP_WORKERS, name="audio-scheduler"):
+        self.interval = interval
+        self.name = name
+        self._cond = threading.Condition()
+        self._jobs = []  # heap of (due, seq, Job)
+        self._seq = itertools.count()
+        self._ramps = {}  # key -> Ramp
+        self._stepping = set()  # keys with a step handed to the ramp pool
+        self._applying = set()  # keys whose apply() is running right now
+        self._next_step = 0.0
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix=f"{name}-job")
+        self._ramp_pool = ThreadPoolExecutor(ramp_workers, thread_name_prefix=f"{name}-ramp")
+        self._thread = None
+
+    def _wake(self):
+        # caller holds _cond
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+        self._cond.notify_all()  # callers in _wait_applied() share the condition
+
+    def _submit(self, fn, *args, pool=None):
+        try:
+            (pool or self._pool).submit(_notify, fn, *args)
+        except RuntimeError:
+            pass  # interpreter shutting down
+
+    # -------------------------
+    # Jobs
+    # -------------------------
+    def call_later(self, delay, fn, *args):
+        """Run fn(*args) on a worker after delay seconds; returns a Job for cancel()"""
+        job = Job(fn, args)
+        with self._cond:
+            heapq.heappush(self._jobs, (time.monotonic() + max(0.0, delay), next(self._seq), job))
+            self._wake()
+        return job
+
+    def run(self, fn, *args):
+        """Run fn(*args) on a worker now"""
+        self._submit(fn, *args)
+
+    @staticmethod
+    def cancel(job):
+        if job is not None:
+            job.cancelled = True
+
+    # -------------------------
+    # Ramps
+    # -------------------------
+    def ramp(self, key, apply, start, end, seconds, done=None):
+        """Step apply(value) from start to end over seconds, then run done() on a worker
+
+        Replaces key's running ramp (its done() is dropped).
+        """
+        with self._cond:
+            self._wait_applied(key)
+            self._ramps[key] = Ramp(apply, start, end, seconds, done)
+            self._next_step = 0.0  # first step right away
+            self._wake()
+
+    def cancel_ramp(self, key):
+        """Stop key's ramp where it stands; once this returns it applies no further value"""
+        with self._cond:
+            self._wait_applied(key)
+            self._ramps.pop(key, None)
+
+    def _wait_applied(self, key):
+        # caller holds _cond. A step already past its check finishes first, so
+        # its value cannot land after the caller's own. A queued step is not
+        # waited for: it sees the ramp gone or replaced and drops its value.
+        while key in self._applying:
+            self._cond.wait()
+
+    def ramping(self, key):
+        with self._cond:
+            return key in self._ramps
+
+    # -------------------------
+    # Thread
+    # -------------------------
+    def _step(self, key, ramp, value, finished):
+        with self._cond:
+            current = self._ramps.get(key) is ramp
+            if current:
+                if finished:
+                    del self._ramps[key]
+                self._applying.add(key)
+        try:
+            if current:
+                _notify(ramp.apply, value)
+        finally:
+            with self._cond:
+                self._applying.discard(key)
+                self._stepping.discard(key)
+                self._cond.notify_all()
+        if current and finished and ramp.done is not None:
+            self._submit(ramp.done)  # may block: on the job pool
+
+    def _run(self):
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                while self._jobs and self._jobs[0][0] <= now:
+                    job = heapq.heappop(self._jobs)[2]
+                    if not job.cancelled:
+                        self._submit(job.fn, *job.args)
+
+                if self._ramps and now >= self._next_step:
+                    self._next_step = now + self.interval
+                    for key, ramp in self._ramps.items():
+                        # Values are read from the clock: a key whose last step is
+                        # still out skips this one and catches up on the next
+                        if key not in self._stepping:
+                            self._stepping.add(key)
+                            self._submit(self._step, key, ramp, ramp.value(now), ramp.finished(now),
+                                         pool=self._ramp_pool)
+
+                timeout = None
+                if self._jobs:
+                    timeout = max(0.0, self._jobs[0][0] - time.monotonic())
+                if self._ramps:
+                    wait = max(0.0, self._next_step - time.monotonic())
+                    timeout = wait if timeout is None else min(timeout, wait)
+                self._cond.wait(timeout)
@@ -26,11 +26,13 @@ state = {
         "track": None,
         "volume": 100,
         "position": 0.0,
-        "duration": 0.0
+        "duration": 0.0,
+        "voices": []
     },
     "modulator": {
         "effect": "off",
-        "volume": 100
+        "volume": 100,
+        "pitch_latency_ms": 0.0
     },
     "available": {
         "loop_modes": [
@@ -0,0 +1,215 @@
+"""Owner of every mpv child process: start, cap, reap, socket cleanup and resource accounting"""
+import glob
+import os
+import socket
+import subprocess
+import threading
+import time
+
+REAP_SECONDS = 1.0  # how often exits are collected when nothing is being stopped
+KILL_SECONDS = 2.0  # SIGTERM grace before SIGKILL
+
+try:
+    _CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+    _PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+except (AttributeError, ValueError, OSError):  # no sysconf: no /proc accounting either
+    _CLOCK_TICKS = _PAGE_SIZE = None
+
+
+def _proc_usage(pid):
+    """(rss bytes, cpu seconds) from /proc, or None where /proc is not available"""
+    if _CLOCK_TICKS is None:
+        return None
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as f:
+            # comm may contain spaces: the fields we want follow its closing parenthesis
+            fields = f.read().rsplit(b")", 1)[1].split()
+    except OSError:
+        return None
+    utime, stime, rss_pages = int(fields[11]), int(fields[12]), int(fields[21])
+    return rss_pages * _PAGE_SIZE, (utime + stime) / _CLOCK_TICKS
+
+
+def remove_stale_sockets(pattern):
+    """Delete IPC sockets matching pattern that nothing listens on any more; returns how many"""
+    removed = 0
+    for path in glob.glob(pattern):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+            continue  # a live mpv (perhaps another server's) still owns it
+        except OSError:
+            pass
+        finally:
+            probe.close()
+        try:
+            os.remove(path)
+            removed += 1
+        except OSError:
+            pass
+    return removed
+
+
+class _Child:
+    def __init__(self, proc, channel, sock, idle):
+        self.proc = proc
+        self.channel = channel
+        self.sock = sock
+        self.idle = idle
+        self.started = time.monotonic()
+        self.stopping = None  # monotonic time of the SIGTERM
+        self.cpu = None  # (wall, cpu seconds) at the last stats() call
+
+
+class Supervisor:
+    """Starts mpv children per channel and cleans up after them
+
+    A reaper thread waits for children that exit, by themselves or when
+    stopped, removes their IPC sockets and escalates to SIGKILL when SIGTERM
+    is not enough. At most limits[channel] children play per channel: starting
+    one more stops the oldest. Idle children (a warm pool's) do not count
+    until claimed; their number is bounded by the pool.
+    """
+
+    def __init__(self, limits):
+        self.limits = dict(limits)
+        self.reaped = 0
+        self.evicted = 0
+        self._children = {}  # pid -> _Child
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._closed = False
+
+    def spawn(self, channel, cmd, sock, idle=False):
+        """Popen cmd as a child of channel (sock: its IPC socket, removed once it exits)"""
+        proc = subprocess.Popen(cmd)
+        with self._lock:
+            self._children[proc.pid] = _Child(proc, channel, sock, idle)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._reap_loop, name="mpv-reaper", daemon=True)
+                self._thread.start()
+        if not idle:
+            self._enforce(channel, keep=proc.pid)
+        return proc
+
+    def claim(self, proc):
+        """An idle child starts playing: it counts against its channel's limit from now on"""
+        with self._lock:
+            child = self._children.get(proc.pid)
+            if child is None:
+                return
+            child.idle = False
+        self._enforce(child.channel, keep=proc.pid)
+
+    def stop(self, proc):
+        """SIGTERM proc (if still running); the reaper collects it"""
+        with self._lock:
+            child = self._children.get(proc.pid)
+            if child is not None and child.stopping is None:
+                child.stopping = time.monotonic()
+        if proc.poll() is None:
+            try:
+                proc.terminate()
+            except OSError:
+                pass
+        self._wake.set()
+
+    def close(self):
+        """Stop every child and wait for them (server shutdown)"""
+        self._closed = True
+        with self._lock:
+            children = list(self._children.values())
+        for child in children:
+            self.stop(child.proc)
+        deadline = time.monotonic() + KILL_SECONDS
+        for child in children:
+            try:
+                child.proc.wait(max(0.0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                child.proc.kill()
+                child.proc.wait()
+        self._reap()
+
+    def _enforce(self, channel, keep):
+        limit = self.limits.get(channel)
+        if not limit:
+            return
+        with self._lock:
+            playing = sorted(
+                (c for c in self._children.values()
+                 if c.channel == channel and not c.idle and c.stopping is None and c.proc.pid != keep),
+                key=lambda c: c.started,
+            )
+            excess = playing[:max(0, len(playing) + 1 - limit)]
+        for child in excess:
+            self.evicted += 1
+            self.stop(child.proc)
+
+    # -------------------------
+    # Reaper
+    # -------------------------
+    def _reap(self):
+        now = time.monotonic()
+        with self._lock:
+            children = list(self._children.values())
+        for child in children:
+            if child.proc.poll() is None:
+                if child.stopping is not None and now - child.stopping > KILL_SECONDS:
+                    child.proc.kill()
+                continue
+            with self._lock:
+                self._children.pop(child.proc.pid, None)
+            self.reaped += 1
+            if child.sock:
+                try:
+                    os.remove(child.sock)
+                except OSError:
+                    pass
+
+    def _reap_loop(self):
+        while not self._closed:
+            self._wake.wait(REAP_SECONDS)
+            self._wake.clear()
+            self._reap()
+            with self._lock:
+                stopping = any(c.stopping is not None for c in self._children.values())
+            if stopping:
+                time.sleep(0.05)  # collect terminated children promptly
+                self._wake.set()
+
+    # -------------------------
+    # Accounting
+    # -------------------------
+    def stats(self):
+        """Per channel: live processes (idle ones too), RSS and CPU use since the previous call"""
+        now = time.monotonic()
+        with self._lock:
+            children = list(self._children.values())
+        channels = {
+            channel: {"processes": 0, "idle": 0, "limit": limit, "rss_bytes": 0, "cpu_percent": 0.0}
+            for channel, limit in self.limits.items()
+        }
+        for child in children:
+            if child.proc.poll() is not None:
+                continue
+            entry = channels.setdefault(
+                child.channel, {"processes": 0, "idle": 0, "limit": None, "rss_bytes": 0, "cpu_percent": 0.0}
+            )
+            entry["processes"] += 1
+            entry["idle"] += child.idle
+            usage = _proc_usage(child.proc.pid)
+            if usage is None:
+                entry["rss_bytes"] = entry["cpu_percent"] = None
+                continue
+            rss, cpu = usage
+            since, cpu_before = child.cpu or (child.started, 0.0)
+            child.cpu = (now, cpu)
+            if entry["rss_bytes"] is not None:
+                entry["rss_bytes"] += rss
+                if now > since:
+                    entry["cpu_percent"] += 100.0 * (cpu - cpu_before) / (now - since)
+        for entry in channels.values():
+            if entry["cpu_percent"] is not None:
+                entry["cpu_percent"] = round(entry["cpu_percent"], 1)
+        return {"channels": channels, "reaped": self.reaped, "evicted": self.evicted}
@@ -0,0 +1,117 @@
+"""Steady-state audio blocks allocate no array buffers (see the DIAGNOSTICS notes in src/dsp.py)
+
+Run from the repository root:
+
+    python -m pytest tests
+"""
+import json
+import os
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from src import modulator
+from src.dsp import (
+    ALLOCATION_BLOCK_SIZES, BLOCK_GROWTH_BYTES, OBJECT_CHURN_BYTES,
+    ChainSwitcher, allocation_profile, available_backends, build_chain, get_backend, set_backend,
+)
+
+SAMPLE_RATE = modulator.SAMPLE_RATE
+PRESETS_FILE = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "effects.json")
+
+# Every stage at once, so none escapes the check
+EVERY_STAGE = {
+    "gain": 3.0, "drive": 0.5, "tone": 0.5, "mix": 0.8, "pitch": 5, "chorus": 0.5,
+    "delay": 120, "reverb": 0.5, "reverb_size": 0.6, "ring_mod": 40, "bitcrusher": 0.1,
+    "low_pass": 3000, "high_pass": 200, "tremolo": 4,
+}
+
+
+def _presets():
+    with open(PRESETS_FILE, "r", encoding="utf-8") as f:
+        presets = {name: params for name, params in json.load(f).items() if params}
+    presets["every-stage"] = EVERY_STAGE
+    return presets
+
+
+def _voice(n):
+    t = np.arange(n) / SAMPLE_RATE
+    return (0.3 * np.sin(2 * np.pi * 180 * t) + 0.1 * np.sin(2 * np.pi * 1250 * t)).astype(np.float32)
+
+
+def _switcher_block(params):
+    def make_process(n):
+        switcher = ChainSwitcher(SAMPLE_RATE, n, chain=build_chain(modulator._normalize_params(params), SAMPLE_RATE, n))
+        x, out = _voice(n), np.zeros(n, dtype=np.float32)
+        return lambda: switcher.process(x, out)
+    return make_process
+
+
+@pytest.fixture(params=available_backends())
+def backend(request):
+    previous = get_backend()
+    set_backend(request.param)
+    yield request.param
+    set_backend(previous)
+
+
+@pytest.mark.parametrize("name", sorted(_presets()))
+def test_preset_blocks_allocate_no_arrays(backend, name):
+    peaks, free = allocation_profile(_switcher_block(_presets()[name]))
+    small, large = min(ALLOCATION_BLOCK_SIZES), max(ALLOCATION_BLOCK_SIZES)
+    assert max(peaks.values()) <= OBJECT_CHURN_BYTES, peaks
+    assert peaks[large] - peaks[small] <= BLOCK_GROWTH_BYTES, peaks
+    assert free
+
+
+def test_passthrough_allocates_no_arrays():
+    def make_process(n):
+        switcher = ChainSwitcher(SAMPLE_RATE, n)
+        x, out = _voice(n), np.zeros(n, dtype=np.float32)
+        return lambda: switcher.process(x, out)
+    peaks, free = allocation_profile(make_process)
+    assert free, peaks
+
+
+def test_audio_callback_allocates_no_arrays():
+    """The whole callback: de-interleave, chain, routing matmul and clip into outdata"""
+    block_size = modulator._block_size
+    switchers = modulator._switchers
+
+    def make_process(n):
+        modulator._set_block_size(n)
+        for switcher in modulator._switchers:
+            switcher.post(build_chain(modulator._normalize_params(EVERY_STAGE), SAMPLE_RATE, n))
+        modulator._update_routing()
+        indata = np.repeat(_voice(n)[:, None], modulator.CHANNELS, axis=1)
+        outdata = np.zeros((n, modulator.OUTPUT_CHANNELS), dtype=np.float32)
+        return lambda: modulator._audio_callback(indata, outdata, n, None, 0)
+
+    try:
+        peaks, free = allocation_profile(make_process)
+    finally:
+        modulator._block_size = block_size
+        modulator._switchers = switchers
+        modulator._set_block_size(block_size)
+    assert free, peaks
+
+
+def test_blocks_do_not_accumulate_memory():
+    n = 1024
+    process = _switcher_block(EVERY_STAGE)(n)
+    for _ in range(50):
+        process()
+    tracemalloc.start()
+    try:
+        # The first traced blocks replace state objects created before tracing started
+        for _ in range(50):
+            process()
+        before = tracemalloc.get_traced_memory()[0]
+        for _ in range(500):
+            process()
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    # Carried ints and floats change size now and then; one object kept per block would be ~15 KB
+    assert after - before < 256